@@ -0,0 +1,253 @@
+"""
+Búsqueda de disponibilidad de villas
+Matriz de ocupación en memoria (villa x franja de 30 minutos) con sumas acumuladas:
+saber si una villa está libre en una ventana es una resta, y se resuelven todas
+las villas y todos los días del rango con una sola operación de NumPy.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import PyMongoError
+import asyncio
+import logging
+import math
+import os
+
+import numpy as np
+
+from backend.booking_service import window_minutes
+
+logger = logging.getLogger(__name__)
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+PAST_DAYS = 2  # amanecidas de días anteriores que aún ocupan el primer día
+HORIZON_DAYS = int(os.environ.get("AVAILABILITY_HORIZON_DAYS", "400"))
+REFRESH_SECONDS = int(os.environ.get("AVAILABILITY_REFRESH_SECONDS", "300"))
+MAX_SEARCH_DAYS = 180
+
+# Horario usado para la búsqueda cuando no se indican horas
+RENTAL_TYPE_WINDOWS = {
+    "pasadia": ("9:00 AM", "8:00 PM"),
+    "amanecida": ("9:00 AM", "8:00 AM"),  # termina al día siguiente
+    "evento": ("9:00 AM", "8:00 PM"),
+}
+
+VILLA_FIELDS = {"_id": 0, "id": 1, "code": 1, "name": 1, "max_guests": 1, "category_id": 1, "is_active": 1}
+RESERVATION_FIELDS = {
+    "_id": 0, "id": 1, "villa_id": 1, "reservation_date": 1,
+    "check_in_time": 1, "check_out_time": 1, "status": 1,
+}
+
+
+class AvailabilityIndex:
+    """Occupancy of every villa from PAST_DAYS ago to HORIZON_DAYS ahead, in 30-minute slots.
+
+    Cada worker mantiene su propia copia: las reservaciones que cambian en este
+    worker se aplican al momento y una reconstrucción periódica recoge las de
+    los demás workers (y mueve la ventana de fechas).
+    """
+
+    def __init__(self):
+        self.origin: Optional[date] = None
+        self.villas: List[dict] = []
+        self.villa_index: Dict[str, int] = {}
+        self.max_guests = np.zeros(0, dtype=np.int32)
+        self.is_active = np.zeros(0, dtype=bool)
+        self.category_ids = np.zeros(0, dtype=object)
+        self.occupancy = np.zeros((0, 0), dtype=np.uint16)  # reservaciones por franja
+        self.bookings: Dict[str, Tuple[int, int, int]] = {}  # reservation_id -> (villa, desde, hasta)
+        self._prefix: Optional[np.ndarray] = None
+        self._dirty_rows: set = set()
+        self._rebuilding = False
+        self._pending: List[Tuple[str, object]] = []
+        self._rebuild_lock = asyncio.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.origin is not None
+
+    # ---------- construcción ----------
+
+    async def rebuild(self, db: AsyncIOMotorDatabase) -> None:
+        """Load villas and upcoming reservations and swap in a fresh matrix.
+
+        Las reconstrucciones (periódica y tras cambiar una villa) van una a la vez:
+        si se solaparan, una borraría los cambios pendientes de la otra o
+        instalaría una copia más vieja.
+        """
+        async with self._rebuild_lock:
+            await self._rebuild(db)
+
+    async def _rebuild(self, db: AsyncIOMotorDatabase) -> None:
+        self._rebuilding = True
+        self._pending = []
+        try:
+            origin = datetime.now(timezone.utc).date() - timedelta(days=PAST_DAYS)
+            start = datetime.combine(origin, datetime.min.time(), tzinfo=timezone.utc)
+            villas = await db.villas.find({}, VILLA_FIELDS).to_list(None)
+            reservations = await db.reservations.find(
+                {
+                    "reservation_date": {"$gte": start, "$lt": start + timedelta(days=HORIZON_DAYS)},
+                    "status": {"$ne": "cancelled"},
+                },
+                RESERVATION_FIELDS
+            ).to_list(None)
+
+            self.origin = origin
+            self.villas = villas
+            self.villa_index = {v["id"]: i for i, v in enumerate(villas)}
+            self.max_guests = np.array([v.get("max_guests") or 0 for v in villas], dtype=np.int32)
+            self.is_active = np.array([v.get("is_active", True) for v in villas], dtype=bool)
+            self.category_ids = np.array([v.get("category_id") for v in villas], dtype=object)
+            self.occupancy = np.zeros((len(villas), HORIZON_DAYS * SLOTS_PER_DAY), dtype=np.uint16)
+            self.bookings = {}
+            self._prefix = None
+            self._dirty_rows = set()
+            for reservation in reservations:
+                self._add(reservation)
+        finally:
+            self._rebuilding = False
+            pending, self._pending = self._pending, []
+
+        # Cambios hechos en este worker mientras se leía la base de datos
+        for op, value in pending:
+            if op == "apply":
+                self.apply_reservation(value)
+            else:
+                self.remove_reservation(value)
+        logger.info(f"Índice de disponibilidad: {len(self.villas)} villas, {len(self.bookings)} reservaciones")
+
+    # ---------- cambios incrementales ----------
+
+    def _slots(self, reservation: dict) -> Optional[Tuple[int, int, int]]:
+        villa = self.villa_index.get(reservation.get("villa_id"))
+        reservation_date = reservation.get("reservation_date")
+        if villa is None or not isinstance(reservation_date, datetime):
+            return None
+        start, end = window_minutes(reservation.get("check_in_time"), reservation.get("check_out_time"))
+        day = (reservation_date.date() - self.origin).days
+        first = day * SLOTS_PER_DAY + start // SLOT_MINUTES
+        last = day * SLOTS_PER_DAY + math.ceil(end / SLOT_MINUTES)
+        first, last = max(first, 0), min(last, self.occupancy.shape[1])
+        if first >= last:
+            return None
+        return villa, first, last
+
+    def _add(self, reservation: dict) -> None:
+        slots = self._slots(reservation)
+        if slots is None:
+            return
+        villa, first, last = slots
+        self.occupancy[villa, first:last] += 1
+        self.bookings[reservation["id"]] = slots
+        self._dirty_rows.add(villa)
+
+    def _remove(self, reservation_id: str) -> None:
+        slots = self.bookings.pop(reservation_id, None)
+        if slots is None:
+            return
+        villa, first, last = slots
+        self.occupancy[villa, first:last] -= 1
+        self._dirty_rows.add(villa)
+
+    def remove_reservation(self, reservation_id: str) -> None:
+        """Free the slots held by a reservation (deleted or cancelled)"""
+        if self._rebuilding:
+            self._pending.append(("remove", reservation_id))
+        self._remove(reservation_id)
+
+    def apply_reservation(self, reservation: dict) -> None:
+        """Record a created or updated reservation"""
+        if self._rebuilding:
+            self._pending.append(("apply", reservation))
+        if not self.ready:
+            return
+        self._remove(reservation["id"])
+        if reservation.get("status") != "cancelled":
+            self._add(reservation)
+
+    # ---------- búsqueda ----------
+
+    def _prefix_sums(self) -> np.ndarray:
+        # Franjas ocupadas acumuladas por villa; tras un cambio solo se recalcula la fila de esa villa
+        if self._prefix is None:
+            self._prefix = np.zeros((self.occupancy.shape[0], self.occupancy.shape[1] + 1), dtype=np.int32)
+            self._dirty_rows = set(range(self.occupancy.shape[0]))
+        for row in self._dirty_rows:
+            np.cumsum(self.occupancy[row] > 0, out=self._prefix[row, 1:])
+        self._dirty_rows = set()
+        return self._prefix
+
+    def search(
+        self,
+        start_date: date,
+        days: int,
+        check_in_time: str,
+        check_out_time: str,
+        guests: int = 0,
+        category_id: Optional[str] = None,
+        is_active: Optional[bool] = True,
+    ) -> List[dict]:
+        """Villas free in the given daily window on at least one day of the range, with their free dates"""
+        first_day = (start_date - self.origin).days
+        start, end = window_minutes(check_in_time, check_out_time)
+        day_offsets = np.arange(first_day, first_day + days) * SLOTS_PER_DAY
+        starts = day_offsets + start // SLOT_MINUTES
+        ends = np.minimum(day_offsets + math.ceil(end / SLOT_MINUTES), self.occupancy.shape[1])
+
+        mask = self.max_guests >= guests
+        if category_id is not None:
+            mask &= self.category_ids == category_id
+        if is_active is not None:
+            mask &= self.is_active == is_active
+        rows = np.flatnonzero(mask)
+
+        # Solo se leen las columnas de inicio y fin de cada día: villas x días
+        prefix = self._prefix_sums()
+        free = (prefix[rows[:, np.newaxis], ends] - prefix[rows[:, np.newaxis], starts]) == 0
+
+        dates = [(start_date + timedelta(days=d)).isoformat() for d in range(days)]
+        results = []
+        for row, villa_free in zip(rows.tolist(), free):
+            free_days = np.flatnonzero(villa_free).tolist()
+            if not free_days:
+                continue
+            villa = self.villas[row]
+            results.append({
+                "villa_id": villa["id"],
+                "code": villa.get("code"),
+                "name": villa.get("name"),
+                "max_guests": villa.get("max_guests") or 0,
+                "category_id": villa.get("category_id"),
+                "fully_available": len(free_days) == days,
+                "available_dates": [dates[d] for d in free_days],
+            })
+        return results
+
+    def covers(self, start_date: date, days: int) -> bool:
+        """Whether the range falls inside the dates the matrix holds"""
+        first_day = (start_date - self.origin).days
+        return first_day >= 0 and first_day + days <= HORIZON_DAYS - 1
+
+
+availability_index = AvailabilityIndex()
+
+
+async def _rebuild_logged(db: AsyncIOMotorDatabase) -> None:
+    try:
+        await availability_index.rebuild(db)
+    except PyMongoError as e:
+        logger.error(f"No se pudo reconstruir el índice de disponibilidad: {e}")
+
+
+def schedule_availability_rebuild(db: AsyncIOMotorDatabase) -> None:
+    """Rebuild in the background after a villa changes (the matrix has one row per villa)"""
+    asyncio.get_running_loop().create_task(_rebuild_logged(db))
+
+
+async def refresh_availability_periodically(db: AsyncIOMotorDatabase) -> None:
+    """Rebuild the index every REFRESH_SECONDS; errors are logged and retried on the next round"""
+    while True:
+        await _rebuild_logged(db)
+        await asyncio.sleep(REFRESH_SECONDS)
@@ -0,0 +1,224 @@
+"""
+Detección de reservas dobles
+Una reservación ocupa su villa desde check_in_time hasta check_out_time del día
+reservado; si la salida es anterior a la entrada (amanecida) termina al día siguiente.
+"""
+from datetime import datetime, time, timedelta, timezone
+from typing import List, Optional, Tuple
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorDatabase
+import re
+
+_TIME_RE = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*([ap])?\.?\s*m?\.?\s*$", re.IGNORECASE)
+
+# Se buscan reservaciones desde el día anterior (amanecidas que terminan hoy)
+# hasta el día siguiente (si esta reservación termina mañana)
+SEARCH_DAYS_BEFORE = 1
+SEARCH_DAYS_AFTER = 2
+
+# Campos que definen cuándo y dónde ocupa la villa una reservación
+BOOKING_FIELDS = ("villa_id", "reservation_date", "check_in_time", "check_out_time")
+
+# Intentos de una escritura que verifica la villa dentro de una transacción
+# (dos reservaciones de la misma villa a la vez chocan en booking_seq)
+BOOKING_WRITE_ATTEMPTS = 3
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """Minutes since midnight for "9:00 AM", "9 pm", "21:00"... None if it cannot be parsed"""
+    if not value:
+        return None
+    match = _TIME_RE.match(value)
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.lower() == "p" else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+
+def _start_of_day(value: datetime) -> datetime:
+    # Fechas sin zona horaria se toman como UTC, igual que en la migración
+    tzinfo = value.tzinfo or timezone.utc
+    return datetime.combine(value.date(), time(0), tzinfo=tzinfo)
+
+
+def window_minutes(check_in_time: Optional[str], check_out_time: Optional[str]) -> Tuple[int, int]:
+    """(start, end) in minutes from the start of the reserved day; end goes past 1440 for overnight stays.
+
+    Horarios que no se pueden interpretar ocupan el día completo.
+    """
+    start = parse_time(check_in_time)
+    end = parse_time(check_out_time)
+    start = start if start is not None else 0
+    end = end if end is not None else 24 * 60
+    if end <= start:
+        end += 24 * 60
+    return start, end
+
+
+def reservation_window(
+    reservation_date: datetime,
+    check_in_time: Optional[str],
+    check_out_time: Optional[str],
+) -> Tuple[datetime, datetime]:
+    """Time span a reservation occupies its villa"""
+    day = _start_of_day(reservation_date)
+    start, end = window_minutes(check_in_time, check_out_time)
+    return day + timedelta(minutes=start), day + timedelta(minutes=end)
+
+
+async def find_booking_conflicts(
+    db: AsyncIOMotorDatabase,
+    villa_id: str,
+    reservation_date: datetime,
+    check_in_time: Optional[str],
+    check_out_time: Optional[str],
+    exclude_id: Optional[str] = None,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> List[dict]:
+    """Active reservations of the villa whose window overlaps the given one.
+
+    Una sola consulta sobre el índice (villa_id, reservation_date); el solapamiento
+    de horarios se resuelve aquí con los pocos candidatos de esos días.
+    """
+    start, end = reservation_window(reservation_date, check_in_time, check_out_time)
+    day = _start_of_day(reservation_date)
+
+    query = {
+        "villa_id": villa_id,
+        "reservation_date": {
+            "$gte": day - timedelta(days=SEARCH_DAYS_BEFORE),
+            "$lt": day + timedelta(days=SEARCH_DAYS_AFTER),
+        },
+        "status": {"$ne": "cancelled"},
+    }
+    if exclude_id:
+        query["id"] = {"$ne": exclude_id}
+
+    candidates = await db.reservations.find(
+        query,
+        {"_id": 0, "id": 1, "invoice_number": 1, "reservation_date": 1, "check_in_time": 1, "check_out_time": 1},
+        session=session
+    ).to_list(None)
+
+    conflicts = []
+    for other in candidates:
+        other_start, other_end = reservation_window(
+            other["reservation_date"], other.get("check_in_time"), other.get("check_out_time")
+        )
+        if start < other_end and other_start < end:
+            conflicts.append(other)
+    return conflicts
+
+
+async def find_batch_booking_conflicts(db: AsyncIOMotorDatabase, reservations: List[dict]) -> List[List[str]]:
+    """Conflicts of each reservation of a batch: invoice numbers already booked, or earlier items of the batch.
+
+    Una sola consulta para todo el lote ($in de villas y el rango de fechas que cubre);
+    los elementos rechazados no bloquean a los siguientes.
+    """
+    active = [r for r in reservations if r.get("status") != "cancelled"]
+    if not active:
+        return [[] for _ in reservations]
+
+    days = [_start_of_day(r["reservation_date"]) for r in active]
+    candidates = await db.reservations.find(
+        {
+            "villa_id": {"$in": list({r["villa_id"] for r in active})},
+            "reservation_date": {
+                "$gte": min(days) - timedelta(days=SEARCH_DAYS_BEFORE),
+                "$lt": max(days) + timedelta(days=SEARCH_DAYS_AFTER),
+            },
+            "status": {"$ne": "cancelled"},
+        },
+        {"_id": 0, "villa_id": 1, "invoice_number": 1, "reservation_date": 1, "check_in_time": 1, "check_out_time": 1}
+    ).to_list(None)
+
+    booked: dict = {}
+    for other in candidates:
+        window = reservation_window(other["reservation_date"], other.get("check_in_time"), other.get("check_out_time"))
+        booked.setdefault(other["villa_id"], []).append((window, other.get("invoice_number") or "?"))
+
+    conflicts = []
+    for i, reservation in enumerate(reservations):
+        if reservation.get("status") == "cancelled":
+            conflicts.append([])
+            continue
+        start, end = reservation_window(
+            reservation["reservation_date"], reservation.get("check_in_time"), reservation.get("check_out_time")
+        )
+        found = [label for (other_start, other_end), label in booked.get(reservation["villa_id"], [])
+                 if start < other_end and other_start < end]
+        if not found:
+            booked.setdefault(reservation["villa_id"], []).append(((start, end), f"lote #{i}"))
+        conflicts.append(found)
+    return conflicts
+
+
+async def ensure_villa_available(
+    db: AsyncIOMotorDatabase,
+    villa_id: str,
+    reservation_date: datetime,
+    check_in_time: Optional[str],
+    check_out_time: Optional[str],
+    exclude_id: Optional[str] = None,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> None:
+    """Raise 409 with the conflicting invoice numbers if the villa is already booked at that time"""
+    conflicts = await find_booking_conflicts(
+        db, villa_id, reservation_date, check_in_time, check_out_time, exclude_id, session
+    )
+    if conflicts:
+        numbers = ", ".join(c.get("invoice_number") or c["id"] for c in conflicts)
+        raise HTTPException(
+            status_code=409,
+            detail=f"La villa ya está reservada en ese horario (facturas: {numbers})"
+        )
+
+
+async def lock_villa_bookings(
+    db: AsyncIOMotorDatabase,
+    villa_id: str,
+    session: Optional[AsyncIOMotorClientSession],
+) -> None:
+    """Write to the villa inside the booking transaction so concurrent bookings of it conflict.
+
+    Verificar y luego insertar no basta: dos reservaciones simultáneas pasan la
+    verificación a la vez. Si ambas transacciones escriben el documento de la
+    villa, una aborta con un conflicto transitorio y al reintentar ya ve la otra.
+    Sin transacciones (standalone) no hay protección.
+    """
+    if session is None:
+        return
+    await db.villas.update_one({"id": villa_id}, {"$inc": {"booking_seq": 1}}, session=session)
+
+
+def booking_unchanged_filter(update: dict) -> dict:
+    """Conditions under which applying `update` cannot create a double booking.
+
+    Si el documento actual cumple el filtro (mismos campos de reserva, y no
+    estaba cancelada si se envía un estado activo) la escritura no necesita
+    verificación. Un formulario que reenvía todos los campos sin cambiarlos
+    se guarda en una sola operación.
+    """
+    if update.get("status") == "cancelled":
+        return {}
+    conditions = {field: update[field] for field in BOOKING_FIELDS if field in update}
+    if "status" in update:
+        conditions["status"] = {"$ne": "cancelled"}
+    return conditions
+
+
+def needs_booking_check(existing: dict, update: dict) -> bool:
+    """Whether `update` moves or reactivates the reservation, so it must be checked for double bookings"""
+    merged = {**existing, **update}
+    if merged.get("status") == "cancelled":
+        return False
+    if existing.get("status") == "cancelled":
+        return True
+    return any(merged.get(field) != existing.get(field) for field in BOOKING_FIELDS)
@@ -0,0 +1,105 @@
+"""
+Copia del cliente en las reservaciones
+Las reservaciones guardan los datos del cliente que muestran sus vistas
+(customer_name, customer_identification_document) para leerse sin join.
+Cuando un cliente cambia se propaga en segundo plano; reconcile completa en
+lote solo las reservaciones a las que les falta la copia, sin tocar los datos
+con que ya se imprimieron las facturas anteriores.
+
+Uso: python -m backend.customer_sync_service
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateMany
+import asyncio
+import logging
+
+from backend.database import VERSION_BUMP, literal_set
+
+logger = logging.getLogger(__name__)
+
+CUSTOMER_SNAPSHOT_MIGRATION = "customer_snapshots"
+CUSTOMER_SNAPSHOT_PROJECTION = {"_id": 0, "id": 1, "name": 1, "identification_document": 1, "dni": 1}
+
+
+def customer_snapshot(customer: dict) -> dict:
+    """Customer fields copied onto its reservations"""
+    return {
+        "customer_name": customer.get("name"),
+        "customer_identification_document": customer.get("identification_document") or customer.get("dni"),
+    }
+
+
+def _stale_reservations(customer_id: str, snapshot: dict) -> dict:
+    # Solo las reservaciones cuya copia difiere: no se reescribe lo que ya está al día
+    return {
+        "customer_id": customer_id,
+        "$or": [{field: {"$ne": value}} for field, value in snapshot.items()],
+    }
+
+
+def _snapshot_update(values: dict) -> list:
+    # Sube la versión: un formulario abierto antes de la copia recibe 409 en vez de pisarla
+    return [literal_set(values), {"$set": VERSION_BUMP}]
+
+
+async def propagate_customer_snapshot(db: AsyncIOMotorDatabase, customer_id: str) -> int:
+    """Copy the current customer fields onto its reservations. Returns the reservations updated"""
+    customer = await db.customers.find_one({"id": customer_id}, CUSTOMER_SNAPSHOT_PROJECTION)
+    if not customer:
+        return 0
+    snapshot = customer_snapshot(customer)
+    result = await db.reservations.update_many(_stale_reservations(customer_id, snapshot), _snapshot_update(snapshot))
+    if result.modified_count:
+        logger.info(f"Cliente {customer_id}: {result.modified_count} reservaciones actualizadas")
+    return result.modified_count
+
+
+def _missing_snapshot_updates(customer_id: str, snapshot: dict) -> list:
+    # Un UpdateMany por campo: solo se completa lo que falta, lo ya guardado no se cambia
+    return [
+        UpdateMany({"customer_id": customer_id, field: {"$exists": False}}, _snapshot_update({field: value}))
+        for field, value in snapshot.items()
+    ]
+
+
+async def reconcile_customer_snapshots(db: AsyncIOMotorDatabase, batch_size: int = 500) -> int:
+    """Fill in the customer copy on reservations that lack it, one bulk_write per batch of customers"""
+    repaired = 0
+    batch = []
+    cursor = db.customers.find({}, CUSTOMER_SNAPSHOT_PROJECTION).batch_size(batch_size)
+    async for customer in cursor:
+        batch.extend(_missing_snapshot_updates(customer["id"], customer_snapshot(customer)))
+        if len(batch) >= batch_size:
+            result = await db.reservations.bulk_write(batch, ordered=False)
+            repaired += result.modified_count
+            batch = []
+
+    if batch:
+        result = await db.reservations.bulk_write(batch, ordered=False)
+        repaired += result.modified_count
+
+    await db.migrations.update_one(
+        {"name": CUSTOMER_SNAPSHOT_MIGRATION},
+        {"$set": {"completed_at": datetime.now(timezone.utc), "repaired": repaired}},
+        upsert=True
+    )
+    return repaired
+
+
+async def main() -> None:
+    from dotenv import load_dotenv
+    from backend.database import Database
+
+    load_dotenv(Path(__file__).parent / ".env")
+    try:
+        repaired = await reconcile_customer_snapshots(Database.get_db())
+        print(f"Reservaciones reparadas: {repaired}")
+    finally:
+        Database.close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -1,25 +1,240 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession, AsyncIOMotorDatabase
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+from contextlib import asynccontextmanager
+import importlib.util
 import os
-from typing import Optional, List, Dict
+import threading
+from typing import AsyncIterator, Optional, List, Dict
 from datetime import datetime
 
+# Opciones del pool leídas del entorno: solo se pasan las definidas,
+# el resto queda con los valores por defecto del driver
+POOL_OPTIONS = {
+    "maxPoolSize": "MONGO_MAX_POOL_SIZE",
+    "minPoolSize": "MONGO_MIN_POOL_SIZE",
+    "maxIdleTimeMS": "MONGO_MAX_IDLE_TIME_MS",
+    "serverSelectionTimeoutMS": "MONGO_SERVER_SELECTION_TIMEOUT_MS",
+    "connectTimeoutMS": "MONGO_CONNECT_TIMEOUT_MS",
+    "socketTimeoutMS": "MONGO_SOCKET_TIMEOUT_MS",
+    "waitQueueTimeoutMS": "MONGO_WAIT_QUEUE_TIMEOUT_MS",
+}
+
+# Compresores de red y el paquete que necesita cada uno (zlib viene con Python)
+COMPRESSOR_PACKAGES = {"zstd": "zstandard", "snappy": "snappy", "zlib": None}
+
+
+def available_compressors(requested: str) -> List[str]:
+    """Keep the requested compressors whose package is installed, in order of preference"""
+    compressors = []
+    for name in (c.strip() for c in requested.split(",") if c.strip()):
+        if name not in COMPRESSOR_PACKAGES:
+            continue
+        package = COMPRESSOR_PACKAGES[name]
+        if package is None or importlib.util.find_spec(package) is not None:
+            compressors.append(name)
+    return compressors
+
+
+def client_options() -> Dict:
+    """Build the Motor client options from the environment"""
+    options = {"tz_aware": True}  # las fechas nativas se leen como datetime UTC con zona horaria
+    for option, env_var in POOL_OPTIONS.items():
+        if os.environ.get(env_var):
+            options[option] = int(os.environ[env_var])
+
+    compressors = available_compressors(os.environ.get("MONGO_COMPRESSORS", "zstd,snappy,zlib"))
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters: checkout wait time, connections in use and churn.
+
+    Los eventos llegan desde los hilos del driver, por eso el lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open_connections = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.pool_clears = 0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "open_connections": self.open_connections,
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_checkout_wait_ms": round(self.checkout_wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_checkout_wait_ms": round(self.checkout_wait_max * 1000, 3),
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "pool_clears": self.pool_clears,
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+            self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        wait = getattr(event, "duration", 0.0) or 0.0
+        with self._lock:
+            self.waiting -= 1
+            self.in_use += 1
+            self.checkouts += 1
+            self.checkout_wait_total += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+
 class Database:
     client: Optional[AsyncIOMotorClient] = None
     db = None
+    options: Dict = {}
+    pool_metrics = PoolMetrics()
 
     @classmethod
     def get_db(cls):
         if cls.db is None:
             mongo_url = os.environ['MONGO_URL']
-            cls.client = AsyncIOMotorClient(mongo_url)
+            cls.options = client_options()
+            cls.client = AsyncIOMotorClient(mongo_url, event_listeners=[cls.pool_metrics], **cls.options)
             cls.db = cls.client[os.environ.get('DB_NAME', 'villa_management')]
         return cls.db
 
+    @classmethod
+    def pool_stats(cls) -> Dict:
+        """Pool configuration and live metrics, to size the pool against the number of workers"""
+        pool_options = cls.client.options.pool_options if cls.client else None
+        return {
+            "config": {
+                "max_pool_size": pool_options.max_pool_size,
+                "min_pool_size": pool_options.min_pool_size,
+                "max_idle_time_seconds": pool_options.max_idle_time_seconds,
+                "wait_queue_timeout": pool_options.wait_queue_timeout,
+                "server_selection_timeout": cls.client.options.server_selection_timeout,
+                "compressors": cls.options.get("compressors"),
+            } if pool_options else None,
+            "metrics": cls.pool_metrics.snapshot(),
+        }
+
     @classmethod
     def close_db(cls):
         if cls.client:
             cls.client.close()
 
+# Soporte de transacciones por cliente (se consulta una sola vez con "hello")
+_transaction_support: Dict[int, bool] = {}
+
+MAX_COMMIT_ATTEMPTS = 3  # commits con resultado desconocido (p. ej. elección de primario)
+
+
+async def supports_transactions(client: AsyncIOMotorClient) -> bool:
+    """Whether the deployment supports multi-document transactions (replica set or sharded cluster)"""
+    key = id(client)
+    if key not in _transaction_support:
+        hello = await client.admin.command("hello")
+        _transaction_support[key] = "setName" in hello or hello.get("msg") == "isdbgrid"
+    return _transaction_support[key]
+
+
+@asynccontextmanager
+async def transaction(db: AsyncIOMotorDatabase) -> AsyncIterator[Optional[AsyncIOMotorClientSession]]:
+    """Session with an open transaction, committed on exit and aborted on error.
+
+    En un servidor standalone (desarrollo local) no hay transacciones: se entrega
+    None y las escrituras se hacen sin sesión.
+    """
+    if not await supports_transactions(db.client):
+        yield None
+        return
+    async with await db.client.start_session() as session:
+        session.start_transaction()
+        try:
+            yield session
+        except BaseException:
+            if session.in_transaction:
+                await session.abort_transaction()
+            raise
+        await commit_with_retry(session)
+
+
+async def commit_with_retry(session: AsyncIOMotorClientSession) -> None:
+    """Commit the session's transaction, retrying while the outcome is unknown (like pymongo's with_transaction).
+
+    Con UnknownTransactionCommitResult el commit pudo haberse aplicado; repetirlo es
+    seguro porque commitTransaction es idempotente.
+    """
+    for attempt in range(MAX_COMMIT_ATTEMPTS):
+        try:
+            await session.commit_transaction()
+            return
+        except PyMongoError as e:
+            if not e.has_error_label("UnknownTransactionCommitResult") or attempt == MAX_COMMIT_ATTEMPTS - 1:
+                raise
+
+# Control de concurrencia optimista: cada escritura incrementa "version";
+# los documentos anteriores a este campo cuentan como versión 1
+VERSION_BUMP = {"version": {"$add": [{"$ifNull": ["$version", 1]}, 1]}}
+
+
+def version_filter(doc_id: str, expected_version: Optional[int] = None) -> dict:
+    """Filter by id and, when the client sent one, by the version it last read"""
+    query = {"id": doc_id}
+    if expected_version is not None:
+        query["version"] = {"$in": [1, None]} if expected_version == 1 else expected_version
+    return query
+
+
+def literal_set(values: Dict) -> Dict:
+    """$set stage for an update pipeline with client values taken literally (no $ expressions)"""
+    return {"$set": {field: {"$literal": value} for field, value in values.items()}}
+
 def serialize_doc(doc: dict) -> dict:
     """Convert MongoDB document to JSON-serializable dict"""
     if doc is None:
@@ -41,18 +256,11 @@ def serialize_docs(docs: List[dict]) -> List[dict]:
     return [serialize_doc(doc) for doc in docs]
 
 def prepare_doc_for_insert(doc: dict) -> dict:
-    """Prepare a document for MongoDB insertion"""
-    prepared = doc.copy()
-    
-    # Convert datetime objects to ISO strings for MongoDB
-    for key, value in prepared.items():
-        if isinstance(value, datetime):
-            prepared[key] = value.isoformat()
-    
-    return prepared
+    """Prepare a document for MongoDB insertion - datetimes are stored as native BSON dates"""
+    return doc.copy()
 
 def restore_datetimes(doc: dict, datetime_fields: List[str]) -> dict:
-    """Restore datetime fields from ISO strings"""
+    """Restore datetime fields still stored as ISO strings (documents not yet migrated)"""
     for field in datetime_fields:
         if field in doc and isinstance(doc[field], str):
             doc[field] = datetime.fromisoformat(doc[field])
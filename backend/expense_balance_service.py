@@ -0,0 +1,146 @@
+"""
+Saldo de los gastos
+Los gastos guardan total_paid y balance_due; cada abono los ajusta con una
+actualización atómica, así que los listados no leen expense_abonos.
+reconcile compara con la suma real de los abonos y repara las diferencias.
+
+Uso: python -m backend.expense_balance_service [--check]
+"""
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+import asyncio
+import logging
+import sys
+
+from backend.database import VERSION_BUMP
+
+logger = logging.getLogger(__name__)
+
+EXPENSE_BALANCE_MIGRATION = "expense_balances"
+BALANCE_TOLERANCE = 0.005  # diferencias de redondeo entre sumar de a uno y sumar todo junto
+
+# balance_due = monto - pagado (negativo si se pagó de más)
+EXPENSE_BALANCE_STAGE = {"$set": {
+    "balance_due": {"$subtract": [{"$ifNull": ["$amount", 0]}, {"$ifNull": ["$total_paid", 0]}]},
+}}
+
+
+def expense_payment_update(amount: float) -> List[dict]:
+    """Update pipeline adding `amount` to total_paid, recomputing balance_due and payment_status.
+
+    Igual que en las reservaciones: una sola operación atómica en el servidor.
+    Con un monto negativo revierte un abono.
+    """
+    return [
+        {"$set": {
+            "total_paid": {"$add": [{"$ifNull": ["$total_paid", 0]}, {"$literal": amount}]},
+            **VERSION_BUMP,
+        }},
+        EXPENSE_BALANCE_STAGE,
+        {"$set": {
+            "payment_status": {"$cond": [{"$gte": ["$total_paid", {"$ifNull": ["$amount", 0]}]}, "paid", "pending"]},
+        }},
+    ]
+
+
+async def paid_by_expense(db: AsyncIOMotorDatabase, expense_ids: List[str]) -> dict:
+    """Actual total of abonos per expense_id, for the given expenses"""
+    pipeline = [
+        {"$match": {"expense_id": {"$in": expense_ids}}},
+        {"$group": {"_id": "$expense_id", "total": {"$sum": "$amount"}}},
+    ]
+    return {row["_id"]: row["total"] async for row in db.expense_abonos.aggregate(pipeline)}
+
+
+def expected_balance(expense: dict, total_paid: float) -> dict:
+    """Stored fields an expense should have given the sum of its abonos.
+
+    payment_status sigue a los abonos solo si tiene alguno: un gasto sin abonos
+    conserva el estado que se le puso a mano.
+    """
+    amount = expense.get("amount", 0)
+    expected = {"total_paid": total_paid, "balance_due": amount - total_paid}
+    if total_paid > 0:
+        expected["payment_status"] = "paid" if total_paid >= amount else "pending"
+    return expected
+
+
+def _differs(stored, expected) -> bool:
+    if isinstance(expected, str):
+        return stored != expected
+    return stored is None or abs(stored - expected) >= BALANCE_TOLERANCE
+
+
+async def _reconcile_batch(db: AsyncIOMotorDatabase, expenses: List[dict], repair: bool) -> List[dict]:
+    # Los abonos se suman después de leer los gastos: un abono posterior cambia
+    # total_paid y el filtro con los valores leídos deja ese gasto sin tocar
+    paid = await paid_by_expense(db, [e["id"] for e in expenses])
+    drifted, updates = [], []
+    for expense in expenses:
+        expected = expected_balance(expense, paid.get(expense["id"], 0))
+        if not any(_differs(expense.get(field), value) for field, value in expected.items()):
+            continue
+        drifted.append({
+            "id": expense["id"],
+            **{f"stored_{field}": expense.get(field) for field in expected},
+            **expected,
+        })
+        stored = {field: expense.get(field) for field in ("amount", "total_paid", "balance_due")}
+        updates.append(UpdateOne({"id": expense["id"], **stored}, {"$set": expected}))
+
+    if repair and updates:
+        await db.expenses.bulk_write(updates, ordered=False)
+    return drifted
+
+
+async def reconcile_expense_balances(db: AsyncIOMotorDatabase, repair: bool = True, batch_size: int = 500) -> List[dict]:
+    """Expenses whose stored total_paid/balance_due/payment_status drifted from their abonos; with `repair`, fix them in bulk.
+
+    Solo se escribe si los valores guardados siguen siendo los leídos: un abono
+    concurrente gana y el gasto se revisa en la siguiente corrida.
+    """
+    drifted = []
+    batch = []
+    cursor = db.expenses.find(
+        {}, {"_id": 0, "id": 1, "amount": 1, "total_paid": 1, "balance_due": 1, "payment_status": 1}
+    ).batch_size(batch_size)
+    async for expense in cursor:
+        batch.append(expense)
+        if len(batch) >= batch_size:
+            drifted.extend(await _reconcile_batch(db, batch, repair))
+            batch = []
+    if batch:
+        drifted.extend(await _reconcile_batch(db, batch, repair))
+
+    if repair:
+        await db.migrations.update_one(
+            {"name": EXPENSE_BALANCE_MIGRATION},
+            {"$set": {"completed_at": datetime.now(timezone.utc), "repaired": len(drifted)}},
+            upsert=True
+        )
+    if drifted:
+        logger.info(f"Gastos con saldo desactualizado: {len(drifted)}{' (reparados)' if repair else ''}")
+    return drifted
+
+
+async def main() -> None:
+    from dotenv import load_dotenv
+    from backend.database import Database
+
+    load_dotenv(Path(__file__).parent / ".env")
+    check_only = "--check" in sys.argv[1:]
+    try:
+        drifted = await reconcile_expense_balances(Database.get_db(), repair=not check_only)
+        for expense in drifted:
+            print(expense)
+        print(f"Gastos {'con diferencias' if check_only else 'reparados'}: {len(drifted)}")
+    finally:
+        Database.close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -262,6 +262,15 @@ def create_excel_template() -> io.BytesIO:
     return output
 
 
+def strip_timezones(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Excel no admite fechas con zona horaria: las fechas nativas (UTC) se exportan sin ella"""
+    for doc in docs:
+        for key, value in doc.items():
+            if isinstance(value, datetime) and value.tzinfo is not None:
+                doc[key] = value.replace(tzinfo=None)
+    return docs
+
+
 async def export_data_to_excel(db: AsyncIOMotorDatabase, data_type: str) -> io.BytesIO:
     """
     Exporta datos existentes a Excel
@@ -270,7 +279,7 @@ async def export_data_to_excel(db: AsyncIOMotorDatabase, data_type: str) -> io.B
     
     if data_type == "customers":
         customers = await db.customers.find({}, {"_id": 0}).to_list(None)
-        df = pd.DataFrame(customers)
+        df = pd.DataFrame(strip_timezones(customers))
         if not df.empty:
             df = df[['name', 'phone', 'email', 'identification_document', 'address']]
             df.columns = ['Nombre Completo', 'Teléfono', 'Email', 'Cédula/Pasaporte/RNC', 'Dirección']
@@ -278,7 +287,7 @@ async def export_data_to_excel(db: AsyncIOMotorDatabase, data_type: str) -> io.B
     
     elif data_type == "villas":
         villas = await db.villas.find({}, {"_id": 0}).to_list(None)
-        df = pd.DataFrame(villas)
+        df = pd.DataFrame(strip_timezones(villas))
         if not df.empty:
             # Mapear columnas según necesidad
             pass
@@ -286,12 +295,12 @@ async def export_data_to_excel(db: AsyncIOMotorDatabase, data_type: str) -> io.B
     
     elif data_type == "reservations":
         reservations = await db.reservations.find({}, {"_id": 0}).to_list(None)
-        df = pd.DataFrame(reservations)
+        df = pd.DataFrame(strip_timezones(reservations))
         df.to_excel(output, index=False, engine='openpyxl')
     
     elif data_type == "expenses":
         expenses = await db.expenses.find({}, {"_id": 0}).to_list(None)
-        df = pd.DataFrame(expenses)
+        df = pd.DataFrame(strip_timezones(expenses))
         df.to_excel(output, index=False, engine='openpyxl')
     
     output.seek(0)
@@ -2,12 +2,15 @@
 Servicio de Importación de Datos desde Excel
 Procesa archivos Excel y los guarda en la base de datos
 """
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import List, Dict, Any, Tuple
 import pandas as pd
 from motor.motor_asyncio import AsyncIOMotorDatabase
 import uuid
 
+from backend.customer_sync_service import customer_snapshot
+from backend.invoice_service import invoice_entry, register_invoice_number
+
 async def import_customers(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[int, int, List[str]]:
     """
     Importa clientes desde DataFrame
@@ -179,19 +182,19 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
                         errors.append(f"Fila {idx + 2}: Formato de fecha inválido. Use DD/MM/YYYY")
                         continue
             else:
-                fecha_obj = pd.to_datetime(fecha_reserva)
+                fecha_obj = pd.to_datetime(fecha_reserva).to_pydatetime()
             
             reservation_data = {
                 'id': str(uuid.uuid4()),
                 'invoice_number': str(int(row['Número Factura'])),
                 'customer_id': customer['id'],
-                'customer_name': customer['name'],
+                **customer_snapshot(customer),
                 'villa_id': villa['id'],
                 'villa_code': villa['code'],
                 'villa_description': villa.get('name', ''),
                 'rental_type': str(row['Tipo Renta']).strip().lower(),
-                'reservation_date': fecha_obj.isoformat(),
-                'check_out_date': fecha_obj.isoformat(),
+                'reservation_date': fecha_obj,
+                'check_out_date': fecha_obj,
                 'check_in_time': str(row.get('Hora Check-In', '9:00 AM')).strip(),
                 'check_out_time': str(row.get('Hora Check-Out', '8:00 PM')).strip(),
                 'guests': int(row['Huéspedes']),
@@ -214,8 +217,8 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
                 'currency': str(row['Moneda']).strip().upper(),
                 'notes': str(row.get('Notas', '')).strip() if not pd.isna(row.get('Notas')) else '',
                 'status': str(row['Estado']).strip().lower(),
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat(),
+                'created_at': datetime.now(timezone.utc),
+                'updated_at': datetime.now(timezone.utc),
                 'created_by': 'import_system'
             }
             
@@ -235,6 +238,10 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
                 await db.reservations.insert_one(reservation_data)
                 reservations_created += 1
                 reservation_id = reservation_data['id']
+                await register_invoice_number(
+                    db, reservation_data['invoice_number'],
+                    invoice_entry('reservation', reservation_id, reservation_id=reservation_id)
+                )
             
             # OPCIÓN A: Crear gasto automático si owner_price > 0
             if villa.get('owner_price', 0) > 0:
@@ -250,6 +257,8 @@ async def import_reservations(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tup
                         'expense_category_id': None,
                         'description': f"Pago propietario villa {villa['code']} - Factura #{reservation_data['invoice_number']}",
                         'amount': villa['owner_price'],
+                        'total_paid': 0,
+                        'balance_due': villa['owner_price'],
                         'currency': reservation_data['currency'],
                         'expense_date': reservation_data['reservation_date'],
                         'payment_status': 'pending',
@@ -303,7 +312,7 @@ async def import_expenses(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[i
                         errors.append(f"Fila {idx + 2}: Formato de fecha inválido. Use DD/MM/YYYY")
                         continue
             else:
-                fecha_obj = pd.to_datetime(fecha_gasto)
+                fecha_obj = pd.to_datetime(fecha_gasto).to_pydatetime()
             
             expense_data = {
                 'id': str(uuid.uuid4()),
@@ -311,8 +320,12 @@ async def import_expenses(df: pd.DataFrame, db: AsyncIOMotorDatabase) -> Tuple[i
                 'expense_category_id': None,
                 'description': str(row['Descripción']).strip(),
                 'amount': float(row['Monto']),
+                'total_paid': 0,
+                'balance_due': float(row['Monto']),
                 'currency': str(row['Moneda']).strip().upper(),
-                'expense_date': fecha_obj.isoformat(),
+                'expense_date': fecha_obj,
+                # Pagos a propietarios: el listado los ordena por check-in
+                'reservation_check_in': fecha_obj if str(row['Categoría']).strip().lower() == 'pago_propietario' else None,
                 'payment_status': str(row['Estado Pago']).strip().lower(),
                 'notes': str(row.get('Notas', '')).strip() if not pd.isna(row.get('Notas')) else '',
                 'expense_type': str(row['Tipo Gasto']).strip().lower(),
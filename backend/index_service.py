@@ -0,0 +1,187 @@
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+from typing import Dict, List
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Los números de factura son únicos; el filtro parcial ignora abonos antiguos sin número
+INVOICE_NUMBER_UNIQUE = dict(
+    name="invoice_number_unique",
+    unique=True,
+    partialFilterExpression={"invoice_number": {"$type": "string"}},
+)
+
+# ============ INDEX REGISTRY ============
+# Índices declarados por colección. Cada consulta de server.py debe estar
+# cubierta por uno de estos; los nombres son explícitos para poder verificarlos.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "customers": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("name", ASCENDING), ("id", ASCENDING)], name="name_id"),
+        IndexModel([("phone", ASCENDING)], name="phone"),
+    ],
+    "categories": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("is_active", ASCENDING)], name="is_active"),
+    ],
+    "expense_categories": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("is_active", ASCENDING)], name="is_active"),
+    ],
+    "villas": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("code", ASCENDING)], name="code_unique", unique=True),
+        IndexModel([("category_id", ASCENDING)], name="category_id"),
+    ],
+    "extra_services": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "reservations": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("invoice_number", ASCENDING)], **INVOICE_NUMBER_UNIQUE),
+        IndexModel([("reservation_date", ASCENDING), ("id", ASCENDING)], name="reservation_date_id"),
+        IndexModel([("villa_id", ASCENDING), ("reservation_date", ASCENDING), ("id", ASCENDING)], name="villa_id_reservation_date_id"),
+        IndexModel([("customer_id", ASCENDING), ("reservation_date", ASCENDING), ("id", ASCENDING)], name="customer_id_reservation_date_id"),
+        IndexModel([("status", ASCENDING), ("reservation_date", ASCENDING), ("id", ASCENDING)], name="status_reservation_date_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="status_created_at_id"),
+        IndexModel([("balance_due", ASCENDING), ("created_at", DESCENDING)], name="balance_due_created_at"),
+    ],
+    "reservation_abonos": [
+        IndexModel([("reservation_id", ASCENDING), ("payment_date", DESCENDING), ("id", DESCENDING)], name="reservation_id_payment_date_id"),
+        IndexModel([("id", ASCENDING)], name="id"),
+        IndexModel([("invoice_number", ASCENDING)], **INVOICE_NUMBER_UNIQUE),
+    ],
+    "expenses": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("expense_date", DESCENDING), ("id", DESCENDING)], name="expense_date_id"),
+        IndexModel([("category", ASCENDING), ("expense_date", DESCENDING), ("id", DESCENDING)], name="category_expense_date_id"),
+        IndexModel([("expense_category_id", ASCENDING), ("expense_date", DESCENDING), ("id", DESCENDING)], name="expense_category_id_expense_date_id"),
+        IndexModel([("payment_status", ASCENDING), ("expense_date", DESCENDING), ("id", DESCENDING)], name="payment_status_expense_date_id"),
+        IndexModel([("expense_type", ASCENDING), ("expense_date", DESCENDING), ("id", DESCENDING)], name="expense_type_expense_date_id"),
+        IndexModel([("reservation_check_in", ASCENDING), ("id", ASCENDING)], name="reservation_check_in_id"),
+        IndexModel([("category", ASCENDING), ("reservation_check_in", ASCENDING), ("id", ASCENDING)], name="category_reservation_check_in_id"),
+        IndexModel([("related_reservation_id", ASCENDING)], name="related_reservation_id"),
+        IndexModel([("is_recurring", ASCENDING)], name="is_recurring"),
+        IndexModel(
+            [("recurring_template_id", ASCENDING), ("recurring_period", ASCENDING)],
+            name="recurring_template_id_period_unique",
+            unique=True,
+            partialFilterExpression={"recurring_template_id": {"$type": "string"}},
+        ),
+    ],
+    "expense_abonos": [
+        IndexModel([("expense_id", ASCENDING), ("payment_date", DESCENDING), ("id", DESCENDING)], name="expense_id_payment_date_id"),
+        IndexModel([("id", ASCENDING)], name="id"),
+        IndexModel([("invoice_number", ASCENDING)], **INVOICE_NUMBER_UNIQUE),
+    ],
+    "villa_owners": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("name", ASCENDING), ("id", ASCENDING)], name="name_id"),
+        # Propietario auto-generado de cada villa (upsert de la deuda); los creados a mano no lo tienen
+        IndexModel(
+            [("villa_code", ASCENDING)],
+            name="villa_code_unique",
+            unique=True,
+            partialFilterExpression={"villa_code": {"$type": "string"}},
+        ),
+    ],
+    "owner_payments": [
+        IndexModel([("owner_id", ASCENDING), ("payment_date", DESCENDING), ("id", DESCENDING)], name="owner_id_payment_date_id"),
+    ],
+    "invoice_counter": [
+        IndexModel([("counter_id", ASCENDING)], name="counter_id_unique", unique=True),
+    ],
+    "invoice_numbers": [
+        IndexModel([("invoice_number", ASCENDING)], name="invoice_number_unique", unique=True),
+        IndexModel([("document_id", ASCENDING)], name="document_id"),
+        IndexModel([("reservation_id", ASCENDING)], name="reservation_id"),
+        IndexModel([("expense_id", ASCENDING)], name="expense_id"),
+    ],
+    "invoice_voided": [
+        IndexModel([("invoice_number", ASCENDING)], name="invoice_number"),
+    ],
+    "migrations": [
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+    ],
+    "scheduled_jobs": [
+        IndexModel([("name", ASCENDING)], name="name_unique", unique=True),
+    ],
+    "job_runs": [
+        IndexModel([("job", ASCENDING), ("started_at", DESCENDING)], name="job_started_at"),
+    ],
+    "invoice_templates": [
+        IndexModel([("template_id", ASCENDING)], name="template_id_unique", unique=True),
+    ],
+    "logo_config": [
+        IndexModel([("config_id", ASCENDING)], name="config_id_unique", unique=True),
+    ],
+}
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase) -> Dict[str, List[str]]:
+    """Create every declared index. Returns the indexes that could not be created, per collection"""
+    failed: Dict[str, List[str]] = {}
+
+    for collection, models in INDEXES.items():
+        for model in models:
+            name = model.document["name"]
+            try:
+                # Uno por uno: un índice inválido (p. ej. duplicados en un unique) no bloquea al resto
+                await db[collection].create_indexes([model])
+            except OperationFailure as e:
+                logger.warning(f"No se pudo crear el índice {collection}.{name}: {e}")
+                failed.setdefault(collection, []).append(name)
+
+    return failed
+
+
+async def verify_indexes(db: AsyncIOMotorDatabase) -> Dict[str, dict]:
+    """Compare declared indexes with the ones in the database, reporting missing, unused and undeclared indexes"""
+    report = {}
+
+    for collection, models in INDEXES.items():
+        declared = [m.document["name"] for m in models]
+        existing = [ix["name"] async for ix in db[collection].list_indexes()]
+
+        # $indexStats no está disponible en todos los planes de Atlas
+        try:
+            stats = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+            unused = sorted(
+                s["name"] for s in stats
+                if s["name"] != "_id_" and s.get("accesses", {}).get("ops", 0) == 0
+            )
+        except OperationFailure:
+            unused = None
+
+        report[collection] = {
+            "missing": [name for name in declared if name not in existing],
+            "unused": unused,
+            "undeclared": [name for name in existing if name != "_id_" and name not in declared],
+        }
+
+    return report
+
+
+async def bootstrap_indexes(db: AsyncIOMotorDatabase) -> None:
+    """Ensure and verify indexes on startup, logging anything that needs attention"""
+    try:
+        await ensure_indexes(db)
+        report = await verify_indexes(db)
+    except PyMongoError as e:
+        # Sin conexión a la base de datos: la API arranca igual, como antes
+        logger.error(f"No se pudieron verificar los índices: {e}")
+        return
+
+    for collection, result in report.items():
+        if result["missing"]:
+            logger.warning(f"Índices faltantes en {collection}: {', '.join(result['missing'])}")
+        if result["unused"]:
+            logger.info(f"Índices sin uso en {collection}: {', '.join(result['unused'])}")
@@ -0,0 +1,361 @@
+from motor.motor_asyncio import AsyncIOMotorClientSession, AsyncIOMotorCollection, AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+from backend.database import transaction
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+INVOICE_COUNTER_ID = "main_counter"
+INVOICE_START_NUMBER = 1600  # Comenzar desde 1600
+MAX_ALLOCATION_ATTEMPTS = 100  # Evitar bucle infinito si hay muchos números manuales seguidos
+MAX_TRANSIENT_RETRIES = 5  # Conflictos de escritura con otras transacciones (mismo propietario o villa)
+
+# Escrituras adicionales que deben confirmarse junto con el documento: reciben el
+# número de factura asignado y la sesión de la transacción (None sin transacciones)
+SideEffects = Callable[[str, Optional[AsyncIOMotorClientSession]], Awaitable[None]]
+
+
+async def allocate_invoice_numbers(db: AsyncIOMotorDatabase, count: int = 1) -> int:
+    """Atomically reserve `count` consecutive invoice numbers and return the first one.
+
+    Un solo find_one_and_update: el pipeline inicializa el contador si no existe,
+    así que no hay lectura previa ni ventana para que dos peticiones obtengan el mismo número.
+    """
+    counter = await db.invoice_counter.find_one_and_update(
+        {"counter_id": INVOICE_COUNTER_ID},
+        [{"$set": {"current_number": {"$add": [
+            {"$ifNull": ["$current_number", INVOICE_START_NUMBER]}, count
+        ]}}}],
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["current_number"] - count
+
+
+class InvoiceNumberLease:
+    """Block of invoice numbers leased by this worker from invoice_counter.
+
+    Cada worker de uvicorn toma `size` números de una vez y los entrega localmente,
+    de modo que el documento invoice_counter solo se toca una vez por bloque.
+    Los números se entregan en orden dentro de cada worker, pero entre workers
+    pueden intercalarse.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._next: Optional[int] = None
+        self._end: Optional[int] = None
+        self._lock = asyncio.Lock()
+
+    async def next_number(self, db: AsyncIOMotorDatabase) -> int:
+        """Hand out the next number of the current block, leasing a new block when exhausted"""
+        async with self._lock:
+            if self._next is None or self._next >= self._end:
+                start = await allocate_invoice_numbers(db, self.size)
+                self._next, self._end = start, start + self.size
+            number = self._next
+            self._next += 1
+            return number
+
+    async def release(self, db: AsyncIOMotorDatabase) -> None:
+        """Return the unused part of the block to the counter, or record it as voided"""
+        async with self._lock:
+            if self._next is None or self._next >= self._end:
+                return
+            unused = list(range(self._next, self._end))
+
+            # Si nadie tomó números después de este bloque, se devuelven al contador
+            result = await db.invoice_counter.update_one(
+                {"counter_id": INVOICE_COUNTER_ID, "current_number": self._end},
+                {"$set": {"current_number": self._next}}
+            )
+            if result.modified_count == 0:
+                voided_at = datetime.now(timezone.utc)
+                await db.invoice_voided.insert_many([
+                    {"invoice_number": str(n), "reason": "lease_released", "voided_at": voided_at}
+                    for n in unused
+                ])
+                logger.info(f"Números de factura anulados al liberar bloque: {unused[0]}-{unused[-1]}")
+
+            self._next = self._end = None
+
+
+async def next_invoice_number(db: AsyncIOMotorDatabase, lease: Optional[InvoiceNumberLease] = None) -> int:
+    """Next invoice number, from the worker lease when one is configured"""
+    if lease is not None:
+        return await lease.next_number(db)
+    return await allocate_invoice_numbers(db)
+
+
+async def void_invoice_numbers(db: AsyncIOMotorDatabase, invoice_numbers: List[str], reason: str) -> None:
+    """Record numbers taken from the counter that will never be used, so the gaps are accounted for"""
+    if not invoice_numbers:
+        return
+    voided_at = datetime.now(timezone.utc)
+    try:
+        await db.invoice_voided.insert_many([
+            {"invoice_number": number, "reason": reason, "voided_at": voided_at} for number in invoice_numbers
+        ])
+    except PyMongoError as e:
+        # No debe ocultar el error original de la inserción
+        logger.error(f"No se pudieron anular los números de factura {', '.join(invoice_numbers)}: {e}")
+        return
+    logger.warning(f"Números de factura anulados ({reason}): {', '.join(invoice_numbers)}")
+
+
+async def void_invoice_number(db: AsyncIOMotorDatabase, invoice_number: Optional[str], reason: str) -> None:
+    """Single-number variant of void_invoice_numbers; does nothing for None"""
+    if invoice_number is not None:
+        await void_invoice_numbers(db, [invoice_number], reason)
+
+
+def is_invoice_number_conflict(error: DuplicateKeyError) -> bool:
+    """Whether a duplicate key error was raised by the invoice_number unique index"""
+    key_pattern = (error.details or {}).get("keyPattern") or {}
+    return "invoice_number" in key_pattern or "invoice_number" in str(error)
+
+
+# ============ INVOICE NUMBER REGISTRY ============
+# invoice_numbers tiene una entrada por número usado (reservación o abono), con
+# índice único sobre invoice_number: comprobar o reservar un número es una sola
+# operación indexada en lugar de buscar en tres colecciones.
+#
+# Entrada: {"invoice_number", "kind", "document_id", "reservation_id", "expense_id", "created_at"}
+# kind: "reservation" | "reservation_abono" | "expense_abono"
+
+INVOICE_KIND_COLLECTIONS = {
+    "reservation": "reservations",
+    "reservation_abono": "reservation_abonos",
+    "expense_abono": "expense_abonos",
+}
+
+
+def invoice_entry(kind: str, document_id: str, reservation_id: Optional[str] = None, expense_id: Optional[str] = None) -> dict:
+    """Build the registry entry describing who owns an invoice number"""
+    return {
+        "kind": kind,
+        "document_id": document_id,
+        "reservation_id": reservation_id,
+        "expense_id": expense_id,
+    }
+
+
+async def claim_invoice_number(
+    db: AsyncIOMotorDatabase,
+    invoice_number: str,
+    entry: dict,
+    session: Optional[AsyncIOMotorClientSession] = None,
+) -> None:
+    """Claim a number in the registry. Raises DuplicateKeyError if it is already taken"""
+    await db.invoice_numbers.insert_one({
+        "invoice_number": invoice_number,
+        **entry,
+        "created_at": datetime.now(timezone.utc),
+    }, session=session)
+
+
+async def register_invoice_number(db: AsyncIOMotorDatabase, invoice_number: str, entry: dict) -> None:
+    """Record a number that is already in use (imports, backfill); keeps an existing entry untouched"""
+    await db.invoice_numbers.update_one(
+        {"invoice_number": invoice_number},
+        {"$setOnInsert": {**entry, "created_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+async def _insert_claimed(
+    db: AsyncIOMotorDatabase,
+    collection: AsyncIOMotorCollection,
+    doc: dict,
+    invoice_number: str,
+    entry: dict,
+    side_effects: Optional[SideEffects] = None,
+) -> None:
+    """Claim `invoice_number`, insert `doc` with it and run `side_effects`, as one transaction.
+
+    Sin transacciones (standalone) se deshace a mano el documento y el número;
+    las escrituras de `side_effects` que alcanzaron a hacerse quedan.
+    """
+    async with transaction(db) as session:
+        # Si el número está tomado falla aquí, antes de escribir nada más
+        await claim_invoice_number(db, invoice_number, entry, session)
+        inserted = False
+        try:
+            doc["invoice_number"] = invoice_number
+            await collection.insert_one(doc, session=session)
+            inserted = True
+            if side_effects is not None:
+                await side_effects(invoice_number, session)
+        except Exception:
+            if session is None:
+                if inserted:
+                    await collection.delete_one({"_id": doc["_id"]})
+                await db.invoice_numbers.delete_one({"invoice_number": invoice_number})
+            raise
+
+
+def is_unknown_commit(error: BaseException) -> bool:
+    """Whether the transaction commit failed without telling if it was applied"""
+    return isinstance(error, PyMongoError) and error.has_error_label("UnknownTransactionCommitResult")
+
+
+async def claim_committed(db: AsyncIOMotorDatabase, invoice_number: str, entry: dict) -> Optional[bool]:
+    """After an unknown commit result: whether the claim for this document is in the registry. None if it cannot be read"""
+    try:
+        claim = await db.invoice_numbers.find_one(
+            {"invoice_number": invoice_number, "document_id": entry["document_id"]}, {"_id": 1}
+        )
+    except PyMongoError as e:
+        logger.error(f"No se pudo comprobar la factura {invoice_number} tras un commit incierto: {e}")
+        return None
+    return claim is not None
+
+
+async def insert_with_invoice_number(
+    db: AsyncIOMotorDatabase,
+    collection: AsyncIOMotorCollection,
+    doc: dict,
+    entry: dict,
+    lease: Optional[InvoiceNumberLease] = None,
+    side_effects: Optional[SideEffects] = None,
+) -> str:
+    """Claim the next free invoice number, insert `doc` with it and return the number used.
+
+    El índice único del registro es la garantía: si el número ya fue usado
+    manualmente por un admin, la reserva del número falla y se toma el siguiente.
+    Cada intento es una transacción nueva, así que un intento fallido no deja nada escrito.
+    Un conflicto de escritura transitorio reintenta con el mismo número: el
+    contador ya avanzó y pedir otro dejaría un hueco en la numeración. Si el
+    commit queda incierto, el registro dice si se aplicó; solo se anula el
+    número cuando se sabe que no se usó.
+    """
+    invoice_number = None
+    try:
+        for _ in range(MAX_ALLOCATION_ATTEMPTS):
+            if invoice_number is None:
+                invoice_number = str(await next_invoice_number(db, lease))
+            try:
+                await _insert_claimed(db, collection, doc, invoice_number, entry, side_effects)
+                return invoice_number
+            except DuplicateKeyError as e:
+                # Número ya registrado, o número antiguo aún no registrado: probar el siguiente
+                if not is_invoice_number_conflict(e):
+                    raise
+                invoice_number = None
+            except PyMongoError as e:
+                # Conflicto de escritura con otra transacción (p. ej. la deuda del mismo propietario)
+                if not e.has_error_label("TransientTransactionError"):
+                    raise
+            doc.pop("_id", None)
+    except Exception as e:
+        if invoice_number is not None and is_unknown_commit(e):
+            committed = await claim_committed(db, invoice_number, entry)
+            if committed:
+                return invoice_number
+            if committed is None:
+                # No se sabe si el número quedó en uso: no se anula
+                raise
+        # El número tomado del contador no llegó a usarse: queda registrado como anulado
+        await void_invoice_number(db, invoice_number, "insert_failed")
+        raise
+
+    await void_invoice_number(db, invoice_number, "insert_failed")
+    raise RuntimeError("No se encontró un número de factura disponible")
+
+
+async def insert_with_manual_invoice_number(
+    db: AsyncIOMotorDatabase,
+    collection: AsyncIOMotorCollection,
+    doc: dict,
+    invoice_number: str,
+    entry: dict,
+    side_effects: Optional[SideEffects] = None,
+) -> None:
+    """Insert `doc` with an admin-provided number. Raises DuplicateKeyError if the number is taken"""
+    for attempt in range(MAX_TRANSIENT_RETRIES):
+        try:
+            await _insert_claimed(db, collection, doc, invoice_number, entry, side_effects)
+            return
+        except DuplicateKeyError:
+            raise
+        except PyMongoError as e:
+            if is_unknown_commit(e) and await claim_committed(db, invoice_number, entry):
+                return
+            # Conflicto de escritura con otra transacción: reintentar con el mismo número
+            if not e.has_error_label("TransientTransactionError") or attempt == MAX_TRANSIENT_RETRIES - 1:
+                raise
+        doc.pop("_id", None)
+
+
+async def claim_invoice_numbers(db: AsyncIOMotorDatabase, claims: List[Tuple[str, dict]]) -> Set[str]:
+    """Claim many (number, entry) pairs with one insert_many. Returns the numbers already taken"""
+    if not claims:
+        return set()
+    created_at = datetime.now(timezone.utc)
+    try:
+        await db.invoice_numbers.insert_many(
+            [{"invoice_number": number, **entry, "created_at": created_at} for number, entry in claims],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        taken = set()
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                raise
+            taken.add(claims[error["index"]][0])
+        return taken
+    return set()
+
+
+async def claim_next_invoice_numbers(db: AsyncIOMotorDatabase, entries: List[dict]) -> List[str]:
+    """Allocate and claim one number per entry, a block at a time. Numbers already taken are skipped"""
+    numbers: List[Optional[str]] = [None] * len(entries)
+    pending = list(range(len(entries)))
+
+    for _ in range(MAX_ALLOCATION_ATTEMPTS):
+        if not pending:
+            return numbers
+        start = await allocate_invoice_numbers(db, len(pending))
+        claims = [(str(start + offset), entries[i]) for offset, i in enumerate(pending)]
+        taken = await claim_invoice_numbers(db, claims)
+        for (number, _), i in zip(claims, pending):
+            if number not in taken:
+                numbers[i] = number
+        pending = [i for i in pending if numbers[i] is None]
+
+    raise RuntimeError("No se encontró un número de factura disponible")
+
+
+async def rebuild_invoice_registry(db: AsyncIOMotorDatabase, batch_size: int = 1000) -> int:
+    """Backfill the registry from reservations and abonos. Idempotent; returns the entries inserted"""
+    inserted = 0
+
+    for kind, collection in INVOICE_KIND_COLLECTIONS.items():
+        cursor = db[collection].find(
+            {"invoice_number": {"$type": "string"}},
+            {"_id": 0, "id": 1, "invoice_number": 1, "reservation_id": 1, "expense_id": 1},
+        ).batch_size(batch_size)
+
+        batch = []
+        async for doc in cursor:
+            reservation_id = doc["id"] if kind == "reservation" else doc.get("reservation_id")
+            entry = invoice_entry(kind, doc["id"], reservation_id, doc.get("expense_id"))
+            batch.append(UpdateOne(
+                {"invoice_number": doc["invoice_number"]},
+                {"$setOnInsert": {**entry, "created_at": datetime.now(timezone.utc)}},
+                upsert=True,
+            ))
+            if len(batch) >= batch_size:
+                result = await db.invoice_numbers.bulk_write(batch, ordered=False)
+                inserted += result.upserted_count
+                batch = []
+
+        if batch:
+            result = await db.invoice_numbers.bulk_write(batch, ordered=False)
+            inserted += result.upserted_count
+
+    return inserted
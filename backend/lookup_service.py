@@ -0,0 +1,21 @@
+"""
+Joins por lotes entre colecciones
+Una sola consulta $in por página en lugar de un find_one por documento
+"""
+from typing import Dict, Iterable, Optional
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+
+async def fetch_by_ids(
+    collection: AsyncIOMotorCollection,
+    ids: Iterable[Optional[str]],
+    projection: Optional[Dict[str, int]] = None,
+) -> Dict[str, dict]:
+    """Fetch the documents with the given ids in one query, keyed by id"""
+    unique_ids = list({i for i in ids if i})
+    if not unique_ids:
+        return {}
+    fields = {"_id": 0, "id": 1, **(projection or {})} if projection else {"_id": 0}
+    docs = await collection.find({"id": {"$in": unique_ids}}, fields).to_list(None)
+    return {doc["id"]: doc for doc in docs}
+
@@ -0,0 +1,107 @@
+"""
+Migración de fechas ISO (string) a fechas nativas de BSON
+Se ejecuta por lotes al arrancar y termina antes de atender peticiones: las
+consultas por rango de fechas (conflictos, disponibilidad, cursores) solo
+encuentran fechas nativas. Una vez completada, los arranques siguientes la saltan.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+import logging
+
+logger = logging.getLogger(__name__)
+
+DATETIME_MIGRATION = "native_datetimes"
+
+# Campos de fecha por colección
+DATETIME_FIELDS: Dict[str, List[str]] = {
+    "users": ["created_at"],
+    "customers": ["created_at"],
+    "categories": ["created_at"],
+    "expense_categories": ["created_at"],
+    "villas": ["created_at"],
+    "extra_services": ["created_at"],
+    "reservations": ["reservation_date", "created_at", "updated_at"],
+    "reservation_abonos": ["payment_date", "created_at"],
+    "expenses": ["expense_date", "reservation_check_in", "created_at"],
+    "expense_abonos": ["payment_date", "created_at"],
+    "villa_owners": ["created_at"],
+    "owner_payments": ["payment_date"],
+    "invoice_templates": ["created_at", "updated_at"],
+    "logo_config": ["uploaded_at"],
+}
+
+
+def parse_datetime_string(value: str) -> Optional[datetime]:
+    """Parse an ISO string as stored by the old code; naive values are taken as UTC"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+async def migrate_collection_datetimes(
+    db: AsyncIOMotorDatabase,
+    collection: str,
+    fields: List[str],
+    batch_size: int = 500,
+) -> int:
+    """Convert string dates of one collection to native dates. Returns the fields converted"""
+    converted = 0
+
+    for field in fields:
+        cursor = db[collection].find(
+            {field: {"$type": "string"}},
+            {"_id": 1, field: 1},
+        ).batch_size(batch_size)
+
+        batch = []
+        async for doc in cursor:
+            parsed = parse_datetime_string(doc[field])
+            if parsed is None:
+                logger.warning(f"Fecha inválida en {collection}.{field} ({doc['_id']}): {doc[field]!r}")
+                continue
+            # Solo si el valor no cambió mientras tanto: una escritura concurrente gana
+            batch.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: parsed}}))
+            if len(batch) >= batch_size:
+                result = await db[collection].bulk_write(batch, ordered=False)
+                converted += result.modified_count
+                batch = []
+
+        if batch:
+            result = await db[collection].bulk_write(batch, ordered=False)
+            converted += result.modified_count
+
+    return converted
+
+
+async def migrate_datetimes(db: AsyncIOMotorDatabase, batch_size: int = 500) -> Dict[str, int]:
+    """Convert every known date field to native dates and record the run. Idempotent"""
+    started_at = datetime.now(timezone.utc)
+    results = {}
+
+    for collection, fields in DATETIME_FIELDS.items():
+        results[collection] = await migrate_collection_datetimes(db, collection, fields, batch_size)
+        if results[collection]:
+            logger.info(f"Migración de fechas: {results[collection]} campos convertidos en {collection}")
+
+    await db.migrations.update_one(
+        {"name": DATETIME_MIGRATION},
+        {"$set": {
+            "started_at": started_at,
+            "completed_at": datetime.now(timezone.utc),
+            "converted": sum(results.values()),
+        }},
+        upsert=True
+    )
+    return results
+
+
+async def is_migration_complete(db: AsyncIOMotorDatabase, name: str) -> bool:
+    """Whether a migration has completed at least once"""
+    record = await db.migrations.find_one({"name": name, "completed_at": {"$ne": None}}, {"_id": 1})
+    return record is not None
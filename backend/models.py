@@ -43,6 +43,16 @@ class CustomerBase(BaseModel):
 class CustomerCreate(CustomerBase):
     pass
 
+class CustomerUpdate(BaseModel):
+    name: Optional[str] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    identification: Optional[str] = None
+    identification_document: Optional[str] = None
+    dni: Optional[str] = None
+    address: Optional[str] = None
+    notes: Optional[str] = None
+
 class Customer(CustomerBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -226,16 +236,37 @@ class ReservationUpdate(BaseModel):
     currency: Optional[Literal["DOP", "USD"]] = None
     notes: Optional[str] = None
     status: Optional[Literal["pending", "confirmed", "completed", "cancelled"]] = None
+    version: Optional[int] = None  # Versión leída por el cliente; si no coincide -> 409
 
 class Reservation(ReservationBase):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     invoice_number: str  # Comenzará desde 1600
     balance_due: float  # Calculated: total_amount - amount_paid
+    customer_identification_document: Optional[str] = None  # Copia del cliente (ver customer_sync_service)
+    version: int = 1  # Se incrementa en cada escritura (concurrencia optimista)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     created_by: str  # user_id
 
+class ReservationBulkCreate(BaseModel):
+    reservations: List[ReservationCreate] = Field(..., min_length=1, max_length=500)
+
+class BulkDeleteRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=1000)
+
+class BulkItemResult(BaseModel):
+    index: int  # Posición en la petición
+    id: Optional[str] = None
+    success: bool
+    invoice_number: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
+
 # ============ VILLA OWNER MODELS ============
 class VillaOwnerBase(BaseModel):
     name: str
@@ -340,6 +371,7 @@ class ExpenseUpdate(BaseModel):
     has_payment_reminder: Optional[bool] = None
     payment_reminder_day: Optional[int] = None
     is_recurring: Optional[bool] = None
+    version: Optional[int] = None  # Versión leída por el cliente; si no coincide -> 409
 
 class Expense(ExpenseBase):
     model_config = ConfigDict(extra="ignore")
@@ -348,6 +380,16 @@ class Expense(ExpenseBase):
     created_by: str
     total_paid: float = 0  # Total de abonos pagados
     balance_due: float = 0  # Saldo restante (puede ser negativo si se paga de más)
+    recurring_template_id: Optional[str] = None  # Gasto recurrente del que se generó este
+    recurring_period: Optional[str] = None  # Mes generado, "YYYY-MM"
+    version: int = 1  # Se incrementa en cada escritura (concurrencia optimista)
+
+class ExpenseReminders(BaseModel):
+    """Pending expenses already due and due within the requested window, oldest first"""
+    overdue: List[Expense]
+    upcoming: List[Expense]
+    overdue_count: int  # Totales aunque las listas se corten en `limit`
+    upcoming_count: int
 
 # ============ INVOICE COUNTER MODEL ============
 class InvoiceCounter(BaseModel):
@@ -0,0 +1,159 @@
+"""
+Paginación por cursor (keyset) para los listados
+El cursor codifica los valores de ordenamiento del último documento de la página;
+la página siguiente empieza justo después, usando el índice del ordenamiento.
+"""
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Tuple, Type
+from fastapi import HTTPException, Response
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pydantic import BaseModel
+import base64
+import json
+
+from backend.serialization import (
+    NDJSON_BATCH_SIZE, fast_json_response, fields_projection, json_array_response, ndjson_response,
+    parse_fields
+)
+
+MAX_PAGE_SIZE = 1000
+
+SortSpec = List[Tuple[str, int]]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    # Solo escalares o {"$date": "..."}: cualquier otro objeto llegaría a la consulta como operador
+    if isinstance(value, dict):
+        if set(value) != {"$date"} or not isinstance(value["$date"], str):
+            raise ValueError("Invalid cursor value")
+        return datetime.fromisoformat(value["$date"])
+    if isinstance(value, list):
+        raise ValueError("Invalid cursor value")
+    return value
+
+
+def encode_cursor(doc: dict, sort: SortSpec) -> str:
+    """Opaque cursor pointing right after `doc` in the given sort order"""
+    values = [_encode_value(doc.get(field)) for field, _ in sort]
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort: SortSpec) -> List[Any]:
+    """Decode a cursor produced by encode_cursor. Raises 400 if it is not valid"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(sort):
+            raise ValueError("Invalid cursor length")
+        return [_decode_value(v) for v in values]
+    except (ValueError, UnicodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after(field: str, direction: int, value: Any, nullable: Iterable[str]) -> Optional[dict]:
+    """Condition "strictly after `value`" on one sort field. None if nothing can come after"""
+    op = "$gt" if direction == 1 else "$lt"
+    if field not in nullable:
+        return {field: {op: value}}
+    # Mongo ordena null antes que cualquier otro valor: primero al ascender, último al descender
+    if value is None:
+        return {field: {"$ne": None}} if direction == 1 else None
+    if direction == 1:
+        return {field: {op: value}}
+    return {"$or": [{field: {op: value}}, {field: None}]}
+
+
+def keyset_filter(query: dict, sort: SortSpec, values: List[Any], nullable: Iterable[str] = ()) -> dict:
+    """Combine `query` with the condition "after these sort values".
+
+    Para (a, b): a > va OR (a == va AND b > vb), con $lt en los campos descendentes.
+    Los campos de `nullable` pueden faltar: esos documentos se recorren también.
+    """
+    branches = []
+    for i, (field, direction) in enumerate(sort):
+        after = _after(field, direction, values[i], nullable)
+        if after is None:
+            continue
+        branches.append({**{f: values[j] for j, (f, _) in enumerate(sort[:i])}, **after})
+
+    condition = {"$or": branches}
+    return {"$and": [query, condition]} if query else condition
+
+
+async def paginate(
+    collection: AsyncIOMotorCollection,
+    query: dict,
+    sort: SortSpec,
+    projection: dict,
+    limit: int,
+    cursor: Optional[str] = None,
+    nullable: Iterable[str] = (),
+) -> Tuple[List[dict], Optional[str]]:
+    """Fetch one page sorted by `sort` (which must end in a unique field). Returns (docs, next_cursor)"""
+    filter_ = keyset_filter(query, sort, decode_cursor(cursor, sort), nullable) if cursor else query
+    find = collection.find(filter_, projection).sort(sort)
+
+    # Se pide un documento de más para saber si hay otra página
+    docs = await find.limit(limit + 1).to_list(None)
+    if len(docs) <= limit:
+        return docs, None
+    docs = docs[:limit]
+    return docs, encode_cursor(docs[-1], sort)
+
+
+async def count_total(collection: AsyncIOMotorCollection, query: dict) -> int:
+    """Total for the X-Total-Count header: collection metadata when unfiltered, indexed count otherwise"""
+    if not query:
+        return await collection.estimated_document_count()
+    return await collection.count_documents(query)
+
+
+async def paginated_response(
+    collection: AsyncIOMotorCollection,
+    query: dict,
+    sort: SortSpec,
+    model: Type[BaseModel],
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    stream: bool = False,
+    nullable: Iterable[str] = (),
+) -> Response:
+    """Run a paginated query and serialize it with the fast path.
+
+    El total solo se calcula en la primera página (sin cursor); X-Next-Cursor
+    aparece mientras haya más resultados. `fields` (?fields=) se convierte en la
+    proyección de Mongo; los campos del ordenamiento se leen igual porque el
+    cursor los necesita, pero no se envían. Con `stream` se envía todo lo que
+    queda después del cursor como NDJSON, lote por lote; sin `limit` se envía
+    como un arreglo JSON, también por lotes, para no cargar la colección entera.
+    `nullable` lista los campos del ordenamiento que algunos documentos no tienen.
+    """
+    requested = parse_fields(fields, model)
+    projection = fields_projection(model, requested, [f for f, _ in sort])
+
+    if stream or limit is None:
+        filter_ = keyset_filter(query, sort, decode_cursor(cursor, sort), nullable) if cursor else query
+        find = collection.find(filter_, projection).sort(sort).batch_size(NDJSON_BATCH_SIZE)
+        if stream:
+            if limit is not None:
+                find = find.limit(limit)
+            return ndjson_response(find, model, requested)
+        headers = {"X-Total-Count": str(await count_total(collection, query))} if cursor is None else None
+        return json_array_response(find, model, requested, headers=headers)
+
+    docs, next_cursor = await paginate(collection, query, sort, projection, limit, cursor, nullable)
+
+    headers = {}
+    if cursor is None:
+        # Si la primera página trae todo, el total ya se conoce
+        total = len(docs) if next_cursor is None else await count_total(collection, query)
+        headers["X-Total-Count"] = str(total)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return fast_json_response(docs, model, requested, headers=headers)
@@ -0,0 +1,181 @@
+"""
+Gastos recurrentes
+Un gasto con is_recurring=True es la plantilla: cada mes se crea una copia
+pendiente (recurring_template_id, recurring_period "YYYY-MM") con fecha en el
+payment_reminder_day del mes. El índice único sobre ese par hace que generar
+dos veces el mismo mes no duplique nada; los meses que se saltaron (servidor
+apagado) se recuperan en la siguiente corrida.
+
+Antes de esto el personal volvía a cargar cada mes el gasto con "Recurrente"
+marcado, así que una misma serie tiene varias plantillas: se agrupan por serie
+(categoría, descripción, moneda) y cada mes se genera una sola vez por serie,
+a partir de la plantilla más reciente. Las plantillas que ya existían al
+activar esto quedan al día en el mes de activación: solo se recuperan los
+meses perdidos desde entonces.
+"""
+from calendar import monthrange
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateMany
+from pymongo.errors import BulkWriteError
+import logging
+
+from backend.models import Expense, ExpenseBase
+from backend.database import prepare_doc_for_insert
+from backend.migration_service import is_migration_complete
+
+logger = logging.getLogger(__name__)
+
+MAX_CATCH_UP_PERIODS = 12  # meses atrasados que se recuperan como máximo
+DUPLICATE_KEY = 11000
+
+RECURRING_GO_LIVE_MIGRATION = "recurring_expenses_go_live"
+
+TEMPLATE_QUERY = {"is_recurring": True, "recurring_template_id": None}
+
+
+def period_of(value: datetime) -> Tuple[int, int]:
+    return value.year, value.month
+
+
+def next_period(period: Tuple[int, int]) -> Tuple[int, int]:
+    year, month = period
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def period_key(period: Tuple[int, int]) -> str:
+    return f"{period[0]:04d}-{period[1]:02d}"
+
+
+def parse_period(key: str) -> Tuple[int, int]:
+    year, month = key.split("-")
+    return int(year), int(month)
+
+
+def due_date(template: dict, period: Tuple[int, int]) -> datetime:
+    """Date of the period's instance: payment_reminder_day (or the template's day), clamped to the month"""
+    year, month = period
+    day = template.get("payment_reminder_day") or template["expense_date"].day
+    return datetime(year, month, min(max(day, 1), monthrange(year, month)[1]), tzinfo=timezone.utc)
+
+
+def covered_through(template: dict) -> Tuple[int, int]:
+    """Last period a template already accounts for: its own month, the month it was entered, or the last generated"""
+    periods = [period_of(template["expense_date"])]
+    if isinstance(template.get("created_at"), datetime):
+        periods.append(period_of(template["created_at"]))
+    if template.get("recurring_generated_through"):
+        periods.append(parse_period(template["recurring_generated_through"]))
+    return max(periods)
+
+
+def pending_periods(last: Tuple[int, int], current: Tuple[int, int]) -> List[Tuple[int, int]]:
+    """Periods after `last` up to the current one, at most MAX_CATCH_UP_PERIODS"""
+    period = last
+    periods = []
+    while period < current:
+        period = next_period(period)
+        periods.append(period)
+    return periods[-MAX_CATCH_UP_PERIODS:]
+
+
+def series_key(template: dict) -> Tuple:
+    """Templates re-entered by hand for the same commitment share this key"""
+    return (
+        template.get("category"),
+        template.get("expense_category_id"),
+        (template.get("description") or "").strip().lower(),
+        template.get("currency"),
+    )
+
+
+def group_series(templates: List[dict]) -> List[Tuple[dict, Tuple[int, int], List[str]]]:
+    """(latest template, last covered period, template ids) per series"""
+    series: Dict[Tuple, List[dict]] = {}
+    for template in templates:
+        series.setdefault(series_key(template), []).append(template)
+    grouped = []
+    for members in series.values():
+        latest = max(members, key=lambda t: (t["expense_date"], covered_through(t)))
+        grouped.append((latest, max(covered_through(t) for t in members), [t["id"] for t in members]))
+    return grouped
+
+
+async def mark_existing_templates(db: AsyncIOMotorDatabase, current: Tuple[int, int]) -> None:
+    """On the first run, treat templates entered before the generator existed as covered through this month"""
+    if await is_migration_complete(db, RECURRING_GO_LIVE_MIGRATION):
+        return
+    result = await db.expenses.update_many(
+        {**TEMPLATE_QUERY, "recurring_generated_through": None},
+        {"$set": {"recurring_generated_through": period_key(current)}}
+    )
+    await db.migrations.update_one(
+        {"name": RECURRING_GO_LIVE_MIGRATION},
+        {"$set": {"completed_at": datetime.now(timezone.utc), "templates": result.modified_count}},
+        upsert=True
+    )
+
+
+def build_instance(template: dict, period: Tuple[int, int]) -> dict:
+    """New pending expense for one period of a template"""
+    fields = {name: template[name] for name in ExpenseBase.model_fields if name in template}
+    expense = Expense(
+        **{
+            **fields,
+            "expense_date": due_date(template, period),
+            "payment_status": "pending",
+            "is_recurring": False,
+            "reservation_check_in": None,
+        },
+        balance_due=template.get("amount", 0),
+        recurring_template_id=template["id"],
+        recurring_period=period_key(period),
+        created_by=template.get("created_by") or "system",
+    )
+    return prepare_doc_for_insert(expense.model_dump())
+
+
+async def materialize_recurring_expenses(db: AsyncIOMotorDatabase, now: datetime = None) -> Dict:
+    """Create the missing monthly instances of every recurring series with one bulk insert. Idempotent"""
+    current = period_of(now or datetime.now(timezone.utc))
+    await mark_existing_templates(db, current)
+
+    templates = [
+        t async for t in db.expenses.find(TEMPLATE_QUERY, {"_id": 0})
+        if t.get("id") and isinstance(t.get("expense_date"), datetime)
+    ]
+    instances = []
+    marks = []
+    skipped = []
+    for template, last, template_ids in group_series(templates):
+        periods = pending_periods(last, current)
+        if not periods:
+            continue
+        try:
+            series_instances = [build_instance(template, period) for period in periods]
+        except (ValueError, TypeError, KeyError) as e:
+            # Datos que nunca se validaron (p. ej. importados de Excel): se omite esta serie, no la corrida
+            logger.warning(f"Plantilla de gasto recurrente {template['id']} omitida: {e}")
+            skipped.append({"template_id": template["id"], "error": f"{type(e).__name__}: {e}"})
+            continue
+        instances.extend(series_instances)
+        marks.append(UpdateMany(
+            {"id": {"$in": template_ids}}, {"$set": {"recurring_generated_through": period_key(periods[-1])}}
+        ))
+
+    created = len(instances)
+    if instances:
+        try:
+            await db.expenses.insert_many(instances, ordered=False)
+        except BulkWriteError as e:
+            # Periodos que ya existían (otra corrida o carga manual): se ignoran
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != DUPLICATE_KEY for err in errors):
+                raise
+            created -= len(errors)
+        await db.expenses.bulk_write(marks, ordered=False)
+
+    if created:
+        logger.info(f"Gastos recurrentes creados: {created}")
+    return {"created": created, "series": len(marks), "skipped": skipped}
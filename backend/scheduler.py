@@ -0,0 +1,119 @@
+"""
+Tareas programadas dentro del proceso de la API
+Cada worker revisa periódicamente las tareas; el documento de la tarea en
+scheduled_jobs funciona como candado (next_run_at), así que con varios workers
+cada ejecución la hace uno solo. Cada ejecución queda registrada en job_runs.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import asyncio
+import logging
+import os
+import socket
+
+from backend.database import VERSION_BUMP
+from backend.recurring_expense_service import materialize_recurring_expenses
+
+logger = logging.getLogger(__name__)
+
+TICK_SECONDS = int(os.environ.get("SCHEDULER_TICK_SECONDS", "60"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Una reservación confirmada pasa a completada cuando su fecha quedó atrás por
+# estas horas (margen para amanecidas que terminan la mañana siguiente)
+COMPLETE_AFTER_HOURS = int(os.environ.get("RESERVATION_COMPLETE_AFTER_HOURS", "36"))
+
+
+@dataclass
+class Job:
+    name: str
+    interval: timedelta
+    run: Callable[[AsyncIOMotorDatabase], Awaitable[Dict]]
+
+
+async def complete_past_reservations(db: AsyncIOMotorDatabase) -> Dict:
+    """confirmed -> completed once reservation_date has passed. Idempotent"""
+    now = datetime.now(timezone.utc)
+    result = await db.reservations.update_many(
+        {
+            "status": "confirmed",
+            "reservation_date": {"$lt": now - timedelta(hours=COMPLETE_AFTER_HOURS)},
+        },
+        [{"$set": {"status": "completed", "updated_at": {"$literal": now}, **VERSION_BUMP}}]
+    )
+    return {"completed": result.modified_count}
+
+
+JOBS: List[Job] = [
+    Job("complete_past_reservations", timedelta(hours=1), complete_past_reservations),
+    Job("materialize_recurring_expenses", timedelta(hours=6), materialize_recurring_expenses),
+]
+
+
+async def acquire_job(db: AsyncIOMotorDatabase, job: Job, now: datetime) -> bool:
+    """Take the job if it is due, moving next_run_at forward. Only one worker wins"""
+    try:
+        claimed = await db.scheduled_jobs.find_one_and_update(
+            {"name": job.name, "next_run_at": {"$lte": now}},
+            {"$set": {"next_run_at": now + job.interval, "locked_by": WORKER_ID, "last_started_at": now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # La tarea existe y todavía no toca (o la tomó otro worker)
+        return False
+    return claimed is not None
+
+
+async def run_job(db: AsyncIOMotorDatabase, job: Job) -> Optional[Dict]:
+    """Run the job if this worker gets it, recording the run in job_runs"""
+    started_at = datetime.now(timezone.utc)
+    if not await acquire_job(db, job, started_at):
+        return None
+
+    run = {"job": job.name, "worker": WORKER_ID, "started_at": started_at}
+    try:
+        run["result"] = await job.run(db)
+        run["status"] = "success"
+    except Exception as e:
+        # Cualquier error de la tarea queda en su corrida; no debe detener al planificador
+        run["status"] = "error"
+        run["error"] = f"{type(e).__name__}: {e}"
+        logger.exception(f"Tarea {job.name} falló: {e}")
+    run["finished_at"] = datetime.now(timezone.utc)
+
+    await db.job_runs.insert_one(dict(run))
+    await db.scheduled_jobs.update_one(
+        {"name": job.name},
+        {"$set": {"last_finished_at": run["finished_at"], "last_status": run["status"], "last_result": run.get("result")}}
+    )
+    if run.get("result"):
+        logger.info(f"Tarea {job.name}: {run['result']}")
+    return run
+
+
+async def run_scheduler(db: AsyncIOMotorDatabase) -> None:
+    """Check every TICK_SECONDS for due jobs. Runs for the life of the worker"""
+    while True:
+        for job in JOBS:
+            try:
+                await run_job(db, job)
+            except Exception as e:
+                # Base de datos caída al tomar o registrar la tarea: se reintenta en la siguiente vuelta
+                logger.error(f"No se pudo ejecutar la tarea {job.name}: {e}")
+        await asyncio.sleep(TICK_SECONDS)
+
+
+async def trigger_job(db: AsyncIOMotorDatabase, name: str) -> Optional[Dict]:
+    """Make a job due now and run it (admin endpoint). None if there is no such job"""
+    job = next((j for j in JOBS if j.name == name), None)
+    if job is None:
+        return None
+    await db.scheduled_jobs.update_one(
+        {"name": name}, {"$set": {"next_run_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    return await run_job(db, job) or {"job": name, "status": "running elsewhere"}
@@ -0,0 +1,166 @@
+"""
+Serialización rápida para listados
+Los documentos que salen de nuestra propia base de datos ya tienen la forma del
+modelo, así que se codifican directamente a bytes sin volver a validarlos.
+"""
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Type
+from functools import lru_cache
+from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
+from motor.motor_asyncio import AsyncIOMotorCursor
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined
+import json
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NDJSON_BATCH_SIZE = 200
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa json de la biblioteca estándar
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode content straight to JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """JSON response encoded with orjson when available"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def model_projection(model: Type[BaseModel]) -> Dict[str, int]:
+    """Mongo projection with exactly the fields of a model"""
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+
+@lru_cache(maxsize=None)
+def model_defaults(model: Type[BaseModel]) -> Dict[str, Any]:
+    """Static defaults of a model, to fill fields missing from older documents"""
+    return {
+        name: field.default
+        for name, field in model.model_fields.items()
+        if field.default is not PydanticUndefined
+    }
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[List[str]]:
+    """Validate a ?fields= list against the model fields. None means every field"""
+    if not fields:
+        return None
+    requested = list(dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()))
+    unknown = [f for f in requested if f not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def fields_projection(model: Type[BaseModel], fields: Optional[List[str]], extra: Iterable[str] = ()) -> Dict[str, int]:
+    """Mongo projection for the requested fields plus the ones the route needs internally"""
+    if fields is None:
+        return model_projection(model)
+    return {"_id": 0, **{name: 1 for name in (*fields, *extra)}}
+
+
+def document_shaper(model: Type[BaseModel], fields: Optional[List[str]] = None) -> Callable[[dict], dict]:
+    """Build the function that gives a database document its response shape.
+
+    Completa los valores por defecto del modelo (documentos antiguos) y, con
+    ?fields=, deja solo los campos pedidos.
+    """
+    defaults = model_defaults(model)
+    if fields is None:
+        return lambda doc: {**defaults, **doc}
+    return lambda doc: {name: doc[name] if name in doc else defaults.get(name) for name in fields}
+
+
+def fast_json_response(
+    docs: Iterable[dict],
+    model: Type[BaseModel],
+    fields: Optional[List[str]] = None,
+    **kwargs
+) -> FastJSONResponse:
+    """Serialize trusted database documents for a list route, skipping response_model validation.
+
+    Opt-in por ruta: al devolver una Response, FastAPI no revalida contra response_model.
+    Los documentos deben venir proyectados con fields_projection(model, fields).
+    """
+    shape = document_shaper(model, fields)
+    return FastJSONResponse([shape(doc) for doc in docs], **kwargs)
+
+
+def fast_json_document(doc: dict, model: Type[BaseModel], fields: Optional[List[str]] = None) -> FastJSONResponse:
+    """Single-document variant of fast_json_response, for detail routes"""
+    return FastJSONResponse(document_shaper(model, fields)(doc))
+
+
+def wants_ndjson(accept: Optional[str]) -> bool:
+    """Whether the client asked for a streamed NDJSON listing"""
+    return accept is not None and NDJSON_MEDIA_TYPE in accept
+
+
+async def _encoded_batches(cursor: AsyncIOMotorCursor, shape: Callable[[dict], dict], batch_size: int):
+    """Read a Motor cursor batch by batch, yielding each batch as a list of encoded documents"""
+    try:
+        while True:
+            docs = await cursor.to_list(batch_size)
+            if not docs:
+                break
+            yield [dumps(shape(doc)) for doc in docs]
+    finally:
+        await cursor.close()
+
+
+def ndjson_response(
+    cursor: AsyncIOMotorCursor,
+    model: Type[BaseModel],
+    fields: Optional[List[str]] = None,
+    batch_size: int = NDJSON_BATCH_SIZE,
+) -> StreamingResponse:
+    """Stream a Motor cursor as NDJSON, one serialized document per line.
+
+    Se lee el cursor por lotes y cada lote se envía en cuanto está listo: ni el
+    tiempo hasta el primer byte ni la memoria dependen del tamaño de la colección.
+    """
+    async def body():
+        async for batch in _encoded_batches(cursor, document_shaper(model, fields), batch_size):
+            yield b"".join(line + b"\n" for line in batch)
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+
+def json_array_response(
+    cursor: AsyncIOMotorCursor,
+    model: Type[BaseModel],
+    fields: Optional[List[str]] = None,
+    batch_size: int = NDJSON_BATCH_SIZE,
+    headers: Optional[Dict[str, str]] = None,
+) -> StreamingResponse:
+    """Stream a Motor cursor as a single JSON array, batch by batch.
+
+    Para listados sin límite: el cliente recibe el mismo arreglo de siempre,
+    pero el servidor nunca tiene más de un lote en memoria.
+    """
+    async def body():
+        separator = b"["
+        async for batch in _encoded_batches(cursor, document_shaper(model, fields), batch_size):
+            yield separator + b",".join(batch)
+            separator = b","
+        yield b"]" if separator == b"," else b"[]"
+
+    return StreamingResponse(body(), media_type="application/json", headers=headers)
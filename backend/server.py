@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, APIRouter, BackgroundTasks, HTTPException, Depends, Header, Query, status, UploadFile, File
 from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -6,22 +6,25 @@ from pathlib import Path
 import os
 import logging
 import io
-from typing import List, Optional
-from datetime import datetime, timezone, timedelta
+import asyncio
+import uuid
+from typing import List, Literal, Optional
+from datetime import date, datetime, timezone, timedelta
 
 # Import local modules
 from backend.models import (
     UserCreate, UserLogin, User, UserResponse,
-    CustomerCreate, Customer,
+    CustomerCreate, CustomerUpdate, Customer,
     CategoryCreate, CategoryUpdate, Category,
     ExpenseCategoryCreate, ExpenseCategoryUpdate, ExpenseCategory,
     VillaCreate, Villa,
     ExtraServiceCreate, ExtraService,
     ReservationCreate, ReservationUpdate, Reservation,
+    ReservationBulkCreate, BulkDeleteRequest, BulkItemResult, BulkResult,
     VillaOwnerCreate, VillaOwnerUpdate, VillaOwner,
     PaymentCreate, Payment,
     AbonoCreate, Abono,
-    ExpenseCreate, ExpenseUpdate, Expense,
+    ExpenseCreate, ExpenseUpdate, Expense, ExpenseReminders,
     DashboardStats, InvoiceCounter,
     InvoiceTemplateCreate, InvoiceTemplateUpdate, InvoiceTemplate,
     LogoConfig
@@ -30,7 +33,35 @@ from backend.auth import (
     verify_password, get_password_hash, create_access_token,
     get_current_user, require_admin
 )
-from backend.database import Database, serialize_doc, serialize_docs, prepare_doc_for_insert, restore_datetimes
+from backend.database import Database, transaction, VERSION_BUMP, version_filter, literal_set, serialize_doc, serialize_docs, prepare_doc_for_insert, restore_datetimes
+from backend.index_service import bootstrap_indexes, verify_indexes
+from backend.serialization import fast_json_document, fields_projection, parse_fields, wants_ndjson
+from backend.pagination import MAX_PAGE_SIZE, paginated_response
+from backend.availability_service import (
+    MAX_SEARCH_DAYS, RENTAL_TYPE_WINDOWS, availability_index,
+    refresh_availability_periodically, schedule_availability_rebuild
+)
+from backend.booking_service import (
+    BOOKING_FIELDS, BOOKING_WRITE_ATTEMPTS, booking_unchanged_filter, ensure_villa_available, find_batch_booking_conflicts,
+    lock_villa_bookings, needs_booking_check
+)
+from backend.customer_sync_service import (
+    CUSTOMER_SNAPSHOT_MIGRATION, CUSTOMER_SNAPSHOT_PROJECTION, customer_snapshot,
+    propagate_customer_snapshot, reconcile_customer_snapshots
+)
+from backend.lookup_service import fetch_by_ids
+from backend.scheduler import run_scheduler, trigger_job
+from backend.expense_balance_service import (
+    EXPENSE_BALANCE_MIGRATION, EXPENSE_BALANCE_STAGE, expense_payment_update, reconcile_expense_balances
+)
+from backend.migration_service import DATETIME_MIGRATION, migrate_datetimes, is_migration_complete
+from backend.invoice_service import (
+    InvoiceNumberLease, INVOICE_KIND_COLLECTIONS, invoice_entry,
+    insert_with_invoice_number, insert_with_manual_invoice_number, rebuild_invoice_registry,
+    claim_invoice_numbers, claim_next_invoice_numbers, void_invoice_numbers
+)
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -38,6 +69,11 @@ load_dotenv(ROOT_DIR / '.env')
 # Get database
 db = Database.get_db()
 
+# Opcional: cada worker reserva bloques de números de factura (INVOICE_LEASE_SIZE=50)
+# para no competir por invoice_counter en cada abono. 0 = desactivado.
+INVOICE_LEASE_SIZE = int(os.environ.get('INVOICE_LEASE_SIZE', '0'))
+invoice_lease = InvoiceNumberLease(INVOICE_LEASE_SIZE) if INVOICE_LEASE_SIZE > 0 else None
+
 # Create the main app
 app = FastAPI(title="Espacios Con Piscina - Sistema de Gestión")
 
@@ -51,74 +87,123 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Ordenamiento de cada listado; siempre termina en "id" para que el cursor sea único
+CUSTOMER_SORT = [("name", 1), ("id", 1)]
+RESERVATION_SORT = [("created_at", -1), ("id", -1)]
+RESERVATION_SORTS = {
+    "-created_at": RESERVATION_SORT,
+    "reservation_date": [("reservation_date", 1), ("id", 1)],
+    "-reservation_date": [("reservation_date", -1), ("id", -1)],
+}
+EXPENSE_SORT = [("expense_date", -1), ("id", -1)]
+EXPENSE_SORTS = {
+    "-expense_date": EXPENSE_SORT,
+    "expense_date": [("expense_date", 1), ("id", 1)],
+    "reservation_check_in": [("reservation_check_in", 1), ("id", 1)],
+    "-reservation_check_in": [("reservation_check_in", -1), ("id", -1)],
+}
+OWNER_SORT = [("name", 1), ("id", 1)]
+PAYMENT_SORT = [("payment_date", -1), ("id", -1)]
+ABONO_SORT = [("payment_date", -1), ("id", -1)]
+
 # ============ HELPER FUNCTIONS ============
 
-async def get_next_invoice_number() -> int:
-    """Get next available invoice number starting from 1600 - skips manually created numbers"""
-    counter = await db.invoice_counter.find_one({"counter_id": "main_counter"})
-    
-    if not counter:
-        # Initialize counter
-        counter_doc = {"counter_id": "main_counter", "current_number": 1600}
-        await db.invoice_counter.insert_one(counter_doc)
-        invoice_num = 1600
-    else:
-        invoice_num = counter["current_number"]
-    
-    # Verificar si el número ya existe en reservations o abonos (por factura manual de admin)
-    # Si existe, buscar el siguiente número disponible
-    max_attempts = 100  # Evitar bucle infinito
-    attempts = 0
-    
-    while attempts < max_attempts:
-        invoice_str = str(invoice_num)
-        
-        # Verificar en reservations
-        existing_reservation = await db.reservations.find_one({"invoice_number": invoice_str}, {"_id": 0})
-        
-        # Verificar en abonos de reservaciones
-        existing_res_abono = await db.reservation_abonos.find_one({"invoice_number": invoice_str}, {"_id": 0})
-        
-        # Verificar en abonos de gastos
-        existing_exp_abono = await db.expense_abonos.find_one({"invoice_number": invoice_str}, {"_id": 0})
-        
-        if not existing_reservation and not existing_res_abono and not existing_exp_abono:
-            # Número disponible encontrado
-            break
-        # Número ya existe, probar el siguiente
-        invoice_num += 1
-        attempts += 1
-    
-    # Actualizar contador al siguiente número después del encontrado
-    await db.invoice_counter.update_one(
-        {"counter_id": "main_counter"},
-        {"$set": {"current_number": invoice_num + 1}}
-    )
-    
-    return invoice_num
+def date_range_filter(date_from: Optional[date], date_to: Optional[date]) -> Optional[dict]:
+    """Mongo range for dates between date_from and date_to, both days included"""
+    condition = {}
+    if date_from:
+        condition["$gte"] = datetime.combine(date_from, datetime.min.time(), tzinfo=timezone.utc)
+    if date_to:
+        condition["$lt"] = datetime.combine(date_to + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return condition or None
 
 def calculate_balance(total: float, paid: float, deposit: float = 0) -> float:
     """Calculate balance due - includes deposit in calculation"""
     return max(0, total + deposit - paid)
 
-async def validate_invoice_number_available(invoice_num: str) -> bool:
-    """Check if an invoice number is available (not used in reservations or abonos)"""
-    # Verificar en reservations
-    existing_reservation = await db.reservations.find_one({"invoice_number": invoice_num}, {"_id": 0})
-    if existing_reservation:
-        return False
-    
-    # Verificar en abonos de reservaciones
-    existing_res_abono = await db.reservation_abonos.find_one({"invoice_number": invoice_num}, {"_id": 0})
-    if existing_res_abono:
-        return False
-    
-    # Verificar en abonos de gastos
-    existing_exp_abono = await db.expense_abonos.find_one({"invoice_number": invoice_num}, {"_id": 0})
-    if existing_exp_abono:
-        return False
-    
-    return True
+
+def reservation_payment_update(amount: float) -> List[dict]:
+    """Update pipeline adding `amount` to amount_paid and recomputing balance_due like calculate_balance.
+
+    Se aplica en el servidor en una sola operación atómica: dos abonos simultáneos
+    no se pisan. Con un monto negativo revierte un abono.
+    """
+    return [
+        {"$set": {
+            "amount_paid": {"$add": [{"$ifNull": ["$amount_paid", 0]}, {"$literal": amount}]},
+            "updated_at": {"$literal": datetime.now(timezone.utc)},
+            **VERSION_BUMP,
+        }},
+        RESERVATION_BALANCE_STAGE,
+    ]
+
+
+# balance_due = max(0, total + depósito - pagado), calculado con los valores actuales del documento
+RESERVATION_BALANCE_STAGE = {"$set": {
+    "balance_due": {"$max": [0, {"$subtract": [
+        {"$add": [{"$ifNull": ["$total_amount", 0]}, {"$ifNull": ["$deposit", 0]}]},
+        {"$ifNull": ["$amount_paid", 0]}
+    ]}]},
+}}
+
+# Campos que cambian el saldo: actualizarlos exige la versión leída por el cliente
+RESERVATION_BALANCE_FIELDS = ("amount_paid", "total_amount", "deposit")
+
+
+async def version_conflict(collection, doc_id: str, not_found: str) -> HTTPException:
+    """Error for a conditional update that matched nothing: 404 if the document is gone, 409 if it changed"""
+    current = await collection.find_one({"id": doc_id}, {"_id": 0, "version": 1})
+    if current is None:
+        return HTTPException(status_code=404, detail=not_found)
+    return HTTPException(
+        status_code=409,
+        detail=f"Modified by someone else in the meantime (current version {current.get('version', 1)}). Reload and try again"
+    )
+
+
+OWNER_NAME_PREFIX = "Propietario "  # propietarios auto-generados: "Propietario <código de villa>"
+
+
+def owner_expense_doc(reservation_data: ReservationCreate, villa: dict, invoice_number: str, reservation_id: str, user_id: str) -> dict:
+    """Auto-generated pago_propietario expense for a reservation with owner_price"""
+    expense = Expense(
+        category="pago_propietario",
+        description=f"Pago propietario villa {villa['code']} - Factura #{invoice_number}",
+        amount=reservation_data.owner_price,
+        balance_due=reservation_data.owner_price,
+        currency=reservation_data.currency,
+        expense_date=reservation_data.reservation_date,
+        reservation_check_in=reservation_data.reservation_date,
+        payment_status="pending",
+        notes=f"Auto-generado por reservación. Cliente: {reservation_data.customer_name}",
+        related_reservation_id=reservation_id,
+        created_by=user_id
+    )
+    return prepare_doc_for_insert(expense.model_dump())
+
+
+def owner_debt_update(villa: dict, amount: float, user_id: str) -> UpdateOne:
+    """Upsert adding `amount` to the debt with the villa owner, creating the owner if needed"""
+    # villa_code tiene índice único: dos upserts simultáneos no pueden crear dos propietarios
+    return UpdateOne(
+        {"villa_code": villa["code"]},
+        {
+            "$inc": {"total_owed": amount, "balance_due": amount},
+            "$setOnInsert": {
+                "id": str(uuid.uuid4()),
+                "name": f"{OWNER_NAME_PREFIX}{villa['code']}",
+                "phone": villa.get("phone", ""),
+                "email": "",
+                "villas": [villa["code"]],
+                "commission_percentage": 0,
+                "amount_paid": 0,
+                "notes": f"Auto-generado para {villa['code']}",
+                "created_at": datetime.now(timezone.utc),
+                "created_by": user_id
+            }
+        },
+        upsert=True
+    )
 
 
 # ============ AUTH ENDPOINTS ============
@@ -360,6 +445,56 @@ async def reset_invoice_counter(
         "next_invoice": str(start_number)
     }
 
+@api_router.get("/config/indexes")
+async def get_index_report(current_user: dict = Depends(require_admin)):
+    """Report missing, unused and undeclared indexes per collection (admin only)"""
+    return await verify_indexes(db)
+
+@api_router.post("/config/invoice-registry/rebuild")
+async def rebuild_invoice_number_registry(current_user: dict = Depends(require_admin)):
+    """Backfill the invoice number registry from reservations and abonos (admin only)"""
+    inserted = await rebuild_invoice_registry(db)
+    return {"message": "Registro de facturas reconstruido", "inserted": inserted}
+
+@api_router.post("/config/migrations/datetimes")
+async def run_datetime_migration_now(current_user: dict = Depends(require_admin)):
+    """Convert remaining ISO string dates to native dates (admin only)"""
+    converted = await migrate_datetimes(db)
+    return {"message": "Migración de fechas completada", "converted": converted}
+
+@api_router.post("/config/reconcile/customer-snapshots")
+async def reconcile_customer_snapshots_now(current_user: dict = Depends(require_admin)):
+    """Fill in the customer data missing from reservations (admin only)"""
+    repaired = await reconcile_customer_snapshots(db)
+    return {"message": "Datos de clientes completados en reservaciones", "repaired": repaired}
+
+@api_router.get("/config/reconcile/expense-balances")
+async def check_expense_balances(current_user: dict = Depends(require_admin)):
+    """List expenses whose stored total_paid/balance_due differ from their abonos (admin only)"""
+    drifted = await reconcile_expense_balances(db, repair=False)
+    return {"drifted": len(drifted), "expenses": drifted}
+
+@api_router.post("/config/reconcile/expense-balances")
+async def reconcile_expense_balances_now(current_user: dict = Depends(require_admin)):
+    """Recompute total_paid/balance_due of the expenses that drifted (admin only)"""
+    drifted = await reconcile_expense_balances(db)
+    return {"message": "Saldos de gastos reparados", "repaired": len(drifted)}
+
+@api_router.get("/config/jobs")
+async def get_scheduled_jobs(current_user: dict = Depends(require_admin)):
+    """State of the scheduled jobs and their latest runs (admin only)"""
+    jobs = await db.scheduled_jobs.find({}, {"_id": 0}).to_list(None)
+    runs = await db.job_runs.find({}, {"_id": 0}).sort("started_at", -1).limit(50).to_list(None)
+    return {"jobs": jobs, "runs": runs}
+
+@api_router.post("/config/jobs/{job_name}/run")
+async def run_scheduled_job_now(job_name: str, current_user: dict = Depends(require_admin)):
+    """Run a scheduled job right away (admin only)"""
+    run = await trigger_job(db, job_name)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    return run
+
 # ============ INVOICE TEMPLATE ENDPOINTS (ADMIN ONLY) ============
 
 @api_router.get("/config/invoice-template", response_model=InvoiceTemplate)
@@ -389,7 +524,7 @@ async def update_invoice_template(
     
     # Prepare update data
     update_dict = {k: v for k, v in template_data.model_dump(exclude_unset=True).items() if v is not None}
-    update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
+    update_dict["updated_at"] = datetime.now(timezone.utc)
     
     if not existing_template:
         # Create new template
@@ -492,19 +627,52 @@ async def create_customer(customer_data: CustomerCreate, current_user: dict = De
     return customer
 
 @api_router.get("/customers", response_model=List[Customer])
-async def get_customers(current_user: dict = Depends(get_current_user)):
-    """Get all customers ordered alphabetically by name"""
-    customers = await db.customers.find({}, {"_id": 0}).sort("name", 1).to_list(1000)
-    return [restore_datetimes(c, ["created_at"]) for c in customers]
+async def get_customers(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get customers ordered alphabetically by name - keyset paginated, or streamed as NDJSON"""
+    return await paginated_response(
+        db.customers, {}, CUSTOMER_SORT, Customer, limit, cursor, fields,
+        stream=wants_ndjson(accept)
+    )
 
 @api_router.get("/customers/{customer_id}", response_model=Customer)
-async def get_customer(customer_id: str, current_user: dict = Depends(get_current_user)):
-    """Get a customer by ID"""
-    customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
+async def get_customer(customer_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Get a customer by ID - ?fields= returns only the listed fields"""
+    requested = parse_fields(fields, Customer)
+    projection = fields_projection(Customer, requested) if requested else {"_id": 0}
+    customer = await db.customers.find_one({"id": customer_id}, projection)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
+    if requested:
+        return fast_json_document(customer, Customer, requested)
     return restore_datetimes(customer, ["created_at"])
 
+@api_router.put("/customers/{customer_id}", response_model=Customer)
+async def update_customer(
+    customer_id: str,
+    update_data: CustomerUpdate,
+    background_tasks: BackgroundTasks,
+    current_user: dict = Depends(get_current_user)
+):
+    """Update a customer - changes to the name or identification are copied to its reservations in the background"""
+    update_dict = {k: v for k, v in update_data.model_dump(exclude_unset=True).items() if v is not None}
+    if update_dict:
+        result = await db.customers.update_one({"id": customer_id}, {"$set": update_dict})
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="Customer not found")
+    
+    updated = await db.customers.find_one({"id": customer_id}, {"_id": 0})
+    if not updated:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    if {"name", "identification_document", "dni"} & update_dict.keys():
+        background_tasks.add_task(propagate_customer_snapshot, db, customer_id)
+    return restore_datetimes(updated, ["created_at"])
+
 @api_router.delete("/customers/{customer_id}")
 async def delete_customer(customer_id: str, current_user: dict = Depends(require_admin)):
     """Delete a customer (admin only)"""
@@ -626,6 +794,7 @@ async def create_villa(villa_data: VillaCreate, current_user: dict = Depends(get
     villa = Villa(**villa_data.model_dump(), created_by=current_user["id"])
     doc = prepare_doc_for_insert(villa.model_dump())
     await db.villas.insert_one(doc)
+    schedule_availability_rebuild(db)
     return villa
 
 @api_router.get("/villas", response_model=List[Villa])
@@ -668,6 +837,7 @@ async def update_villa(villa_id: str, villa_data: VillaCreate, current_user: dic
     
     update_dict = villa_data.model_dump()
     await db.villas.update_one({"id": villa_id}, {"$set": update_dict})
+    schedule_availability_rebuild(db)
     
     updated = await db.villas.find_one({"id": villa_id}, {"_id": 0})
     return restore_datetimes(updated, ["created_at"])
@@ -678,6 +848,7 @@ async def delete_villa(villa_id: str, current_user: dict = Depends(require_admin
     result = await db.villas.delete_one({"id": villa_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Villa not found")
+    schedule_availability_rebuild(db)
     return {"message": "Villa deleted successfully"}
 
 # ============ EXTRA SERVICE ENDPOINTS ============
@@ -722,21 +893,6 @@ async def delete_extra_service(service_id: str, current_user: dict = Depends(req
 @api_router.post("/reservations", response_model=Reservation)
 async def create_reservation(reservation_data: ReservationCreate, current_user: dict = Depends(get_current_user)):
     """Create a new reservation"""
-    # Si el usuario es admin y proporciona un invoice_number, usarlo
-    # De lo contrario, obtener el siguiente número disponible
-    if hasattr(reservation_data, 'invoice_number') and reservation_data.invoice_number is not None and current_user.get("role") == "admin":
-        # Admin proporcionó un número manual - convertir a string
-        invoice_number = str(reservation_data.invoice_number)
-        
-        # Verificar si ya existe
-        existing = await db.reservations.find_one({"invoice_number": invoice_number}, {"_id": 0})
-        if existing:
-            raise HTTPException(status_code=400, detail=f"El número de factura {invoice_number} ya existe")
-    else:
-        # Obtener siguiente número automático disponible
-        invoice_number_int = await get_next_invoice_number()
-        invoice_number = str(invoice_number_int)
-    
     # Calculate balance: Total + Depósito - Pagado
     balance_due = calculate_balance(
         reservation_data.total_amount, 
@@ -746,148 +902,354 @@ async def create_reservation(reservation_data: ReservationCreate, current_user:
     
     reservation = Reservation(
         **reservation_data.model_dump(exclude={'invoice_number'}),
-        invoice_number=invoice_number,
+        invoice_number="",
         balance_due=balance_due,
         created_by=current_user["id"]
     )
+    # Evitar reservas dobles: una consulta indexada por villa y fecha (falla rápido,
+    # antes de tomar un número de factura; se repite dentro de la transacción)
+    if reservation_data.status != "cancelled":
+        await ensure_villa_available(
+            db, reservation_data.villa_id, reservation_data.reservation_date,
+            reservation_data.check_in_time, reservation_data.check_out_time
+        )
     
-    doc = prepare_doc_for_insert(reservation.model_dump())
-    await db.reservations.insert_one(doc)
-    
-    # AUTO-CREAR GASTO PARA PAGO AL PROPIETARIO
+    # Una sola lectura del cliente (copia en la reservación) y de la villa (gasto y deuda
+    # al propietario)
+    customer = await db.customers.find_one({"id": reservation_data.customer_id}, CUSTOMER_SNAPSHOT_PROJECTION)
+    villa = None
     if reservation_data.owner_price > 0 and reservation_data.villa_id:
-        villa = await db.villas.find_one({"id": reservation_data.villa_id}, {"_id": 0})
-        if villa:
-            # Crear gasto automático para el pago al propietario
-            from models import Expense
-            import uuid
-            
-            expense = {
-                "id": str(uuid.uuid4()),
-                "category": "pago_propietario",
-                "category_id": None,
-                "description": f"Pago propietario villa {villa['code']} - Factura #{invoice_number}",
-                "amount": reservation_data.owner_price,
-                "currency": reservation_data.currency,
-                "expense_date": reservation_data.reservation_date.isoformat() if isinstance(reservation_data.reservation_date, datetime) else reservation_data.reservation_date,
-                "payment_status": "pending",
-                "notes": f"Auto-generado por reservación. Cliente: {reservation_data.customer_name}",
-                "related_reservation_id": reservation.id,
-                "created_at": datetime.now(timezone.utc).isoformat(),
-                "created_by": current_user["id"]
-            }
-            
-            await db.expenses.insert_one(expense)
+        villa = await db.villas.find_one({"id": reservation_data.villa_id}, {"_id": 0, "code": 1, "phone": 1})
+    if customer:
+        for field, value in customer_snapshot(customer).items():
+            setattr(reservation, field, value)
     
-    # Si hay owner_price, crear/actualizar deuda al propietario de la villa
-    if reservation_data.owner_price > 0 and reservation_data.villa_id:
-        villa = await db.villas.find_one({"id": reservation_data.villa_id}, {"_id": 0})
-        if villa:
-            # Buscar si ya existe un registro del propietario
-            owner_name = f"Propietario {villa['code']}"
-            owner = await db.villa_owners.find_one({"name": owner_name}, {"_id": 0})
-            
-            if not owner:
-                # Crear nuevo propietario
-                from models import VillaOwner
-                import uuid
-                owner = {
-                    "id": str(uuid.uuid4()),
-                    "name": owner_name,
-                    "phone": villa.get("phone", ""),
-                    "email": "",
-                    "villas": [villa["code"]],
-                    "commission_percentage": 0,
-                    "total_owed": reservation_data.owner_price,
-                    "amount_paid": 0,
-                    "balance_due": reservation_data.owner_price,
-                    "notes": f"Auto-generado para {villa['code']}",
-                    "created_at": datetime.now(timezone.utc).isoformat(),
-                    "created_by": current_user["id"]
-                }
-                await db.villa_owners.insert_one(owner)
-            else:
-                # Actualizar deuda existente
-                new_total = owner.get("total_owed", 0) + reservation_data.owner_price
-                new_balance = new_total - owner.get("amount_paid", 0)
-                await db.villa_owners.update_one(
-                    {"id": owner["id"]},
-                    {"$set": {"total_owed": new_total, "balance_due": new_balance}}
+    doc = prepare_doc_for_insert(reservation.model_dump())
+    entry = invoice_entry("reservation", reservation.id, reservation_id=reservation.id)
+    
+    async def reservation_side_effects(invoice_number, session):
+        if reservation_data.status != "cancelled":
+            # Repetir la verificación dentro de la transacción, serializada por villa
+            await lock_villa_bookings(db, reservation_data.villa_id, session)
+            if session is not None:
+                await ensure_villa_available(
+                    db, reservation_data.villa_id, reservation_data.reservation_date,
+                    reservation_data.check_in_time, reservation_data.check_out_time,
+                    exclude_id=reservation.id, session=session
                 )
+        if villa is None:
+            return
+        # AUTO-CREAR GASTO PARA PAGO AL PROPIETARIO
+        await db.expenses.insert_one(
+            owner_expense_doc(reservation_data, villa, invoice_number, reservation.id, current_user["id"]),
+            session=session
+        )
+        
+        # Crear o actualizar la deuda al propietario de la villa en una sola operación
+        await db.villa_owners.bulk_write(
+            [owner_debt_update(villa, reservation_data.owner_price, current_user["id"])], session=session
+        )
+    
+    # Reservación, gasto y deuda se confirman juntos (o no se escribe nada)
+    # Si el usuario es admin y proporciona un invoice_number, usarlo
+    # De lo contrario, obtener el siguiente número disponible
+    if reservation_data.invoice_number is not None and current_user.get("role") == "admin":
+        # Admin proporcionó un número manual - el índice único detecta si ya existe
+        invoice_number = str(reservation_data.invoice_number)
+        try:
+            await insert_with_manual_invoice_number(
+                db, db.reservations, doc, invoice_number, entry, reservation_side_effects
+            )
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail=f"El número de factura {invoice_number} ya existe")
+    else:
+        invoice_number = await insert_with_invoice_number(
+            db, db.reservations, doc, entry, invoice_lease, reservation_side_effects
+        )
+    reservation.invoice_number = invoice_number
+    availability_index.apply_reservation(doc)
     
     return reservation
 
+async def record_bulk_owner_payments(items, docs: dict, numbers: dict, indexes: List[int], user_id: str) -> None:
+    """Owner expenses and owner debts for the given bulk items, in one transaction (retried on write conflicts)"""
+    villas = await fetch_by_ids(db.villas, (items[i].villa_id for i in indexes), {"code": 1, "phone": 1})
+    expenses, debts = [], {}
+    for i in indexes:
+        villa = villas.get(items[i].villa_id)
+        if villa is None:
+            continue
+        expenses.append(owner_expense_doc(items[i], villa, numbers[i], docs[i]["id"], user_id))
+        villa_debt = debts.setdefault(villa["id"], [villa, 0.0])
+        villa_debt[1] += items[i].owner_price
+    if not expenses:
+        return
+    
+    for attempt in range(BOOKING_WRITE_ATTEMPTS):
+        try:
+            async with transaction(db) as session:
+                await db.expenses.insert_many([dict(e) for e in expenses], session=session)
+                await db.villa_owners.bulk_write(
+                    [owner_debt_update(villa, amount, user_id) for villa, amount in debts.values()], session=session
+                )
+            return
+        except PyMongoError as e:
+            # La deuda del mismo propietario se actualizó a la vez desde otra transacción
+            if not e.has_error_label("TransientTransactionError") or attempt == BOOKING_WRITE_ATTEMPTS - 1:
+                raise
+
+@api_router.post("/reservations/bulk", response_model=BulkResult)
+async def create_reservations_bulk(payload: ReservationBulkCreate, current_user: dict = Depends(get_current_user)):
+    """Create many reservations at once - batched invoice allocation and inserts, per-item results"""
+    items = payload.reservations
+    is_admin = current_user.get("role") == "admin"
+    results = [BulkItemResult(index=i, success=False) for i in range(len(items))]
+    
+    # Reservas dobles contra la base de datos y dentro del mismo lote: una consulta
+    conflicts = await find_batch_booking_conflicts(db, [item.model_dump() for item in items])
+    
+    customers = await fetch_by_ids(db.customers, (item.customer_id for item in items), CUSTOMER_SNAPSHOT_PROJECTION)
+    
+    docs, entries, manual = {}, {}, {}
+    for i, item in enumerate(items):
+        if conflicts[i]:
+            results[i].error = f"La villa ya está reservada en ese horario (facturas: {', '.join(conflicts[i])})"
+            continue
+        reservation = Reservation(
+            **item.model_dump(exclude={'invoice_number'}),
+            invoice_number="",
+            balance_due=calculate_balance(item.total_amount, item.amount_paid, item.deposit),
+            created_by=current_user["id"]
+        )
+        if item.customer_id in customers:
+            for field, value in customer_snapshot(customers[item.customer_id]).items():
+                setattr(reservation, field, value)
+        docs[i] = prepare_doc_for_insert(reservation.model_dump())
+        entries[i] = invoice_entry("reservation", reservation.id, reservation_id=reservation.id)
+        results[i].id = reservation.id
+        # Igual que en la creación individual: solo un admin puede fijar el número
+        if item.invoice_number is not None and is_admin:
+            manual[i] = str(item.invoice_number)
+    
+    # Números manuales en un insert_many; el resto con bloques del contador
+    taken = await claim_invoice_numbers(db, [(manual[i], entries[i]) for i in manual])
+    numbers = {}
+    for i, number in manual.items():
+        if number in taken:
+            results[i].error = f"El número de factura {number} ya existe"
+            del docs[i]
+        else:
+            numbers[i] = number
+    auto = [i for i in docs if i not in manual]
+    for i, number in zip(auto, await claim_next_invoice_numbers(db, [entries[i] for i in auto])):
+        numbers[i] = number
+    
+    order = list(docs)
+    for i in order:
+        docs[i]["invoice_number"] = numbers[i]
+    inserted = set(order)
+    if order:
+        try:
+            await db.reservations.insert_many([docs[i] for i in order], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                i = order[error["index"]]
+                inserted.discard(i)
+                if error.get("code") == 11000 and "invoice_number" in (error.get("keyPattern") or {}):
+                    results[i].error = f"El número de factura {numbers[i]} ya existe"
+                else:
+                    results[i].error = error.get("errmsg", "Insert failed")
+            # Liberar los números de las reservaciones que no se insertaron
+            failed = [i for i in order if i not in inserted]
+            await db.invoice_numbers.delete_many({"invoice_number": {"$in": [numbers[i] for i in failed]}})
+            await void_invoice_numbers(db, [numbers[i] for i in failed if i not in manual], "bulk_insert_failed")
+    
+    # Gastos y deudas al propietario de las reservaciones creadas: una lectura de villas,
+    # un insert_many de gastos y un bulk_write con la deuda sumada por villa, en una transacción
+    with_owner = [i for i in order if i in inserted and items[i].owner_price > 0 and items[i].villa_id]
+    if with_owner:
+        try:
+            await record_bulk_owner_payments(items, docs, numbers, with_owner, current_user["id"])
+        except PyMongoError as e:
+            # Sin gasto ni deuda la reservación quedaría huérfana: se deshace y se informa por elemento
+            logger.error(f"Gastos de propietario del lote fallaron: {e}")
+            failed_ids = [docs[i]["id"] for i in with_owner]
+            await db.expenses.delete_many({"related_reservation_id": {"$in": failed_ids}})
+            await db.reservations.delete_many({"id": {"$in": failed_ids}})
+            await db.invoice_numbers.delete_many({"reservation_id": {"$in": failed_ids}})
+            await void_invoice_numbers(db, [numbers[i] for i in with_owner if i not in manual], "bulk_owner_payment_failed")
+            for i in with_owner:
+                inserted.discard(i)
+                results[i].error = "No se pudo registrar el pago al propietario; la reservación no se creó"
+    
+    for i in inserted:
+        results[i].success = True
+        results[i].invoice_number = numbers[i]
+        availability_index.apply_reservation(docs[i])
+    
+    return BulkResult(succeeded=len(inserted), failed=len(items) - len(inserted), results=results)
+
+@api_router.post("/reservations/bulk-delete", response_model=BulkResult)
+async def delete_reservations_bulk(payload: BulkDeleteRequest, current_user: dict = Depends(require_admin)):
+    """Delete many reservations (admin only) - cascades to expenses, abonos and invoice numbers with delete_many"""
+    ids = list(dict.fromkeys(payload.ids))
+    found = await db.reservations.find({"id": {"$in": ids}}, {"_id": 0, "id": 1}).to_list(None)
+    found_ids = [r["id"] for r in found]
+    
+    if found_ids:
+        async with transaction(db) as session:
+            await db.expenses.delete_many({"related_reservation_id": {"$in": found_ids}}, session=session)
+            await db.reservation_abonos.delete_many({"reservation_id": {"$in": found_ids}}, session=session)
+            await db.invoice_numbers.delete_many({"reservation_id": {"$in": found_ids}}, session=session)
+            await db.reservations.delete_many({"id": {"$in": found_ids}}, session=session)
+        for reservation_id in found_ids:
+            availability_index.remove_reservation(reservation_id)
+    
+    found_set = set(found_ids)
+    results = [
+        BulkItemResult(index=i, id=reservation_id, success=reservation_id in found_set,
+                       error=None if reservation_id in found_set else "Reservation not found")
+        for i, reservation_id in enumerate(payload.ids)
+    ]
+    succeeded = sum(r.success for r in results)
+    return BulkResult(succeeded=succeeded, failed=len(results) - succeeded, results=results)
+
 @api_router.get("/reservations", response_model=List[Reservation])
 async def get_reservations(
     status: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    villa_id: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    currency: Optional[Literal["DOP", "USD"]] = None,
+    rental_type: Optional[Literal["pasadia", "amanecida", "evento"]] = None,
+    has_balance: Optional[bool] = None,
+    sort: Literal["-created_at", "reservation_date", "-reservation_date"] = "-created_at",
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    accept: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get all reservations with customer identification"""
+    """Get reservations with customer identification - filtered server-side, keyset paginated, or streamed as NDJSON
+
+    Los filtros de fecha, villa y cliente usan los índices compuestos (villa_id|customer_id,
+    reservation_date, id); currency y rental_type se aplican sobre el rango ya acotado.
+    """
     query = {}
     if status:
         query["status"] = status
-    
-    reservations = await db.reservations.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    datetime_fields = ["reservation_date", "created_at", "updated_at"]
-    
-    # Enrich with customer identification document
-    enriched_reservations = []
-    for r in reservations:
-        restored = restore_datetimes(r, datetime_fields)
-        
-        # Get customer identification if customer_id exists
-        if r.get("customer_id"):
-            customer = await db.customers.find_one({"id": r["customer_id"]}, {"_id": 0})
-            if customer:
-                restored["customer_identification_document"] = customer.get("identification_document") or customer.get("dni")
-        
-        enriched_reservations.append(restored)
-    
-    return enriched_reservations
+    reservation_date = date_range_filter(date_from, date_to)
+    if reservation_date:
+        query["reservation_date"] = reservation_date
+    if villa_id:
+        query["villa_id"] = villa_id
+    if customer_id:
+        query["customer_id"] = customer_id
+    if currency:
+        query["currency"] = currency
+    if rental_type:
+        query["rental_type"] = rental_type
+    if has_balance is not None:
+        query["balance_due"] = {"$gt": 0} if has_balance else {"$lte": 0}
+    
+    # Los datos del cliente vienen copiados en la reservación: no hace falta join
+    return await paginated_response(
+        db.reservations, query, RESERVATION_SORTS[sort], Reservation, limit, cursor, fields,
+        stream=wants_ndjson(accept)
+    )
 
 @api_router.get("/reservations/{reservation_id}", response_model=Reservation)
-async def get_reservation(reservation_id: str, current_user: dict = Depends(get_current_user)):
-    """Get a reservation by ID"""
-    reservation = await db.reservations.find_one({"id": reservation_id}, {"_id": 0})
+async def get_reservation(reservation_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Get a reservation by ID - ?fields= returns only the listed fields"""
+    requested = parse_fields(fields, Reservation)
+    projection = fields_projection(Reservation, requested) if requested else {"_id": 0}
+    reservation = await db.reservations.find_one({"id": reservation_id}, projection)
     if not reservation:
         raise HTTPException(status_code=404, detail="Reservation not found")
+    if requested:
+        return fast_json_document(reservation, Reservation, requested)
     return restore_datetimes(reservation, ["reservation_date", "created_at", "updated_at"])
 
+async def update_booked_reservation(
+    reservation_id: str,
+    expected_version: Optional[int],
+    update_dict: dict,
+    pipeline: List[dict],
+) -> Optional[dict]:
+    """Apply an update that may move the reservation, checking for double bookings inside a transaction"""
+    for attempt in range(BOOKING_WRITE_ATTEMPTS):
+        try:
+            async with transaction(db) as session:
+                existing = await db.reservations.find_one(
+                    version_filter(reservation_id, expected_version),
+                    {"_id": 0, "status": 1, **{f: 1 for f in BOOKING_FIELDS}},
+                    session=session
+                )
+                if existing is None:
+                    return None
+                if needs_booking_check(existing, update_dict):
+                    merged = {**existing, **update_dict}
+                    await lock_villa_bookings(db, merged["villa_id"], session)
+                    await ensure_villa_available(
+                        db, merged["villa_id"], restore_datetimes(merged, ["reservation_date"])["reservation_date"],
+                        merged.get("check_in_time"), merged.get("check_out_time"),
+                        exclude_id=reservation_id, session=session
+                    )
+                return await db.reservations.find_one_and_update(
+                    version_filter(reservation_id, expected_version),
+                    pipeline,
+                    projection={"_id": 0},
+                    return_document=ReturnDocument.AFTER,
+                    session=session
+                )
+        except PyMongoError as e:
+            # Otra reservación de la misma villa se confirmó a la vez: reintentar la verificación
+            if not e.has_error_label("TransientTransactionError") or attempt == BOOKING_WRITE_ATTEMPTS - 1:
+                raise
+
 @api_router.put("/reservations/{reservation_id}", response_model=Reservation)
 async def update_reservation(
     reservation_id: str,
     update_data: ReservationUpdate,
     current_user: dict = Depends(get_current_user)
 ):
-    """Update a reservation"""
-    existing = await db.reservations.find_one({"id": reservation_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Reservation not found")
-    
+    """Update a reservation - with `version`, only if nobody changed it since it was read (409 otherwise)
+
+    Los montos (pagado, total, depósito) solo se aceptan con `version`: un
+    amount_paid leído antes de un abono lo borraría.
+    """
     update_dict = {k: v for k, v in update_data.model_dump(exclude_unset=True).items() if v is not None}
-    
-    if update_dict:
-        # Recalculate balance if amounts changed: Total + Depósito - Pagado
-        total = update_dict.get("total_amount", existing["total_amount"])
-        paid = update_dict.get("amount_paid", existing["amount_paid"])
-        deposit = update_dict.get("deposit", existing.get("deposit", 0))
-        update_dict["balance_due"] = calculate_balance(total, paid, deposit)
-        update_dict["updated_at"] = datetime.now(timezone.utc).isoformat()
-        
-        prepared_update = {}
-        for key, value in update_dict.items():
-            if isinstance(value, datetime):
-                prepared_update[key] = value.isoformat()
-            else:
-                prepared_update[key] = value
-        
-        await db.reservations.update_one(
-            {"id": reservation_id},
-            {"$set": prepared_update}
+    expected_version = update_dict.pop("version", None)
+    if expected_version is None and any(f in update_dict for f in RESERVATION_BALANCE_FIELDS):
+        raise HTTPException(
+            status_code=428,
+            detail="Se requiere la versión de la reservación para modificar montos (vuelva a cargarla)"
         )
-    
-    updated = await db.reservations.find_one({"id": reservation_id}, {"_id": 0})
-    return restore_datetimes(updated, ["reservation_date", "created_at", "updated_at"])
+    if not update_dict:
+        return await get_reservation(reservation_id, current_user=current_user)
+    
+    # Una sola escritura condicional que devuelve el documento nuevo; el saldo
+    # (Total + Depósito - Pagado) se recalcula con los valores actuales, no con los leídos
+    update_dict["updated_at"] = datetime.now(timezone.utc)
+    pipeline = [literal_set(update_dict), {"$set": VERSION_BUMP}, RESERVATION_BALANCE_STAGE]
+    
+    # Caso común: el formulario reenvía villa, fecha y horario sin cambiarlos. La
+    # escritura se condiciona a eso y no hace falta verificar reservas dobles
+    updated = await db.reservations.find_one_and_update(
+        {**version_filter(reservation_id, expected_version), **booking_unchanged_filter(update_dict)},
+        pipeline,
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is None and booking_unchanged_filter(update_dict):
+        # Cambió la villa, la fecha, el horario o se reactiva (o no existe / cambió la versión)
+        updated = await update_booked_reservation(reservation_id, expected_version, update_dict, pipeline)
+    if updated is None:
+        raise await version_conflict(db.reservations, reservation_id, "Reservation not found")
+    restore_datetimes(updated, ["reservation_date", "created_at", "updated_at"])
+    availability_index.apply_reservation(updated)
+    return updated
 
 @api_router.delete("/reservations/{reservation_id}")
 async def delete_reservation(reservation_id: str, current_user: dict = Depends(require_admin)):
@@ -898,103 +1260,141 @@ async def delete_reservation(reservation_id: str, current_user: dict = Depends(r
     # Eliminar abonos de la reservación
     await db.reservation_abonos.delete_many({"reservation_id": reservation_id})
     
+    # Liberar números de factura de la reservación y sus abonos
+    await db.invoice_numbers.delete_many({"reservation_id": reservation_id})
+    
     # Eliminar la reservación
     result = await db.reservations.delete_one({"id": reservation_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Reservation not found")
+    availability_index.remove_reservation(reservation_id)
     return {"message": "Reservation and related expenses deleted successfully"}
 
+# ============ AVAILABILITY SEARCH ============
+
+@api_router.get("/availability")
+async def search_availability(
+    start_date: date,
+    days: int = Query(1, ge=1, le=MAX_SEARCH_DAYS),
+    guests: int = Query(0, ge=0),
+    rental_type: Literal["pasadia", "amanecida", "evento"] = "pasadia",
+    check_in_time: Optional[str] = None,
+    check_out_time: Optional[str] = None,
+    category_id: Optional[str] = None,
+    is_active: Optional[bool] = True,
+    current_user: dict = Depends(get_current_user)
+):
+    """Villas free on each day of a date range - answered from the in-memory occupancy matrix"""
+    if not availability_index.ready:
+        raise HTTPException(status_code=503, detail="El índice de disponibilidad se está cargando")
+    if not availability_index.covers(start_date, days):
+        raise HTTPException(status_code=400, detail="Date range outside the availability window")
+    
+    # Sin horas explícitas se usa el horario típico del tipo de renta
+    default_check_in, default_check_out = RENTAL_TYPE_WINDOWS[rental_type]
+    return availability_index.search(
+        start_date, days,
+        check_in_time or default_check_in, check_out_time or default_check_out,
+        guests=guests, category_id=category_id, is_active=is_active
+    )
+
+# ============ INVOICE RESOLVER ============
+
+@api_router.get("/invoices/{invoice_number}")
+async def resolve_invoice(invoice_number: str, current_user: dict = Depends(get_current_user)):
+    """Resolve an invoice number to the reservation or abono that owns it"""
+    entry = await db.invoice_numbers.find_one({"invoice_number": invoice_number}, {"_id": 0})
+    if not entry:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    collection = INVOICE_KIND_COLLECTIONS[entry["kind"]]
+    document = await db[collection].find_one({"id": entry["document_id"]}, {"_id": 0})
+    if not document:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    
+    return {
+        "invoice_number": invoice_number,
+        "kind": entry["kind"],
+        "reservation_id": entry.get("reservation_id"),
+        "expense_id": entry.get("expense_id"),
+        "document": document
+    }
+
 # ============ ABONOS TO RESERVATIONS ============
 
 @api_router.post("/reservations/{reservation_id}/abonos", response_model=Abono)
 async def add_abono_to_reservation(reservation_id: str, abono_data: AbonoCreate, current_user: dict = Depends(get_current_user)):
     """Add a payment (abono) to a reservation - each abono gets its own invoice number"""
-    reservation = await db.reservations.find_one({"id": reservation_id}, {"_id": 0})
+    reservation = await db.reservations.find_one({"id": reservation_id}, {"_id": 1})
     if not reservation:
         raise HTTPException(status_code=404, detail="Reservation not found")
     
+    # Create abono record; invoice_number is assigned on insert
+    abono_dict = abono_data.model_dump()
+    abono_dict["invoice_number"] = ""
+    abono = Abono(**abono_dict, created_by=current_user["id"])
+    abono_doc = prepare_doc_for_insert(abono.model_dump())
+    
+    # Store in reservation_abonos collection
+    abono_doc["reservation_id"] = reservation_id
+    entry = invoice_entry("reservation_abono", abono.id, reservation_id=reservation_id)
+    
+    async def apply_payment(invoice_number, session):
+        # Update reservation amount_paid and balance_due atomically, in the same transaction as the abono
+        await db.reservations.update_one(
+            {"id": reservation_id}, reservation_payment_update(abono_data.amount), session=session
+        )
+    
     # Handle invoice_number generation
     if abono_data.invoice_number:
-        # Admin provided manual invoice number - validate it's available
+        # Admin provided manual invoice number - the registry rejects numbers already in use
         if current_user.get("role") != "admin":
             raise HTTPException(status_code=403, detail="Only admins can specify manual invoice numbers")
         
         invoice_num_str = str(abono_data.invoice_number)
-        is_available = await validate_invoice_number_available(invoice_num_str)
-        if not is_available:
+        try:
+            await insert_with_manual_invoice_number(
+                db, db.reservation_abonos, abono_doc, invoice_num_str, entry, apply_payment
+            )
+        except DuplicateKeyError:
             raise HTTPException(status_code=400, detail=f"Invoice number {invoice_num_str} is already in use")
-        invoice_number = invoice_num_str
+        abono.invoice_number = invoice_num_str
     else:
         # Auto-generate invoice number for employee/admin
-        invoice_number = str(await get_next_invoice_number())
-    
-    # Create abono record with invoice_number
-    abono_dict = abono_data.model_dump()
-    abono_dict["invoice_number"] = invoice_number  
-    abono = Abono(**abono_dict, created_by=current_user["id"])
-    abono_doc = prepare_doc_for_insert(abono.model_dump())
-    
-    # Store in reservation_abonos collection
-    abono_doc["reservation_id"] = reservation_id
-    await db.reservation_abonos.insert_one(abono_doc)
-    
-    # Update reservation amount_paid and balance_due: Total + Depósito - Pagado
-    new_amount_paid = reservation.get("amount_paid", 0) + abono_data.amount
-    new_balance_due = calculate_balance(
-        reservation.get("total_amount", 0), 
-        new_amount_paid,
-        reservation.get("deposit", 0)
-    )
-    
-    await db.reservations.update_one(
-        {"id": reservation_id},
-        {"$set": {
-            "amount_paid": new_amount_paid,
-            "balance_due": new_balance_due,
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }}
-    )
+        abono.invoice_number = await insert_with_invoice_number(
+            db, db.reservation_abonos, abono_doc, entry, invoice_lease, apply_payment
+        )
     
     return abono
 
 @api_router.get("/reservations/{reservation_id}/abonos", response_model=List[Abono])
-async def get_reservation_abonos(reservation_id: str, current_user: dict = Depends(get_current_user)):
-    """Get all abonos for a reservation"""
-    abonos = await db.reservation_abonos.find({"reservation_id": reservation_id}, {"_id": 0}).sort("payment_date", -1).to_list(100)
-    return [restore_datetimes(a, ["payment_date", "created_at"]) for a in abonos]
+async def get_reservation_abonos(
+    reservation_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get abonos for a reservation, newest first - keyset paginated with limit/cursor"""
+    return await paginated_response(
+        db.reservation_abonos, {"reservation_id": reservation_id}, ABONO_SORT, Abono,
+        limit, cursor, fields
+    )
 
 @api_router.delete("/reservations/{reservation_id}/abonos/{abono_id}")
 async def delete_reservation_abono(reservation_id: str, abono_id: str, current_user: dict = Depends(require_admin)):
     """Delete an abono from a reservation (admin only) - to correct errors"""
-    # Get the abono to delete
-    abono_to_delete = await db.reservation_abonos.find_one({"reservation_id": reservation_id, "id": abono_id}, {"_id": 0})
-    if not abono_to_delete:
-        raise HTTPException(status_code=404, detail="Abono not found")
-    
-    # Delete the abono
-    await db.reservation_abonos.delete_one({"reservation_id": reservation_id, "id": abono_id})
-    
-    # Recalculate reservation balance: Total + Depósito - Pagado
-    reservation = await db.reservations.find_one({"id": reservation_id}, {"_id": 0})
-    if reservation:
-        # Recalculate total paid from remaining abonos
-        all_abonos = await db.reservation_abonos.find({"reservation_id": reservation_id}, {"_id": 0}).to_list(1000)
-        total_from_abonos = sum(a.get("amount", 0) for a in all_abonos)
-        
-        # Original payment is stored in the reservation
-        new_amount_paid = reservation.get("amount_paid", 0) - abono_to_delete.get("amount", 0)
-        new_balance_due = calculate_balance(
-            reservation.get("total_amount", 0), 
-            new_amount_paid,
-            reservation.get("deposit", 0)
+    async with transaction(db) as session:
+        # Delete the abono, release its invoice number and revert the payment, all together
+        abono_to_delete = await db.reservation_abonos.find_one_and_delete(
+            {"reservation_id": reservation_id, "id": abono_id}, projection={"_id": 0, "amount": 1}, session=session
         )
+        if not abono_to_delete:
+            raise HTTPException(status_code=404, detail="Abono not found")
         
+        await db.invoice_numbers.delete_one({"document_id": abono_id}, session=session)
         await db.reservations.update_one(
-            {"id": reservation_id},
-            {"$set": {
-                "amount_paid": new_amount_paid,
-                "balance_due": new_balance_due
-            }}
+            {"id": reservation_id}, reservation_payment_update(-abono_to_delete.get("amount", 0)), session=session
         )
     
     return {"message": "Abono deleted successfully"}
@@ -1010,10 +1410,16 @@ async def create_owner(owner_data: VillaOwnerCreate, current_user: dict = Depend
     return owner
 
 @api_router.get("/owners", response_model=List[VillaOwner])
-async def get_owners(current_user: dict = Depends(get_current_user)):
-    """Get all villa owners"""
-    owners = await db.villa_owners.find({}, {"_id": 0}).to_list(1000)
-    return [restore_datetimes(o, ["created_at"]) for o in owners]
+async def get_owners(
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get villa owners ordered by name - keyset paginated with limit/cursor"""
+    return await paginated_response(
+        db.villa_owners, {}, OWNER_SORT, VillaOwner, limit, cursor, fields
+    )
 
 @api_router.get("/owners/{owner_id}", response_model=VillaOwner)
 async def get_owner(owner_id: str, current_user: dict = Depends(get_current_user)):
@@ -1068,10 +1474,18 @@ async def create_owner_payment(owner_id: str, payment_data: PaymentCreate, curre
     return payment
 
 @api_router.get("/owners/{owner_id}/payments", response_model=List[Payment])
-async def get_owner_payments(owner_id: str, current_user: dict = Depends(get_current_user)):
-    """Get all payments for an owner"""
-    payments = await db.owner_payments.find({"owner_id": owner_id}, {"_id": 0}).sort("payment_date", -1).to_list(1000)
-    return [restore_datetimes(p, ["payment_date"]) for p in payments]
+async def get_owner_payments(
+    owner_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get payments for an owner, newest first - keyset paginated with limit/cursor"""
+    return await paginated_response(
+        db.owner_payments, {"owner_id": owner_id}, PAYMENT_SORT, Payment,
+        limit, cursor, fields
+    )
 
 @api_router.put("/owners/{owner_id}/amounts")
 async def update_owner_amounts(owner_id: str, total_owed: float, current_user: dict = Depends(get_current_user)):
@@ -1095,7 +1509,7 @@ async def update_owner_amounts(owner_id: str, total_owed: float, current_user: d
 @api_router.post("/expenses", response_model=Expense)
 async def create_expense(expense_data: ExpenseCreate, current_user: dict = Depends(get_current_user)):
     """Create a new expense"""
-    expense = Expense(**expense_data.model_dump(), created_by=current_user["id"])
+    expense = Expense(**expense_data.model_dump(), balance_due=expense_data.amount, created_by=current_user["id"])
     doc = prepare_doc_for_insert(expense.model_dump())
     await db.expenses.insert_one(doc)
     return expense
@@ -1104,16 +1518,43 @@ async def create_expense(expense_data: ExpenseCreate, current_user: dict = Depen
 async def get_expenses(
     category: Optional[str] = None,
     category_id: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    payment_status: Optional[Literal["pending", "paid"]] = None,
+    expense_type: Optional[Literal["fijo", "variable", "unico"]] = None,
+    is_recurring: Optional[bool] = None,
+    related_reservation_id: Optional[str] = None,
     search: Optional[str] = None,
+    sort: Literal["-expense_date", "expense_date", "reservation_check_in", "-reservation_check_in"] = "-expense_date",
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    accept: Optional[str] = Header(None),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get all expenses with optional filters and search, including balance_due calculation"""
+    """Get expenses with optional filters and search (total_paid/balance_due are stored) - keyset paginated, or streamed as NDJSON
+
+    Los filtros de categoría, estado de pago y tipo usan los índices compuestos
+    (campo, expense_date, id). Al ordenar por reservation_check_in, los gastos sin
+    esa fecha (todos salvo los pagos a propietarios) van al principio en orden
+    ascendente y al final en descendente: el listado es el mismo con cualquier orden.
+    """
     query = {}
     if category:
         query["category"] = category
     if category_id:
-        query["category_id"] = category_id
-    
+        query["expense_category_id"] = category_id
+    expense_date = date_range_filter(date_from, date_to)
+    if expense_date:
+        query["expense_date"] = expense_date
+    if payment_status:
+        query["payment_status"] = payment_status
+    if expense_type:
+        query["expense_type"] = expense_type
+    if is_recurring is not None:
+        query["is_recurring"] = is_recurring
+    if related_reservation_id:
+        query["related_reservation_id"] = related_reservation_id
     # Advanced search: invoice, villa, customer, owner
     if search:
         # Search in description and notes
@@ -1130,49 +1571,72 @@ async def get_expenses(
         else:
             query = search_query
     
-    expenses = await db.expenses.find(query, {"_id": 0}).sort("expense_date", -1).to_list(1000)
-    
-    # Calculate balance_due for each expense based on abonos
-    for expense in expenses:
-        expense_id = expense.get("id")
-        # Get all abonos for this expense
-        abonos = await db.expense_abonos.find({"expense_id": expense_id}, {"_id": 0}).to_list(1000)
-        total_paid = sum(a.get("amount", 0) for a in abonos)
-        
-        # Calculate balance_due: original amount - total paid
-        expense["total_paid"] = total_paid
-        expense["balance_due"] = expense.get("amount", 0) - total_paid
-    
-    return [restore_datetimes(e, ["expense_date", "created_at"]) for e in expenses]
+    return await paginated_response(
+        db.expenses, query, EXPENSE_SORTS[sort], Expense, limit, cursor, fields,
+        stream=wants_ndjson(accept), nullable=("reservation_check_in",)
+    )
+
+@api_router.get("/expenses/reminders", response_model=ExpenseReminders)
+async def get_expense_reminders(
+    days: int = Query(7, ge=0, le=90),
+    limit: int = Query(200, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    """Pending expenses overdue or due from today through today + `days`, all categories
+
+    La fecha de vencimiento es expense_date (los gastos recurrentes se generan en
+    su payment_reminder_day): todo sale del índice (payment_status, expense_date, id).
+    """
+    today_start = datetime.combine(datetime.now(timezone.utc).date(), datetime.min.time(), tzinfo=timezone.utc)
+    window_end = today_start + timedelta(days=days + 1)
+    overdue_query = {"payment_status": "pending", "expense_date": {"$lt": today_start}}
+    upcoming_query = {"payment_status": "pending", "expense_date": {"$gte": today_start, "$lt": window_end}}
+    
+    overdue, upcoming, overdue_count, upcoming_count = await asyncio.gather(
+        db.expenses.find(overdue_query, {"_id": 0}).sort([("expense_date", 1), ("id", 1)]).to_list(limit),
+        db.expenses.find(upcoming_query, {"_id": 0}).sort([("expense_date", 1), ("id", 1)]).to_list(limit),
+        db.expenses.count_documents(overdue_query),
+        db.expenses.count_documents(upcoming_query),
+    )
+    return ExpenseReminders(
+        overdue=[restore_datetimes(e, ["expense_date", "created_at"]) for e in overdue],
+        upcoming=[restore_datetimes(e, ["expense_date", "created_at"]) for e in upcoming],
+        overdue_count=overdue_count,
+        upcoming_count=upcoming_count,
+    )
 
 @api_router.get("/expenses/{expense_id}", response_model=Expense)
-async def get_expense(expense_id: str, current_user: dict = Depends(get_current_user)):
-    """Get an expense by ID"""
-    expense = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
+async def get_expense(expense_id: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """Get an expense by ID - ?fields= returns only the listed fields"""
+    requested = parse_fields(fields, Expense)
+    projection = fields_projection(Expense, requested) if requested else {"_id": 0}
+    expense = await db.expenses.find_one({"id": expense_id}, projection)
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
+    if requested:
+        return fast_json_document(expense, Expense, requested)
     return restore_datetimes(expense, ["expense_date", "created_at"])
 
 @api_router.put("/expenses/{expense_id}", response_model=Expense)
 async def update_expense(expense_id: str, update_data: ExpenseUpdate, current_user: dict = Depends(get_current_user)):
-    """Update an expense"""
-    existing = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    
+    """Update an expense - with `version`, only if nobody changed it since it was read (409 otherwise)"""
     update_dict = {k: v for k, v in update_data.model_dump(exclude_unset=True).items() if v is not None}
-    
-    if update_dict:
-        prepared_update = {}
-        for key, value in update_dict.items():
-            if isinstance(value, datetime):
-                prepared_update[key] = value.isoformat()
-            else:
-                prepared_update[key] = value
-        
-        await db.expenses.update_one({"id": expense_id}, {"$set": prepared_update})
-    
-    updated = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
+    expected_version = update_dict.pop("version", None)
+    if not update_dict:
+        return await get_expense(expense_id, current_user=current_user)
+    
+    # Si cambia el monto, balance_due se recalcula con el total_paid guardado
+    pipeline = [literal_set(update_dict), {"$set": VERSION_BUMP}]
+    if "amount" in update_dict:
+        pipeline.append(EXPENSE_BALANCE_STAGE)
+    updated = await db.expenses.find_one_and_update(
+        version_filter(expense_id, expected_version),
+        pipeline,
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is None:
+        raise await version_conflict(db.expenses, expense_id, "Expense not found")
     return restore_datetimes(updated, ["expense_date", "created_at"])
 
 @api_router.delete("/expenses/{expense_id}")
@@ -1183,8 +1647,9 @@ async def delete_expense(expense_id: str, current_user: dict = Depends(require_a
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     
-    # Eliminar abonos asociados
+    # Eliminar abonos asociados y liberar sus números de factura
     await db.expense_abonos.delete_many({"expense_id": expense_id})
+    await db.invoice_numbers.delete_many({"expense_id": expense_id})
     
     # Eliminar el gasto
     result = await db.expenses.delete_one({"id": expense_id})
@@ -1195,72 +1660,76 @@ async def delete_expense(expense_id: str, current_user: dict = Depends(require_a
 @api_router.post("/expenses/{expense_id}/abonos", response_model=Abono)
 async def add_abono_to_expense(expense_id: str, abono_data: AbonoCreate, current_user: dict = Depends(get_current_user)):
     """Add a payment (abono) to an expense - each abono gets its own invoice number"""
-    expense = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
+    expense = await db.expenses.find_one({"id": expense_id}, {"_id": 1})
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
     
+    # Create abono record; invoice_number is assigned on insert
+    abono_dict = abono_data.model_dump()
+    abono_dict["invoice_number"] = ""
+    abono = Abono(**abono_dict, created_by=current_user["id"])
+    abono_doc = prepare_doc_for_insert(abono.model_dump())
+    
+    # Store in expense_abonos collection
+    abono_doc["expense_id"] = expense_id
+    entry = invoice_entry("expense_abono", abono.id, expense_id=expense_id)
+    
+    async def apply_payment(invoice_number, session):
+        # Update total_paid, balance_due and payment_status atomically, in the same transaction as the abono
+        await db.expenses.update_one(
+            {"id": expense_id}, expense_payment_update(abono_data.amount), session=session
+        )
+    
     # Handle invoice_number generation
     if abono_data.invoice_number:
-        # Admin provided manual invoice number - validate it's available
+        # Admin provided manual invoice number - the registry rejects numbers already in use
         if current_user.get("role") != "admin":
             raise HTTPException(status_code=403, detail="Only admins can specify manual invoice numbers")
         
         invoice_num_str = str(abono_data.invoice_number)
-        is_available = await validate_invoice_number_available(invoice_num_str)
-        if not is_available:
+        try:
+            await insert_with_manual_invoice_number(
+                db, db.expense_abonos, abono_doc, invoice_num_str, entry, apply_payment
+            )
+        except DuplicateKeyError:
             raise HTTPException(status_code=400, detail=f"Invoice number {invoice_num_str} is already in use")
-        invoice_number = invoice_num_str
+        abono.invoice_number = invoice_num_str
     else:
         # Auto-generate invoice number for employee/admin
-        invoice_number = str(await get_next_invoice_number())
-    
-    # Create abono record with invoice_number
-    abono_dict = abono_data.model_dump()
-    abono_dict["invoice_number"] = invoice_number  
-    abono = Abono(**abono_dict, created_by=current_user["id"])
-    abono_doc = prepare_doc_for_insert(abono.model_dump())
-    
-    # Store in expense_abonos collection
-    abono_doc["expense_id"] = expense_id
-    await db.expense_abonos.insert_one(abono_doc)
-    
-    # Get total abonos for this expense
-    all_abonos = await db.expense_abonos.find({"expense_id": expense_id}, {"_id": 0}).to_list(1000)
-    total_paid = sum(a.get("amount", 0) for a in all_abonos)
-    
-    # Update expense payment status
-    new_status = "paid" if total_paid >= expense.get("amount", 0) else "pending"
-    
-    await db.expenses.update_one(
-        {"id": expense_id},
-        {"$set": {"payment_status": new_status}}
-    )
+        abono.invoice_number = await insert_with_invoice_number(
+            db, db.expense_abonos, abono_doc, entry, invoice_lease, apply_payment
+        )
     
     return abono
 
 @api_router.get("/expenses/{expense_id}/abonos", response_model=List[Abono])
-async def get_expense_abonos(expense_id: str, current_user: dict = Depends(get_current_user)):
-    """Get all abonos for an expense"""
-    abonos = await db.expense_abonos.find({"expense_id": expense_id}, {"_id": 0}).sort("payment_date", -1).to_list(100)
-    return [restore_datetimes(a, ["payment_date", "created_at"]) for a in abonos]
+async def get_expense_abonos(
+    expense_id: str,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get abonos for an expense, newest first - keyset paginated with limit/cursor"""
+    return await paginated_response(
+        db.expense_abonos, {"expense_id": expense_id}, ABONO_SORT, Abono,
+        limit, cursor, fields
+    )
 
 @api_router.delete("/expenses/{expense_id}/abonos/{abono_id}")
 async def delete_expense_abono(expense_id: str, abono_id: str, current_user: dict = Depends(require_admin)):
     """Delete an abono from an expense (admin only) - to correct errors"""
-    # Delete the abono
-    result = await db.expense_abonos.delete_one({"expense_id": expense_id, "id": abono_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Abono not found")
-    
-    # Recalculate expense status
-    expense = await db.expenses.find_one({"id": expense_id}, {"_id": 0})
-    if expense:
-        all_abonos = await db.expense_abonos.find({"expense_id": expense_id}, {"_id": 0}).to_list(1000)
-        total_paid = sum(a.get("amount", 0) for a in all_abonos)
-        new_status = "paid" if total_paid >= expense.get("amount", 0) else "pending"
+    async with transaction(db) as session:
+        # Delete the abono, release its invoice number and revert the payment, all together
+        abono_to_delete = await db.expense_abonos.find_one_and_delete(
+            {"expense_id": expense_id, "id": abono_id}, projection={"_id": 0, "amount": 1}, session=session
+        )
+        if not abono_to_delete:
+            raise HTTPException(status_code=404, detail="Abono not found")
+        
+        await db.invoice_numbers.delete_one({"document_id": abono_id}, session=session)
         await db.expenses.update_one(
-            {"id": expense_id},
-            {"$set": {"payment_status": new_status}}
+            {"id": expense_id}, expense_payment_update(-abono_to_delete.get("amount", 0)), session=session
         )
     
     return {"message": "Abono deleted successfully"}
@@ -1299,21 +1768,16 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     ).sort("created_at", -1).limit(10).to_list(10)
     pending_payment_reservations = [restore_datetimes(r, ["reservation_date", "created_at", "updated_at"]) for r in pending_payment_reservations_raw]
     
-    # Calcular compromisos del mes actual
-    from datetime import datetime, timezone
+    # Calcular compromisos del mes actual - rango de fechas indexado (category, expense_date)
     now = datetime.now(timezone.utc)
-    current_month = now.month
-    current_year = now.year
-    
-    # Obtener todos los gastos con categoría "compromiso" del mes actual
-    commitments = []
-    for expense in all_expenses:
-        if expense.get("category") == "compromiso":
-            expense_date = expense.get("expense_date")
-            if isinstance(expense_date, str):
-                expense_date = datetime.fromisoformat(expense_date.replace('Z', '+00:00'))
-            if expense_date and expense_date.month == current_month and expense_date.year == current_year:
-                commitments.append(expense)
+    month_start = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    next_month_start = datetime(now.year + now.month // 12, now.month % 12 + 1, 1, tzinfo=timezone.utc)
+    today_start = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+    
+    commitments = await db.expenses.find(
+        {"category": "compromiso", "expense_date": {"$gte": month_start, "$lt": next_month_start}},
+        {"_id": 0, "amount": 1, "currency": 1, "payment_status": 1, "expense_date": 1}
+    ).to_list(None)
     
     commitments_count = len(commitments)
     commitments_total_dop = sum(c.get("amount", 0) for c in commitments if c.get("currency") == "DOP")
@@ -1322,14 +1786,10 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     commitments_pending_count = len([c for c in commitments if c.get("payment_status") == "pending"])
     
     # Contar compromisos vencidos (pendientes con fecha pasada)
-    commitments_overdue_count = 0
-    for commitment in commitments:
-        if commitment.get("payment_status") == "pending":
-            expense_date = commitment.get("expense_date")
-            if isinstance(expense_date, str):
-                expense_date = datetime.fromisoformat(expense_date.replace('Z', '+00:00'))
-            if expense_date and expense_date.date() < now.date():
-                commitments_overdue_count += 1
+    commitments_overdue_count = len([
+        c for c in commitments
+        if c.get("payment_status") == "pending" and c["expense_date"] < today_start
+    ])
     
     return DashboardStats(
         total_reservations=total_reservations,
@@ -1360,6 +1820,11 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "espacios-con-piscina-api"}
 
+@api_router.get("/health/db-pool")
+async def db_pool_stats(current_user: dict = Depends(require_admin)):
+    """MongoDB connection pool configuration and metrics (admin only)"""
+    return Database.pool_stats()
+
 # ============ EXPORT/IMPORT ENDPOINTS ============
 from backend.export_service import create_excel_template, export_data_to_excel
 from backend.import_service import import_customers, import_villas, import_reservations, import_expenses
@@ -1502,9 +1967,105 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor"],
 )
 
+# Startup event
+@app.on_event("startup")
+async def startup_event():
+    await bootstrap_indexes(db)
+    
+    # Antes de atender peticiones: el upsert de la deuda con el propietario busca por villa_code
+    await backfill_owner_villa_codes()
+    
+    # Fechas ISO (string) a fechas nativas, antes de atender peticiones y de arrancar las
+    # tareas de fondo: las consultas por rango de fechas no ven los documentos con string
+    await run_datetime_migration()
+    
+    # Primer arranque con el registro de facturas: poblarlo con los números existentes
+    try:
+        if await db.invoice_numbers.estimated_document_count() == 0:
+            inserted = await rebuild_invoice_registry(db)
+            logger.info(f"Registro de facturas poblado con {inserted} números")
+    except PyMongoError as e:
+        logger.error(f"No se pudo poblar el registro de facturas: {e}")
+    
+    # Primera copia de los datos del cliente en las reservaciones existentes
+    asyncio.create_task(run_customer_snapshot_backfill())
+    
+    # Primer cálculo de total_paid/balance_due guardados en los gastos
+    asyncio.create_task(run_expense_balance_backfill())
+    
+    # Pagos a propietarios creados sin reservation_check_in (ordenamiento por check-in)
+    asyncio.create_task(backfill_owner_expense_check_in())
+    
+    # Matriz de disponibilidad: carga inicial y reconstrucción periódica
+    asyncio.create_task(refresh_availability_periodically(db))
+    
+    # Tareas programadas (cambios de estado automáticos)
+    asyncio.create_task(run_scheduler(db))
+
+async def run_datetime_migration():
+    """Run the datetime migration unless it already completed"""
+    try:
+        if not await is_migration_complete(db, DATETIME_MIGRATION):
+            await migrate_datetimes(db)
+    except PyMongoError as e:
+        logger.error(f"Error en la migración de fechas: {e}")
+
+async def run_customer_snapshot_backfill():
+    """Copy customer fields onto existing reservations unless it already ran"""
+    try:
+        if not await is_migration_complete(db, CUSTOMER_SNAPSHOT_MIGRATION):
+            await reconcile_customer_snapshots(db)
+    except PyMongoError as e:
+        logger.error(f"Error copiando datos de clientes a reservaciones: {e}")
+
+async def run_expense_balance_backfill():
+    """Store total_paid/balance_due on existing expenses unless it already ran"""
+    try:
+        if not await is_migration_complete(db, EXPENSE_BALANCE_MIGRATION):
+            await reconcile_expense_balances(db)
+    except PyMongoError as e:
+        logger.error(f"Error calculando saldos de gastos: {e}")
+
+async def backfill_owner_expense_check_in():
+    """Copy expense_date into reservation_check_in on reservation expenses that lack it. Idempotent"""
+    try:
+        result = await db.expenses.update_many(
+            {"reservation_check_in": None, "related_reservation_id": {"$ne": None}},
+            [{"$set": {"reservation_check_in": "$expense_date"}}]
+        )
+        if result.modified_count:
+            logger.info(f"reservation_check_in agregado a {result.modified_count} gastos")
+    except PyMongoError as e:
+        logger.error(f"Error agregando reservation_check_in a gastos: {e}")
+
+async def backfill_owner_villa_codes():
+    """Set villa_code on auto-generated "Propietario <code>" owners created before it existed. Idempotent"""
+    try:
+        owners = await db.villa_owners.find(
+            {"villa_code": None, "name": {"$regex": f"^{OWNER_NAME_PREFIX}"}},
+            {"_id": 0, "id": 1, "name": 1}
+        ).sort("created_at", 1).to_list(None)
+        linked = set()
+        for owner in owners:
+            code = owner["name"][len(OWNER_NAME_PREFIX):]
+            if code in linked:
+                # Duplicado de antes del índice único: se deja sin villa_code y su deuda no crece más
+                logger.warning(f"Propietario duplicado para la villa {code}: {owner['id']}")
+                continue
+            try:
+                await db.villa_owners.update_one({"id": owner["id"]}, {"$set": {"villa_code": code}})
+            except DuplicateKeyError:
+                logger.warning(f"La villa {code} ya tiene propietario; {owner['id']} queda sin villa_code")
+            linked.add(code)
+    except PyMongoError as e:
+        logger.error(f"Error asignando villa_code a propietarios: {e}")
+
 # Shutdown event
 @app.on_event("shutdown")
 async def shutdown_event():
+    if invoice_lease is not None:
+        await invoice_lease.release(db)
     Database.close_db()
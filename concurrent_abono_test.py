@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Concurrent Abono Invoice Number Testing
+Sends many abonos at the same time and checks the invoice numbers are unique,
+consecutive (no gaps) and that the reservation balance counts every payment.
+Run against a server with INVOICE_LEASE_SIZE=0 and no other traffic: with
+worker leases the numbers of different workers interleave.
+"""
+
+import requests
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any
+
+# Backend URL from environment
+BACKEND_URL = "https://villa-expense-mgr.preview.emergentagent.com/api"
+
+CONCURRENT_ABONOS = 20
+ABONO_AMOUNT = 100.0
+
+class ConcurrentAbonoTester:
+    def __init__(self):
+        self.admin_token = None
+        self.test_results = []
+
+    def log_test(self, test_name: str, success: bool, message: str, details: Any = None):
+        """Log test result"""
+        result = {
+            "test": test_name,
+            "success": success,
+            "message": message,
+            "details": details
+        }
+        self.test_results.append(result)
+        status = "✅ PASS" if success else "❌ FAIL"
+        print(f"{status}: {test_name} - {message}")
+        if details and not success:
+            print(f"   Details: {details}")
+
+    def make_request(self, method: str, endpoint: str, data: Dict = None, token: str = None) -> Dict:
+        """Make HTTP request to backend"""
+        url = f"{BACKEND_URL}{endpoint}"
+        headers = {"Content-Type": "application/json"}
+
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        try:
+            if method == "GET":
+                response = requests.get(url, headers=headers, params=data)
+            elif method == "POST":
+                response = requests.post(url, headers=headers, json=data)
+            elif method == "DELETE":
+                response = requests.delete(url, headers=headers)
+            else:
+                return {"error": f"Unsupported method: {method}"}
+
+            return {
+                "status_code": response.status_code,
+                "data": response.json() if response.content else {},
+                "success": 200 <= response.status_code < 300
+            }
+        except Exception as e:
+            return {"error": str(e), "success": False}
+
+    def login_admin(self):
+        """Login admin user"""
+        result = self.make_request("POST", "/auth/login", {"username": "admin", "password": "admin123"})
+        if result.get("success"):
+            self.admin_token = result["data"]["access_token"]
+            self.log_test("Admin Login", True, "Admin logged in successfully")
+            return True
+        self.log_test("Admin Login", False, "Admin login failed", result)
+        return False
+
+    def setup_test_data(self):
+        """Create test customer and reservation"""
+        customer_data = {
+            "name": "Test Cliente Abonos Concurrentes",
+            "phone": "809-555-8888",
+            "email": "test.concurrentes@email.com",
+            "address": "Santo Domingo, RD"
+        }
+
+        customer_result = self.make_request("POST", "/customers", customer_data, self.admin_token)
+        if not customer_result.get("success"):
+            self.log_test("Create Test Customer", False, "Failed to create test customer", customer_result)
+            return None
+        test_customer = customer_result["data"]
+
+        villas_result = self.make_request("GET", "/villas", token=self.admin_token)
+        if not villas_result.get("success") or not villas_result["data"]:
+            self.log_test("Get Villa", False, "No villas available")
+            return None
+        test_villa = villas_result["data"][0]
+
+        total = 20000.0 + CONCURRENT_ABONOS * ABONO_AMOUNT
+        reservation_data = {
+            "customer_id": test_customer["id"],
+            "customer_name": test_customer["name"],
+            "villa_id": test_villa["id"],
+            "villa_code": test_villa["code"],
+            "rental_type": "pasadia",
+            "reservation_date": "2025-03-20T00:00:00Z",
+            "check_in_time": "10:00 AM",
+            "check_out_time": "8:00 PM",
+            "guests": 6,
+            "base_price": total,
+            "owner_price": 0.0,
+            "subtotal": total,
+            "total_amount": total,
+            "amount_paid": 0.0,
+            "currency": "DOP",
+            "status": "confirmed",
+            "notes": "Test reservation for concurrent abonos"
+        }
+
+        reservation_result = self.make_request("POST", "/reservations", reservation_data, self.admin_token)
+        if not reservation_result.get("success"):
+            self.log_test("Create Test Reservation", False, "Failed to create test reservation", reservation_result)
+            return None
+
+        test_reservation = reservation_result["data"]
+        self.log_test("Create Test Reservation", True, f"Created reservation #{test_reservation['invoice_number']}")
+        return test_reservation
+
+    def post_abono(self, reservation_id: str, index: int) -> Dict:
+        abono_data = {
+            "amount": ABONO_AMOUNT,
+            "currency": "DOP",
+            "payment_method": "efectivo",
+            "payment_date": "2025-03-20T10:00:00Z",
+            "notes": f"Abono concurrente {index + 1}"
+        }
+        return self.make_request("POST", f"/reservations/{reservation_id}/abonos", abono_data, self.admin_token)
+
+    def test_concurrent_abonos(self, reservation):
+        """Post abonos in parallel and check their invoice numbers"""
+        print(f"\n🧾 Posting {CONCURRENT_ABONOS} abonos concurrently")
+
+        with ThreadPoolExecutor(max_workers=CONCURRENT_ABONOS) as executor:
+            results = list(executor.map(
+                lambda i: self.post_abono(reservation["id"], i), range(CONCURRENT_ABONOS)
+            ))
+
+        failed = [r for r in results if not r.get("success")]
+        if failed:
+            self.log_test("All Abonos Created", False, f"{len(failed)} of {CONCURRENT_ABONOS} abonos failed", failed[:3])
+            return
+        self.log_test("All Abonos Created", True, f"{CONCURRENT_ABONOS} abonos created")
+
+        numbers = [r["data"].get("invoice_number") for r in results]
+        if len(set(numbers)) == len(numbers):
+            self.log_test("Unique Invoice Numbers", True, "No duplicate invoice numbers")
+        else:
+            duplicates = sorted({n for n in numbers if numbers.count(n) > 1})
+            self.log_test("Unique Invoice Numbers", False, "Duplicate invoice numbers", duplicates)
+
+        try:
+            values = sorted(int(n) for n in numbers)
+        except (TypeError, ValueError):
+            self.log_test("No Gaps", False, "Invoice numbers are not numeric", numbers)
+            return
+        missing = sorted(set(range(values[0], values[-1] + 1)) - set(values))
+        if not missing:
+            self.log_test("No Gaps", True, f"Consecutive invoice numbers {values[0]}-{values[-1]}")
+        else:
+            self.log_test("No Gaps", False, f"{len(missing)} numbers skipped", missing)
+
+        # Every abono must be counted once in the balance
+        reservation_result = self.make_request("GET", f"/reservations/{reservation['id']}", token=self.admin_token)
+        if not reservation_result.get("success"):
+            self.log_test("Reservation Balance", False, "Failed to fetch reservation", reservation_result)
+            return
+        amount_paid = reservation_result["data"].get("amount_paid")
+        expected = CONCURRENT_ABONOS * ABONO_AMOUNT
+        if abs((amount_paid or 0) - expected) < 0.01:
+            self.log_test("Reservation Balance", True, f"amount_paid = {amount_paid}")
+        else:
+            self.log_test("Reservation Balance", False, f"amount_paid = {amount_paid}, expected {expected}")
+
+    def cleanup(self, reservation):
+        """Delete the test reservation"""
+        self.make_request("DELETE", f"/reservations/{reservation['id']}", token=self.admin_token)
+
+    def run_tests(self):
+        """Run concurrent abono tests"""
+        print("🧾 Starting Concurrent Abono Invoice Number Tests")
+        print("=" * 60)
+
+        if not self.login_admin():
+            return False
+
+        reservation = self.setup_test_data()
+        if not reservation:
+            return False
+
+        try:
+            self.test_concurrent_abonos(reservation)
+        finally:
+            self.cleanup(reservation)
+
+        # Summary
+        print("\n" + "=" * 60)
+        print("📊 CONCURRENT ABONO TEST SUMMARY")
+        print("=" * 60)
+
+        passed = sum(1 for result in self.test_results if result["success"])
+        failed = len(self.test_results) - passed
+
+        print(f"Total Tests: {len(self.test_results)}")
+        print(f"✅ Passed: {passed}")
+        print(f"❌ Failed: {failed}")
+
+        if failed > 0:
+            print("\n🔍 FAILED TESTS:")
+            for result in self.test_results:
+                if not result["success"]:
+                    print(f"   ❌ {result['test']}: {result['message']}")
+
+        return failed == 0
+
+if __name__ == "__main__":
+    tester = ConcurrentAbonoTester()
+    success = tester.run_tests()
+
+    if success:
+        print("\n🎉 All concurrent abono tests passed!")
+        sys.exit(0)
+    else:
+        print("\n💥 Some concurrent abono tests failed!")
+        sys.exit(1)
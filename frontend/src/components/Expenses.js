@@ -153,7 +153,8 @@ const Expenses = () => {
       };
       
       if (editingExpense) {
-        await updateExpense(editingExpense.id, dataToSend);
+        // version: si otro usuario lo modificó mientras tanto el servidor responde 409
+        await updateExpense(editingExpense.id, { ...dataToSend, version: editingExpense.version });
       } else {
         await createExpense(dataToSend);
       }
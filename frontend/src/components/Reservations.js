@@ -260,7 +260,14 @@ const Reservations = () => {
       };
       
       if (editingReservation) {
-        await updateReservation(editingReservation.id, dataToSend);
+        // version: si otro usuario la modificó mientras tanto el servidor responde 409.
+        // amount_paid solo se envía si se cambió aquí: los abonos lo actualizan por su cuenta
+        const { amount_paid, ...updateData } = dataToSend;
+        updateData.version = editingReservation.version;
+        if (amount_paid !== editingReservation.amount_paid) {
+          updateData.amount_paid = amount_paid;
+        }
+        await updateReservation(editingReservation.id, updateData);
       } else {
         await createReservation(dataToSend);
       }
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark de serialización para listados
+Compara el camino actual (restore_datetimes + validación con response_model +
+codificador JSON estándar) con el camino rápido de backend/serialization.py
+Uso: python serialization_benchmark.py [cantidad_de_reservaciones]
+"""
+
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from pydantic import TypeAdapter
+
+from backend.database import restore_datetimes
+from backend.models import Reservation
+from backend.serialization import fast_json_response, model_projection
+
+ROUNDS = 20
+
+
+def make_reservations(count: int) -> List[dict]:
+    """Documentos como los devuelve Motor con model_projection(Reservation)"""
+    now = datetime.now(timezone.utc)
+    docs = []
+    for i in range(count):
+        docs.append({
+            "id": str(uuid.uuid4()),
+            "invoice_number": str(1600 + i),
+            "customer_id": str(uuid.uuid4()),
+            "customer_name": f"Cliente {i}",
+            "villa_id": str(uuid.uuid4()),
+            "villa_code": "ECPVSH",
+            "villa_description": "Villa Sabrina",
+            "rental_type": "pasadia",
+            "event_type": None,
+            "reservation_date": now + timedelta(days=i % 90),
+            "check_in_time": "9:00 AM",
+            "check_out_time": "8:00 PM",
+            "guests": 20,
+            "base_price": 15000.0,
+            "owner_price": 10000.0,
+            "extra_hours": 0.0,
+            "extra_hours_cost": 0.0,
+            "extra_services": [
+                {"service_id": str(uuid.uuid4()), "service_name": "DJ", "quantity": 1, "unit_price": 5000.0, "total": 5000.0}
+            ],
+            "extra_services_total": 5000.0,
+            "subtotal": 20000.0,
+            "discount": 0.0,
+            "include_itbis": False,
+            "itbis_amount": 0.0,
+            "total_amount": 20000.0,
+            "deposit": 5000.0,
+            "payment_method": "efectivo",
+            "payment_details": None,
+            "amount_paid": 10000.0,
+            "currency": "DOP",
+            "notes": "Notas de la reservación",
+            "status": "confirmed",
+            "balance_due": 15000.0,
+            "created_at": now,
+            "updated_at": now,
+            "created_by": str(uuid.uuid4()),
+        })
+    return docs
+
+
+def current_path(docs: List[dict], adapter: TypeAdapter) -> bytes:
+    """Lo que hacía FastAPI con response_model=List[Reservation]"""
+    restored = [restore_datetimes(d, ["reservation_date", "created_at", "updated_at"]) for d in docs]
+    validated = adapter.validate_python(restored)
+    content = adapter.dump_python(validated, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(docs: List[dict]) -> bytes:
+    return fast_json_response(docs, Reservation).body
+
+
+def measure(label: str, fn) -> float:
+    fn()  # calentamiento
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn()
+    elapsed_ms = (time.perf_counter() - start) / ROUNDS * 1000
+    print(f"{label:<40} {elapsed_ms:8.2f} ms")
+    return elapsed_ms
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    docs = make_reservations(count)
+    assert set(docs[0]) <= set(model_projection(Reservation))
+    adapter = TypeAdapter(List[Reservation])
+
+    print(f"\n=== SERIALIZACIÓN DE {count} RESERVACIONES ({ROUNDS} rondas) ===\n")
+    current = measure("Actual (validación + json)", lambda: current_path(docs, adapter))
+    fast = measure("Rápido (sin revalidar + orjson)", lambda: fast_path(docs))
+    print(f"\nMejora: {current / fast:.1f}x\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Base de datos en memoria para probar los servicios sin MongoDB
+Cubre solo lo que usan los servicios de facturación: filtros de igualdad,
+índices únicos, pipelines sencillos ($add, $ifNull, $literal) y sesiones con
+transacción cuyo commit puede fallar a propósito.
+"""
+from itertools import count
+from typing import Dict, List, Optional
+import asyncio
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+_object_ids = count(1)
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    return all(doc.get(field) == value for field, value in query.items())
+
+
+def _eval(expr, doc: dict):
+    if isinstance(expr, str) and expr.startswith("$"):
+        return doc.get(expr[1:])
+    if isinstance(expr, dict) and len(expr) == 1:
+        (op, args), = expr.items()
+        if op == "$add":
+            return sum(_eval(a, doc) for a in args)
+        if op == "$ifNull":
+            value = _eval(args[0], doc)
+            return value if value is not None else _eval(args[1], doc)
+        if op == "$literal":
+            return args
+    return expr
+
+
+class FakeResult:
+    def __init__(self, modified_count: int = 0, deleted_count: int = 0):
+        self.modified_count = modified_count
+        self.deleted_count = deleted_count
+
+
+class FakeCollection:
+    def __init__(self, unique: Optional[str] = None):
+        self.docs: List[dict] = []
+        self.unique = unique
+
+    def _check_unique(self, doc: dict) -> None:
+        value = doc.get(self.unique) if self.unique else None
+        if isinstance(value, str) and any(d.get(self.unique) == value for d in self.docs):
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error {self.unique}: {value}", 11000, {"keyPattern": {self.unique: 1}}
+            )
+
+    def _insert(self, doc: dict, session) -> None:
+        self._check_unique(doc)
+        doc.setdefault("_id", next(_object_ids))
+        stored = dict(doc)
+        self.docs.append(stored)
+        if session is not None:
+            session.undo.append(lambda: self.docs.remove(stored))
+
+    async def insert_one(self, doc: dict, session=None):
+        await asyncio.sleep(0)
+        self._insert(doc, session)
+
+    async def insert_many(self, docs: List[dict], ordered: bool = True, session=None):
+        await asyncio.sleep(0)
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                self._insert(doc, session)
+            except DuplicateKeyError:
+                errors.append({"index": index, "code": 11000})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    async def find_one(self, query: dict, projection=None, session=None) -> Optional[dict]:
+        await asyncio.sleep(0)
+        return next((dict(d) for d in self.docs if _matches(d, query)), None)
+
+    async def delete_one(self, query: dict, session=None) -> FakeResult:
+        await asyncio.sleep(0)
+        for doc in self.docs:
+            if _matches(doc, query):
+                self.docs.remove(doc)
+                return FakeResult(deleted_count=1)
+        return FakeResult()
+
+    async def update_one(self, query: dict, update: dict, session=None) -> FakeResult:
+        await asyncio.sleep(0)
+        for doc in self.docs:
+            if _matches(doc, query):
+                doc.update(update["$set"])
+                return FakeResult(modified_count=1)
+        return FakeResult()
+
+    async def find_one_and_update(self, query: dict, pipeline: list, upsert=False, return_document=None, session=None):
+        # La espera va antes: la lectura y la escritura son atómicas, como en MongoDB
+        await asyncio.sleep(0)
+        doc = next((d for d in self.docs if _matches(d, query)), None)
+        if doc is None:
+            doc = {**query, "_id": next(_object_ids)}
+            self.docs.append(doc)
+        for stage in pipeline:
+            doc.update({field: _eval(expr, doc) for field, expr in stage["$set"].items()})
+        return dict(doc)
+
+
+class FakeSession:
+    """Session whose commits follow `outcomes`: ok, transient, unknown_applied or unknown_lost"""
+
+    def __init__(self, outcomes: List[str]):
+        self.outcomes = outcomes
+        self.undo: list = []
+        self.in_transaction = False
+        self.commits = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def start_transaction(self):
+        self.in_transaction = True
+        self.undo = []
+
+    def _rollback(self):
+        for undo in reversed(self.undo):
+            undo()
+        self.undo = []
+
+    async def abort_transaction(self):
+        self._rollback()
+        self.in_transaction = False
+
+    async def commit_transaction(self):
+        self.commits += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else "ok"
+        if outcome in ("ok", "unknown_applied"):
+            self.undo = []
+        else:
+            self._rollback()
+        if outcome == "ok":
+            self.in_transaction = False
+            return
+        label = "TransientTransactionError" if outcome == "transient" else "UnknownTransactionCommitResult"
+        raise PyMongoError(f"commit {outcome}", error_labels=[label])
+
+
+class FakeAdmin:
+    def __init__(self, replica_set: bool):
+        self.replica_set = replica_set
+
+    async def command(self, name: str) -> dict:
+        return {"setName": "rs0"} if self.replica_set else {}
+
+
+class FakeClient:
+    def __init__(self, replica_set: bool = False, commit_outcomes: Optional[List[str]] = None):
+        self.admin = FakeAdmin(replica_set)
+        self.commit_outcomes = commit_outcomes if commit_outcomes is not None else []
+        self.sessions: List[FakeSession] = []
+
+    async def start_session(self) -> FakeSession:
+        session = FakeSession(self.commit_outcomes)
+        self.sessions.append(session)
+        return session
+
+
+class FakeDB:
+    """Collections are created on first use; the invoice collections enforce unique invoice_number"""
+
+    UNIQUE = {
+        "invoice_numbers": "invoice_number",
+        "reservations": "invoice_number",
+        "reservation_abonos": "invoice_number",
+        "expense_abonos": "invoice_number",
+    }
+
+    def __init__(self, client: Optional[FakeClient] = None):
+        self.client = client or FakeClient()
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self.UNIQUE.get(name))
+        return self.collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+
+from backend.availability_service import AvailabilityIndex
+
+TODAY = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+TOMORROW = TODAY + timedelta(days=1)
+
+VILLAS = [
+    {"id": "v1", "code": "ECP-1", "name": "Villa Uno", "max_guests": 10, "category_id": "c1", "is_active": True},
+    {"id": "v2", "code": "ECP-2", "name": "Villa Dos", "max_guests": 30, "category_id": "c2", "is_active": True},
+]
+
+
+class FakeCursor:
+    def __init__(self, docs, gate=None):
+        self.docs = list(docs)
+        self.gate = gate
+
+    async def to_list(self, length):
+        if self.gate is not None:
+            await self.gate.wait()
+        return self.docs
+
+
+class FakeCollection:
+    def __init__(self, docs, gates=None):
+        self.docs = docs
+        self.gates = gates
+        self.calls = 0
+
+    def find(self, query, projection):
+        # La foto se toma al llamar a find; to_list espera la compuerta de esta llamada
+        gate = self.gates[self.calls] if self.gates else None
+        self.calls += 1
+        return FakeCursor(self.docs, gate)
+
+
+class FakeDB:
+    def __init__(self, reservations, gates=None):
+        self.villas = FakeCollection(VILLAS)
+        self.reservations = FakeCollection(reservations, gates)
+
+
+def booking(id_, villa_id, day, check_in, check_out, status="confirmed"):
+    return {"id": id_, "villa_id": villa_id, "reservation_date": day,
+            "check_in_time": check_in, "check_out_time": check_out, "status": status}
+
+
+def build(reservations):
+    index = AvailabilityIndex()
+    asyncio.run(index.rebuild(FakeDB(reservations)))
+    return index
+
+
+def free_dates(index, days=2, check_in="9:00 AM", check_out="8:00 PM", **filters):
+    return {r["villa_id"]: r["available_dates"] for r in index.search(TODAY.date(), days, check_in, check_out, **filters)}
+
+
+def test_booked_day_is_not_available():
+    index = build([booking("r1", "v1", TODAY, "10:00 AM", "6:00 PM")])
+    assert free_dates(index) == {
+        "v1": [TOMORROW.date().isoformat()],
+        "v2": [TODAY.date().isoformat(), TOMORROW.date().isoformat()],
+    }
+
+
+def test_overnight_blocks_next_morning():
+    index = build([booking("r1", "v2", TODAY, "9:00 PM", "10:00 AM")])
+    assert free_dates(index, check_in="9:00 AM", check_out="6:00 PM")["v2"] == [TODAY.date().isoformat()]
+
+
+def test_window_next_to_a_booking_is_free():
+    index = build([booking("r1", "v1", TODAY, "8:00 AM", "1:00 PM")])
+    assert free_dates(index, days=1, check_in="1:00 PM", check_out="8:00 PM")["v1"] == [TODAY.date().isoformat()]
+
+
+def test_cancelled_and_removed_bookings_free_the_slots():
+    index = build([booking("r1", "v1", TODAY, "10:00 AM", "6:00 PM")])
+    assert "v1" not in free_dates(index, days=1)
+    index.apply_reservation(booking("r1", "v1", TODAY, "10:00 AM", "6:00 PM", status="cancelled"))
+    assert "v1" in free_dates(index, days=1)
+
+    index.apply_reservation(booking("r2", "v1", TODAY, "10:00 AM", "6:00 PM"))
+    assert "v1" not in free_dates(index, days=1)
+    index.remove_reservation("r2")
+    assert "v1" in free_dates(index, days=1)
+
+
+def test_moved_booking_frees_the_old_day():
+    index = build([booking("r1", "v1", TODAY, "10:00 AM", "6:00 PM")])
+    index.apply_reservation(booking("r1", "v1", TOMORROW, "10:00 AM", "6:00 PM"))
+    assert free_dates(index)["v1"] == [TODAY.date().isoformat()]
+
+
+def test_filters_by_guests_and_category():
+    index = build([])
+    assert set(free_dates(index, guests=20)) == {"v2"}
+    assert set(free_dates(index, category_id="c1")) == {"v1"}
+
+
+def test_overlapping_rebuilds_keep_local_changes():
+    reservations = []
+    gates = [asyncio.Event() for _ in range(3)]
+    gates[0].set()
+    index = AvailabilityIndex()
+    db = FakeDB(reservations, gates)
+
+    async def run():
+        await index.rebuild(db)
+        first = asyncio.create_task(index.rebuild(db))
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+        # Reservación creada en este worker mientras la primera reconstrucción lee
+        created = booking("r1", "v1", TODAY, "10:00 AM", "6:00 PM")
+        reservations.append(created)
+        index.apply_reservation(created)
+
+        second = asyncio.create_task(index.rebuild(db))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        # La segunda termina primero si no esperan una a la otra
+        gates[2].set()
+        for _ in range(5):
+            await asyncio.sleep(0)
+        gates[1].set()
+        await asyncio.gather(first, second)
+
+    asyncio.run(run())
+    assert "r1" in index.bookings
+    assert "v1" not in free_dates(index, days=1)
@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from backend.booking_service import (
+    booking_unchanged_filter, needs_booking_check, parse_time, reservation_window, window_minutes
+)
+
+DAY = datetime(2025, 1, 15, tzinfo=timezone.utc)
+NEXT_DAY = datetime(2025, 1, 16, tzinfo=timezone.utc)
+
+
+def overlaps(a, b):
+    return a[0] < b[1] and b[0] < a[1]
+
+
+@pytest.mark.parametrize("value, minutes", [
+    ("9:00 AM", 9 * 60),
+    ("9 pm", 21 * 60),
+    ("12:00 AM", 0),
+    ("12:30 PM", 12 * 60 + 30),
+    ("21:00", 21 * 60),
+    (" 8:15 p.m. ", 20 * 60 + 15),
+])
+def test_parse_time(value, minutes):
+    assert parse_time(value) == minutes
+
+
+@pytest.mark.parametrize("value", [None, "", "mediodía", "13:00 PM", "24:00", "9:75"])
+def test_parse_time_invalid(value):
+    assert parse_time(value) is None
+
+
+def test_window_minutes_same_day():
+    assert window_minutes("9:00 AM", "8:00 PM") == (9 * 60, 20 * 60)
+
+
+def test_window_minutes_overnight_ends_next_day():
+    assert window_minutes("9:00 AM", "8:00 AM") == (9 * 60, 24 * 60 + 8 * 60)
+
+
+def test_window_minutes_unparseable_takes_whole_day():
+    assert window_minutes(None, "lo que sea") == (0, 24 * 60)
+
+
+def test_overnight_overlaps_next_morning():
+    amanecida = reservation_window(DAY, "9:00 PM", "10:00 AM")
+    pasadia = reservation_window(NEXT_DAY, "9:00 AM", "6:00 PM")
+    assert overlaps(amanecida, pasadia)
+
+
+def test_overnight_ending_before_next_checkin_does_not_overlap():
+    amanecida = reservation_window(DAY, "9:00 AM", "8:00 AM")
+    pasadia = reservation_window(NEXT_DAY, "9:00 AM", "6:00 PM")
+    assert not overlaps(amanecida, pasadia)
+
+
+def test_back_to_back_windows_do_not_overlap():
+    morning = reservation_window(DAY, "8:00 AM", "1:00 PM")
+    afternoon = reservation_window(DAY, "1:00 PM", "8:00 PM")
+    assert not overlaps(morning, afternoon)
+
+
+def test_booking_unchanged_filter_same_form():
+    update = {"villa_id": "v1", "reservation_date": DAY, "check_in_time": "9:00 AM", "status": "confirmed", "notes": "x"}
+    assert booking_unchanged_filter(update) == {
+        "villa_id": "v1", "reservation_date": DAY, "check_in_time": "9:00 AM", "status": {"$ne": "cancelled"},
+    }
+
+
+def test_booking_unchanged_filter_cancelling_needs_no_check():
+    assert booking_unchanged_filter({"villa_id": "v1", "status": "cancelled"}) == {}
+
+
+def test_needs_booking_check():
+    existing = {"villa_id": "v1", "reservation_date": DAY, "check_in_time": "9:00 AM",
+                "check_out_time": "6:00 PM", "status": "confirmed"}
+    assert not needs_booking_check(existing, {**existing, "notes": "otra nota"})
+    assert needs_booking_check(existing, {"reservation_date": NEXT_DAY})
+    assert not needs_booking_check(existing, {"reservation_date": NEXT_DAY, "status": "cancelled"})
+    assert needs_booking_check({**existing, "status": "cancelled"}, {"status": "confirmed"})
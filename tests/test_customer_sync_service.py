@@ -0,0 +1,95 @@
+import asyncio
+
+from backend.customer_sync_service import (
+    customer_snapshot, propagate_customer_snapshot, reconcile_customer_snapshots
+)
+from backend.database import VERSION_BUMP
+
+CUSTOMER = {"id": "c1", "name": "Ana Pérez", "identification_document": "001-0000000-1", "dni": None}
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeResult:
+    modified_count = 1
+
+
+class FakeCollection:
+    def __init__(self, docs=()):
+        self.docs = list(docs)
+        self.writes = []
+
+    def find(self, query, projection):
+        return FakeCursor(self.docs)
+
+    async def find_one(self, query, projection):
+        return next((d for d in self.docs if d["id"] == query["id"]), None)
+
+    async def update_many(self, query, update):
+        self.writes.append((query, update))
+        return FakeResult()
+
+    async def bulk_write(self, requests, ordered=True):
+        self.writes.extend((r._filter, r._doc) for r in requests)
+        return FakeResult()
+
+    async def update_one(self, query, update, upsert=False):
+        self.writes.append((query, update))
+
+
+class FakeDB:
+    def __init__(self, customers):
+        self.customers = FakeCollection(customers)
+        self.reservations = FakeCollection()
+        self.migrations = FakeCollection()
+
+
+def test_snapshot_falls_back_to_dni():
+    assert customer_snapshot(CUSTOMER) == {
+        "customer_name": "Ana Pérez", "customer_identification_document": "001-0000000-1",
+    }
+    assert customer_snapshot({"name": "Luis", "dni": "X123"})["customer_identification_document"] == "X123"
+
+
+def test_propagation_bumps_the_version():
+    db = FakeDB([CUSTOMER])
+    asyncio.run(propagate_customer_snapshot(db, "c1"))
+    (query, update), = db.reservations.writes
+    assert query["customer_id"] == "c1"
+    assert {"customer_name": {"$ne": "Ana Pérez"}} in query["$or"]
+    assert update[0] == {"$set": {
+        "customer_name": {"$literal": "Ana Pérez"},
+        "customer_identification_document": {"$literal": "001-0000000-1"},
+    }}
+    assert update[1] == {"$set": VERSION_BUMP}
+
+
+def test_propagation_of_unknown_customer_writes_nothing():
+    db = FakeDB([])
+    assert asyncio.run(propagate_customer_snapshot(db, "c1")) == 0
+    assert db.reservations.writes == []
+
+
+def test_reconcile_only_fills_missing_fields():
+    db = FakeDB([CUSTOMER])
+    asyncio.run(reconcile_customer_snapshots(db))
+    assert db.reservations.writes == [
+        ({"customer_id": "c1", "customer_name": {"$exists": False}},
+         [{"$set": {"customer_name": {"$literal": "Ana Pérez"}}}, {"$set": VERSION_BUMP}]),
+        ({"customer_id": "c1", "customer_identification_document": {"$exists": False}},
+         [{"$set": {"customer_identification_document": {"$literal": "001-0000000-1"}}}, {"$set": VERSION_BUMP}]),
+    ]
+    assert db.migrations.writes[0][0] == {"name": "customer_snapshots"}
@@ -0,0 +1,17 @@
+from backend.database import literal_set, version_filter
+
+
+def test_version_filter_without_version_matches_by_id_only():
+    assert version_filter("r1") == {"id": "r1"}
+
+
+def test_version_filter_first_version_matches_documents_without_field():
+    assert version_filter("r1", 1) == {"id": "r1", "version": {"$in": [1, None]}}
+
+
+def test_version_filter_later_version_is_exact():
+    assert version_filter("r1", 4) == {"id": "r1", "version": 4}
+
+
+def test_literal_set_does_not_evaluate_client_values():
+    assert literal_set({"notes": "$amount_paid"}) == {"$set": {"notes": {"$literal": "$amount_paid"}}}
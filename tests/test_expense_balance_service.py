@@ -0,0 +1,88 @@
+import asyncio
+
+from backend.expense_balance_service import _reconcile_batch, expected_balance
+
+
+class FakeAggregate:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for row in self.rows:
+            yield row
+
+
+class FakeAbonos:
+    def __init__(self, abonos):
+        self.abonos = abonos
+
+    def aggregate(self, pipeline):
+        ids = pipeline[0]["$match"]["expense_id"]["$in"]
+        totals = {}
+        for abono in self.abonos:
+            if abono["expense_id"] in ids:
+                totals[abono["expense_id"]] = totals.get(abono["expense_id"], 0) + abono["amount"]
+        return FakeAggregate([{"_id": k, "total": v} for k, v in totals.items()])
+
+
+class FakeExpenses:
+    def __init__(self):
+        self.writes = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.writes.extend((r._filter, r._doc) for r in requests)
+
+
+class FakeDB:
+    def __init__(self, abonos):
+        self.expense_abonos = FakeAbonos(abonos)
+        self.expenses = FakeExpenses()
+
+
+def test_expected_balance_with_abonos_sets_status():
+    assert expected_balance({"amount": 1000.0}, 1000.0) == {"total_paid": 1000.0, "balance_due": 0.0, "payment_status": "paid"}
+    assert expected_balance({"amount": 1000.0}, 400.0) == {"total_paid": 400.0, "balance_due": 600.0, "payment_status": "pending"}
+
+
+def test_expected_balance_overpaid_is_negative():
+    assert expected_balance({"amount": 1000.0}, 1200.0)["balance_due"] == -200.0
+
+
+def test_expected_balance_without_abonos_keeps_manual_status():
+    assert expected_balance({"amount": 1000.0}, 0) == {"total_paid": 0, "balance_due": 1000.0}
+
+
+def test_reconcile_repairs_only_drifted_expenses_conditionally():
+    db = FakeDB([
+        {"expense_id": "e1", "amount": 300.0},
+        {"expense_id": "e1", "amount": 200.0},
+        {"expense_id": "e2", "amount": 1000.0},
+    ])
+    expenses = [
+        # Al día (diferencia de redondeo)
+        {"id": "e1", "amount": 1000.0, "total_paid": 500.001, "balance_due": 499.999, "payment_status": "pending"},
+        # Abono que no se sumó
+        {"id": "e2", "amount": 1000.0, "total_paid": 0.0, "balance_due": 1000.0, "payment_status": "pending"},
+        # Gasto antiguo sin campos guardados y sin abonos
+        {"id": "e3", "amount": 250.0, "payment_status": "paid"},
+    ]
+    drifted = asyncio.run(_reconcile_batch(db, expenses, repair=True))
+
+    assert [d["id"] for d in drifted] == ["e2", "e3"]
+    assert db.expenses.writes == [
+        ({"id": "e2", "amount": 1000.0, "total_paid": 0.0, "balance_due": 1000.0},
+         {"$set": {"total_paid": 1000.0, "balance_due": 0.0, "payment_status": "paid"}}),
+        ({"id": "e3", "amount": 250.0, "total_paid": None, "balance_due": None},
+         {"$set": {"total_paid": 0, "balance_due": 250.0}}),
+    ]
+
+
+def test_reconcile_check_only_writes_nothing():
+    db = FakeDB([{"expense_id": "e1", "amount": 100.0}])
+    drifted = asyncio.run(_reconcile_batch(db, [{"id": "e1", "amount": 100.0, "total_paid": 0.0, "balance_due": 100.0}], repair=False))
+    assert drifted[0]["stored_total_paid"] == 0.0
+    assert drifted[0]["total_paid"] == 100.0
+    assert db.expenses.writes == []
@@ -0,0 +1,77 @@
+import asyncio
+
+from pymongo.errors import OperationFailure
+
+from backend.index_service import INDEXES, verify_indexes
+
+
+class FakeAggregate:
+    def __init__(self, stats):
+        self.stats = stats
+
+    async def to_list(self, length):
+        if self.stats is None:
+            raise OperationFailure("$indexStats is not allowed in this atlas tier")
+        return self.stats
+
+
+class FakeCollection:
+    def __init__(self, names, stats=None):
+        self.names = names
+        self.stats = stats
+
+    async def list_indexes(self):
+        for name in self.names:
+            yield {"name": name}
+
+    def aggregate(self, pipeline):
+        return FakeAggregate(self.stats)
+
+
+def declared(collection):
+    return [m.document["name"] for m in INDEXES[collection]]
+
+
+def fake_db(overrides):
+    # Por defecto cada colección tiene exactamente sus índices declarados, todos usados
+    return {
+        collection: overrides.get(collection) or FakeCollection(
+            ["_id_", *declared(collection)],
+            [{"name": n, "accesses": {"ops": 1}} for n in ["_id_", *declared(collection)]],
+        )
+        for collection in INDEXES
+    }
+
+
+def test_every_declared_index_has_a_unique_name():
+    for collection, models in INDEXES.items():
+        names = [m.document["name"] for m in models]
+        assert len(names) == len(set(names)), collection
+
+
+def test_clean_database_reports_nothing():
+    report = asyncio.run(verify_indexes(fake_db({})))
+    assert set(report) == set(INDEXES)
+    assert all(r == {"missing": [], "unused": [], "undeclared": []} for r in report.values())
+
+
+def test_reports_missing_unused_and_undeclared_indexes():
+    names = declared("customers")
+    customers = FakeCollection(
+        ["_id_", names[0], "legacy_email"],
+        [{"name": "_id_", "accesses": {"ops": 0}},
+         {"name": names[0], "accesses": {"ops": 0}},
+         {"name": "legacy_email", "accesses": {"ops": 3}}],
+    )
+    report = asyncio.run(verify_indexes(fake_db({"customers": customers})))
+    assert report["customers"] == {
+        "missing": names[1:],
+        "unused": [names[0]],
+        "undeclared": ["legacy_email"],
+    }
+
+
+def test_unused_is_unknown_without_index_stats():
+    villas = FakeCollection(["_id_", *declared("villas")], stats=None)
+    report = asyncio.run(verify_indexes(fake_db({"villas": villas})))
+    assert report["villas"] == {"missing": [], "unused": None, "undeclared": []}
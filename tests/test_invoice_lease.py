@@ -0,0 +1,87 @@
+import asyncio
+
+from backend.invoice_service import INVOICE_START_NUMBER, InvoiceNumberLease, allocate_invoice_numbers
+from tests.fake_db import FakeDB
+
+
+def counter(db):
+    return db.invoice_counter.docs[0]["current_number"]
+
+
+def test_lease_hands_out_its_block_in_order():
+    db = FakeDB()
+    lease = InvoiceNumberLease(5)
+
+    async def run():
+        return [await lease.next_number(db) for _ in range(7)]
+
+    assert asyncio.run(run()) == list(range(INVOICE_START_NUMBER, INVOICE_START_NUMBER + 7))
+    # Dos bloques: el contador solo se tocó dos veces
+    assert counter(db) == INVOICE_START_NUMBER + 10
+
+
+def test_concurrent_requests_share_the_block_without_duplicates():
+    db = FakeDB()
+    lease = InvoiceNumberLease(4)
+
+    async def run():
+        return await asyncio.gather(*(lease.next_number(db) for _ in range(10)))
+
+    numbers = asyncio.run(run())
+    assert sorted(numbers) == list(range(INVOICE_START_NUMBER, INVOICE_START_NUMBER + 10))
+    assert counter(db) == INVOICE_START_NUMBER + 12
+
+
+def test_two_workers_never_overlap():
+    db = FakeDB()
+    first, second = InvoiceNumberLease(3), InvoiceNumberLease(3)
+
+    async def run():
+        return await asyncio.gather(*(lease.next_number(db) for lease in [first, second] * 5))
+
+    numbers = asyncio.run(run())
+    assert len(set(numbers)) == len(numbers)
+
+
+def test_release_returns_unused_numbers_to_the_counter():
+    db = FakeDB()
+    lease = InvoiceNumberLease(10)
+
+    async def run():
+        await lease.next_number(db)
+        await lease.next_number(db)
+        await lease.release(db)
+
+    asyncio.run(run())
+    assert counter(db) == INVOICE_START_NUMBER + 2
+    assert db.invoice_voided.docs == []
+
+
+def test_release_voids_numbers_when_the_counter_moved_on():
+    db = FakeDB()
+    lease = InvoiceNumberLease(4)
+
+    async def run():
+        await lease.next_number(db)
+        await allocate_invoice_numbers(db)  # otro worker tomó un número después del bloque
+        await lease.release(db)
+
+    asyncio.run(run())
+    assert counter(db) == INVOICE_START_NUMBER + 5
+    assert [d["invoice_number"] for d in db.invoice_voided.docs] == [
+        str(n) for n in range(INVOICE_START_NUMBER + 1, INVOICE_START_NUMBER + 4)
+    ]
+    assert {d["reason"] for d in db.invoice_voided.docs} == {"lease_released"}
+
+
+def test_release_of_an_exhausted_block_does_nothing():
+    db = FakeDB()
+    lease = InvoiceNumberLease(1)
+
+    async def run():
+        await lease.next_number(db)
+        await lease.release(db)
+
+    asyncio.run(run())
+    assert counter(db) == INVOICE_START_NUMBER + 1
+    assert db.invoice_voided.docs == []
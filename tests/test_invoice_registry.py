@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from backend.invoice_service import (
+    INVOICE_START_NUMBER, claim_invoice_number, claim_invoice_numbers, claim_next_invoice_numbers,
+    invoice_entry, is_invoice_number_conflict, void_invoice_number, void_invoice_numbers
+)
+from tests.fake_db import FakeDB
+
+
+def abono(doc_id):
+    return invoice_entry("reservation_abono", doc_id, "r1")
+
+
+def test_claimed_number_cannot_be_claimed_again():
+    db = FakeDB()
+    asyncio.run(claim_invoice_number(db, "1700", abono("a1")))
+    with pytest.raises(DuplicateKeyError) as error:
+        asyncio.run(claim_invoice_number(db, "1700", abono("a2")))
+    assert is_invoice_number_conflict(error.value)
+    assert db.invoice_numbers.docs[0]["document_id"] == "a1"
+
+
+def test_bulk_claim_reports_taken_numbers():
+    db = FakeDB()
+    asyncio.run(claim_invoice_number(db, "1701", abono("manual")))
+    taken = asyncio.run(claim_invoice_numbers(db, [("1700", abono("a1")), ("1701", abono("a2")), ("1702", abono("a3"))]))
+    assert taken == {"1701"}
+    assert sorted(d["invoice_number"] for d in db.invoice_numbers.docs) == ["1700", "1701", "1702"]
+
+
+def test_claim_next_skips_numbers_used_manually():
+    db = FakeDB()
+    asyncio.run(claim_invoice_number(db, str(INVOICE_START_NUMBER + 1), abono("manual")))
+    numbers = asyncio.run(claim_next_invoice_numbers(db, [abono("a1"), abono("a2"), abono("a3")]))
+    # La entrada que chocó recibe el primer número del bloque siguiente
+    assert numbers == [str(INVOICE_START_NUMBER), str(INVOICE_START_NUMBER + 3), str(INVOICE_START_NUMBER + 2)]
+    owners = {d["invoice_number"]: d["document_id"] for d in db.invoice_numbers.docs}
+    assert owners[str(INVOICE_START_NUMBER + 1)] == "manual"
+
+
+def test_void_records_each_number_with_its_reason():
+    db = FakeDB()
+    asyncio.run(void_invoice_numbers(db, ["1700", "1701"], "bulk_insert_failed"))
+    asyncio.run(void_invoice_number(db, None, "insert_failed"))
+    assert [(d["invoice_number"], d["reason"]) for d in db.invoice_voided.docs] == [
+        ("1700", "bulk_insert_failed"), ("1701", "bulk_insert_failed")
+    ]
+
+
+def test_void_failure_does_not_hide_the_original_error():
+    db = FakeDB()
+
+    async def fail(*args, **kwargs):
+        raise PyMongoError("connection lost")
+
+    db.invoice_voided.insert_many = fail
+    asyncio.run(void_invoice_number(db, "1700", "insert_failed"))
@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from backend import database
+from backend.invoice_service import (
+    INVOICE_START_NUMBER, allocate_invoice_numbers, insert_with_invoice_number,
+    insert_with_manual_invoice_number, invoice_entry
+)
+from tests.fake_db import FakeClient, FakeDB
+
+
+@pytest.fixture(autouse=True)
+def clear_transaction_support():
+    # Se guarda por id(client) y los clientes falsos de cada prueba pueden reutilizar ids
+    database._transaction_support.clear()
+    yield
+    database._transaction_support.clear()
+
+
+def entry(doc_id="r1"):
+    return invoice_entry("reservation", doc_id, doc_id)
+
+
+def voided(db):
+    return [(d["invoice_number"], d["reason"]) for d in db.invoice_voided.docs]
+
+
+# ---------- allocate_invoice_numbers ----------
+
+def test_first_number_is_the_start_number():
+    db = FakeDB()
+    assert asyncio.run(allocate_invoice_numbers(db)) == INVOICE_START_NUMBER
+    assert asyncio.run(allocate_invoice_numbers(db)) == INVOICE_START_NUMBER + 1
+
+
+def test_blocks_are_consecutive():
+    db = FakeDB()
+    assert asyncio.run(allocate_invoice_numbers(db, 10)) == INVOICE_START_NUMBER
+    assert asyncio.run(allocate_invoice_numbers(db)) == INVOICE_START_NUMBER + 10
+
+
+def test_concurrent_allocations_are_unique_without_gaps():
+    db = FakeDB()
+
+    async def run():
+        return await asyncio.gather(*(allocate_invoice_numbers(db) for _ in range(50)))
+
+    numbers = asyncio.run(run())
+    assert sorted(numbers) == list(range(INVOICE_START_NUMBER, INVOICE_START_NUMBER + 50))
+
+
+# ---------- insert_with_invoice_number ----------
+
+def test_insert_claims_and_stores_the_number():
+    db = FakeDB()
+    doc = {"id": "r1"}
+    number = asyncio.run(insert_with_invoice_number(db, db.reservations, doc, entry()))
+    assert number == str(INVOICE_START_NUMBER)
+    assert db.reservations.docs[0]["invoice_number"] == number
+    assert db.invoice_numbers.docs[0]["document_id"] == "r1"
+
+
+def test_number_used_manually_is_skipped_not_voided():
+    db = FakeDB()
+    db.invoice_numbers.docs.append({"invoice_number": str(INVOICE_START_NUMBER), "document_id": "manual"})
+    number = asyncio.run(insert_with_invoice_number(db, db.reservations, {"id": "r1"}, entry()))
+    assert number == str(INVOICE_START_NUMBER + 1)
+    assert voided(db) == []
+
+
+def test_failed_side_effect_rolls_back_and_voids_the_number():
+    db = FakeDB()
+
+    async def side_effects(invoice_number, session):
+        raise ValueError("owner expense failed")
+
+    with pytest.raises(ValueError):
+        asyncio.run(insert_with_invoice_number(db, db.reservations, {"id": "r1"}, entry(), side_effects=side_effects))
+    assert db.reservations.docs == []
+    assert db.invoice_numbers.docs == []
+    assert voided(db) == [(str(INVOICE_START_NUMBER), "insert_failed")]
+
+
+def test_transient_conflict_retries_with_the_same_number():
+    db = FakeDB(FakeClient(replica_set=True, commit_outcomes=["transient", "ok"]))
+    number = asyncio.run(insert_with_invoice_number(db, db.reservations, {"id": "r1"}, entry()))
+    assert number == str(INVOICE_START_NUMBER)
+    assert len(db.reservations.docs) == 1
+    assert voided(db) == []
+
+
+def test_unknown_commit_result_is_retried():
+    client = FakeClient(replica_set=True, commit_outcomes=["unknown_applied", "ok"])
+    db = FakeDB(client)
+    number = asyncio.run(insert_with_invoice_number(db, db.reservations, {"id": "r1"}, entry()))
+    assert number == str(INVOICE_START_NUMBER)
+    assert client.sessions[0].commits == 2
+    assert len(client.sessions) == 1
+    assert voided(db) == []
+
+
+def test_unknown_commit_that_was_applied_keeps_the_number():
+    client = FakeClient(replica_set=True, commit_outcomes=["unknown_applied"] * database.MAX_COMMIT_ATTEMPTS)
+    db = FakeDB(client)
+    number = asyncio.run(insert_with_invoice_number(db, db.reservations, {"id": "r1"}, entry()))
+    assert number == str(INVOICE_START_NUMBER)
+    assert client.sessions[0].commits == database.MAX_COMMIT_ATTEMPTS
+    assert len(db.reservations.docs) == 1
+    assert voided(db) == []
+
+
+def test_unknown_commit_that_was_lost_voids_the_number():
+    client = FakeClient(replica_set=True, commit_outcomes=["unknown_lost"] * database.MAX_COMMIT_ATTEMPTS)
+    db = FakeDB(client)
+    with pytest.raises(PyMongoError):
+        asyncio.run(insert_with_invoice_number(db, db.reservations, {"id": "r1"}, entry()))
+    assert db.reservations.docs == []
+    assert voided(db) == [(str(INVOICE_START_NUMBER), "insert_failed")]
+
+
+def test_manual_number_with_applied_unknown_commit_succeeds():
+    client = FakeClient(replica_set=True, commit_outcomes=["unknown_applied"] * database.MAX_COMMIT_ATTEMPTS)
+    db = FakeDB(client)
+    asyncio.run(insert_with_manual_invoice_number(db, db.reservations, {"id": "r1"}, "9000", entry()))
+    assert db.reservations.docs[0]["invoice_number"] == "9000"
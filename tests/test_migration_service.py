@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+
+import pytest
+
+from backend.migration_service import migrate_collection_datetimes, parse_datetime_string
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2025-01-15T10:30:00Z", datetime(2025, 1, 15, 10, 30, tzinfo=timezone.utc)),
+    ("2025-01-15T10:30:00+00:00", datetime(2025, 1, 15, 10, 30, tzinfo=timezone.utc)),
+    ("2025-01-15T10:30:00.123456", datetime(2025, 1, 15, 10, 30, 0, 123456, tzinfo=timezone.utc)),
+    ("2025-01-15", datetime(2025, 1, 15, tzinfo=timezone.utc)),
+])
+def test_parse_datetime_string(value, expected):
+    assert parse_datetime_string(value) == expected
+
+
+def test_parse_datetime_string_keeps_offset():
+    parsed = parse_datetime_string("2025-01-15T06:30:00-04:00")
+    assert parsed.utcoffset() == timedelta(hours=-4)
+    assert parsed == datetime(2025, 1, 15, 10, 30, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("value", ["", "15/01/2025", "mañana"])
+def test_parse_datetime_string_invalid(value):
+    assert parse_datetime_string(value) is None
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeResult:
+    def __init__(self, count):
+        self.modified_count = count
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.batches = []
+
+    def find(self, query, projection):
+        field = next(iter(query))
+        return FakeCursor([
+            {"_id": d["_id"], field: d[field]} for d in self.docs if isinstance(d.get(field), str)
+        ])
+
+    async def bulk_write(self, requests, ordered=True):
+        self.batches.append(requests)
+        return FakeResult(len(requests))
+
+
+def test_migrate_collection_converts_only_strings_in_batches():
+    native = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    collection = FakeCollection([
+        {"_id": 1, "payment_date": "2025-01-15T10:30:00Z"},
+        {"_id": 2, "payment_date": native},
+        {"_id": 3, "payment_date": "no es fecha"},
+        {"_id": 4, "payment_date": "2025-02-01T00:00:00"},
+        {"_id": 5, "payment_date": "2025-03-01T00:00:00+00:00"},
+    ])
+    db = {"reservation_abonos": collection}
+
+    converted = asyncio.run(migrate_collection_datetimes(db, "reservation_abonos", ["payment_date"], batch_size=2))
+
+    assert converted == 3
+    assert [len(batch) for batch in collection.batches] == [2, 1]
+    first = collection.batches[0][0]
+    # Condicionado al string leído: si otra escritura lo cambió, no se pisa
+    assert first._filter == {"_id": 1, "payment_date": "2025-01-15T10:30:00Z"}
+    assert first._doc == {"$set": {"payment_date": datetime(2025, 1, 15, 10, 30, tzinfo=timezone.utc)}}
@@ -0,0 +1,173 @@
+from datetime import datetime, timezone
+import asyncio
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from backend.models import Customer
+from backend.pagination import decode_cursor, encode_cursor, keyset_filter, paginated_response
+from backend.serialization import NDJSON_BATCH_SIZE
+
+SORT = [("reservation_date", -1), ("id", -1)]
+
+
+def test_cursor_round_trip_keeps_datetimes():
+    doc = {"reservation_date": datetime(2025, 1, 15, 9, 30, tzinfo=timezone.utc), "id": "abc"}
+    values = decode_cursor(encode_cursor(doc, SORT), SORT)
+    assert values == [doc["reservation_date"], "abc"]
+    assert values[0].tzinfo is not None
+
+
+def test_cursor_with_wrong_length_is_rejected():
+    cursor = encode_cursor({"id": "abc"}, [("id", 1)])
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, SORT)
+    assert error.value.status_code == 400
+
+
+def test_garbage_cursor_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        decode_cursor("no es un cursor", SORT)
+    assert error.value.status_code == 400
+
+
+def test_keyset_filter_descending():
+    date = datetime(2025, 1, 15, tzinfo=timezone.utc)
+    assert keyset_filter({}, SORT, [date, "abc"]) == {"$or": [
+        {"reservation_date": {"$lt": date}},
+        {"reservation_date": date, "id": {"$lt": "abc"}},
+    ]}
+
+
+def test_keyset_filter_ascending_combines_with_query():
+    sort = [("name", 1), ("id", 1)]
+    assert keyset_filter({"status": "confirmed"}, sort, ["Ana", "x"]) == {"$and": [
+        {"status": "confirmed"},
+        {"$or": [{"name": {"$gt": "Ana"}}, {"name": "Ana", "id": {"$gt": "x"}}]},
+    ]}
+
+
+def _raw_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+@pytest.mark.parametrize("value", [
+    {"$date": "x"},
+    {"$date": 1},
+    {"$ne": None},
+    {"$date": "2025-01-15T00:00:00+00:00", "$ne": None},
+    ["abc"],
+])
+def test_cursor_values_must_be_scalars_or_dates(value):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(_raw_cursor([value, "abc"]), SORT)
+    assert error.value.status_code == 400
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = list(docs)
+        self.reads = []
+
+    def sort(self, sort):
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def limit(self, limit):
+        self.docs = self.docs[:limit]
+        return self
+
+    async def to_list(self, length):
+        batch, self.docs = self.docs[:length], self.docs[length:]
+        self.reads.append(len(batch))
+        return batch
+
+    async def close(self):
+        pass
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.cursor = FakeCursor(docs)
+
+    def find(self, query, projection):
+        return self.cursor
+
+    async def estimated_document_count(self):
+        return len(self.cursor.docs)
+
+
+async def _body(response):
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+def test_listing_without_limit_streams_a_json_array_in_batches():
+    docs = [{"id": str(i), "name": f"Cliente {i}"} for i in range(450)]
+    collection = FakeCollection(docs)
+
+    async def run():
+        response = await paginated_response(collection, {}, [("name", 1), ("id", 1)], Customer)
+        return response, await _body(response)
+
+    response, body = asyncio.run(run())
+    assert response.headers["X-Total-Count"] == "450"
+    assert [c["id"] for c in json.loads(body)] == [d["id"] for d in docs]
+    assert max(collection.cursor.reads) == NDJSON_BATCH_SIZE
+
+
+def test_listing_without_limit_empty_is_an_empty_array():
+    async def run():
+        return await _body(await paginated_response(FakeCollection([]), {}, [("name", 1), ("id", 1)], Customer))
+
+    assert json.loads(asyncio.run(run())) == []
+
+
+def _value_matches(value, condition):
+    if not isinstance(condition, dict):
+        return value == condition
+    if "$ne" in condition:
+        return value != condition["$ne"]
+    # Como en Mongo, $gt/$lt no comparan null con fechas
+    if value is None:
+        return False
+    return value > condition["$gt"] if "$gt" in condition else value < condition["$lt"]
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_matches(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(_matches(doc, q) for q in condition):
+                return False
+        elif not _value_matches(doc.get(key), condition):
+            return False
+    return True
+
+
+@pytest.mark.parametrize("direction", [1, -1])
+def test_keyset_walks_over_missing_values(direction):
+    day = lambda d: datetime(2025, 1, d, tzinfo=timezone.utc)
+    docs = [
+        {"id": "a", "check_in": None}, {"id": "b", "check_in": day(3)}, {"id": "c", "check_in": None},
+        {"id": "d", "check_in": day(1)}, {"id": "e", "check_in": day(3)}, {"id": "f", "check_in": None},
+    ]
+    sort = [("check_in", direction), ("id", direction)]
+    # Mongo ordena null antes que cualquier fecha
+    key = lambda d: (d["check_in"] is not None, d["check_in"] or day(1), d["id"])
+    ordered = sorted(docs, key=key, reverse=direction == -1)
+
+    seen, values = [], None
+    while True:
+        query = keyset_filter({}, sort, values, ["check_in"]) if values else {}
+        page = [d for d in ordered if _matches(d, query)][:2]
+        if not page:
+            break
+        seen.extend(page)
+        values = [page[-1]["check_in"], page[-1]["id"]]
+    assert seen == ordered
@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+
+from backend.recurring_expense_service import (
+    MAX_CATCH_UP_PERIODS, build_instance, covered_through, due_date, group_series, pending_periods
+)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+TEMPLATE = {
+    "id": "t1",
+    "description": "Luz",
+    "category": "compromiso",
+    "currency": "DOP",
+    "amount": 3500.0,
+    "expense_type": "fijo",
+    "expense_date": utc(2025, 11, 15),
+    "created_at": utc(2025, 11, 15),
+    "created_by": "u1",
+    "is_recurring": True,
+    "payment_reminder_day": 31,
+}
+
+
+def test_pending_periods_crosses_year():
+    assert pending_periods((2025, 11), (2026, 2)) == [(2025, 12), (2026, 1), (2026, 2)]
+
+
+def test_pending_periods_nothing_when_up_to_date():
+    assert pending_periods((2026, 2), (2026, 2)) == []
+
+
+def test_pending_periods_catch_up_is_capped():
+    periods = pending_periods((2020, 1), (2026, 2))
+    assert len(periods) == MAX_CATCH_UP_PERIODS
+    assert periods[-1] == (2026, 2)
+
+
+def test_due_date_clamps_to_month_length():
+    assert due_date(TEMPLATE, (2026, 2)) == utc(2026, 2, 28)
+    assert due_date(TEMPLATE, (2028, 2)) == utc(2028, 2, 29)
+    assert due_date(TEMPLATE, (2026, 4)) == utc(2026, 4, 30)
+    assert due_date(TEMPLATE, (2026, 1)) == utc(2026, 1, 31)
+
+
+def test_due_date_defaults_to_template_day():
+    assert due_date({**TEMPLATE, "payment_reminder_day": None}, (2026, 2)) == utc(2026, 2, 15)
+
+
+def test_covered_through_uses_latest_of_date_entry_and_generated():
+    assert covered_through(TEMPLATE) == (2025, 11)
+    assert covered_through({**TEMPLATE, "created_at": utc(2026, 1, 3)}) == (2026, 1)
+    assert covered_through({**TEMPLATE, "recurring_generated_through": "2026-03"}) == (2026, 3)
+
+
+def test_manual_reentries_form_one_series():
+    march = {**TEMPLATE, "id": "t2", "description": " luz ", "expense_date": utc(2026, 3, 15), "created_at": utc(2026, 3, 16)}
+    other = {**TEMPLATE, "id": "t3", "description": "Internet"}
+    grouped = {latest["id"]: (last, ids) for latest, last, ids in group_series([TEMPLATE, march, other])}
+    assert grouped == {"t2": ((2026, 3), ["t1", "t2"]), "t3": ((2025, 11), ["t3"])}
+
+
+def test_build_instance_is_pending_copy_for_the_period():
+    instance = build_instance(TEMPLATE, (2026, 2))
+    assert instance["expense_date"] == utc(2026, 2, 28)
+    assert instance["recurring_template_id"] == "t1"
+    assert instance["recurring_period"] == "2026-02"
+    assert instance["payment_status"] == "pending"
+    assert instance["is_recurring"] is False
+    assert instance["balance_due"] == 3500.0
+    assert instance["id"] != "t1"
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+import asyncio
+
+from pymongo.errors import DuplicateKeyError
+
+from backend.scheduler import Job, acquire_job, run_job
+
+NOW = datetime(2025, 1, 15, 12, 0, tzinfo=timezone.utc)
+
+
+class FakeJobs:
+    """scheduled_jobs with its unique index on name"""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        await asyncio.sleep(0)
+        doc = self.docs.get(query["name"])
+        if doc is None:
+            self.docs[query["name"]] = doc = {"name": query["name"], **update["$set"]}
+            return doc
+        if doc["next_run_at"] <= query["next_run_at"]["$lte"]:
+            doc.update(update["$set"])
+            return doc
+        # Sin coincidencia el upsert intenta insertar otro documento con el mismo nombre
+        raise DuplicateKeyError("E11000 duplicate key error name", 11000)
+
+    async def update_one(self, query, update, upsert=False):
+        self.docs.setdefault(query["name"], {"name": query["name"]}).update(update["$set"])
+
+
+class FakeRuns:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+class FakeDB:
+    def __init__(self):
+        self.scheduled_jobs = FakeJobs()
+        self.job_runs = FakeRuns()
+
+
+def counting_job(calls):
+    async def run(db):
+        calls.append(1)
+        return {"completed": len(calls)}
+    return Job("complete_past_reservations", timedelta(hours=1), run)
+
+
+def test_job_is_taken_once_per_interval():
+    db = FakeDB()
+    job = counting_job([])
+
+    assert asyncio.run(acquire_job(db, job, NOW))
+    assert not asyncio.run(acquire_job(db, job, NOW + timedelta(minutes=30)))
+    assert asyncio.run(acquire_job(db, job, NOW + timedelta(hours=1)))
+    assert db.scheduled_jobs.docs[job.name]["next_run_at"] == NOW + timedelta(hours=2)
+
+
+def test_only_one_worker_runs_a_due_job():
+    db = FakeDB()
+    calls = []
+    job = counting_job(calls)
+
+    async def run():
+        return await asyncio.gather(*(run_job(db, job) for _ in range(5)))
+
+    runs = asyncio.run(run())
+    assert len(calls) == 1
+    assert sum(r is not None for r in runs) == 1
+    assert len(db.job_runs.docs) == 1
+
+
+def test_successful_run_is_recorded():
+    db = FakeDB()
+    run = asyncio.run(run_job(db, counting_job([])))
+    assert run["status"] == "success"
+    assert run["result"] == {"completed": 1}
+    assert db.job_runs.docs == [run]
+    assert db.scheduled_jobs.docs["complete_past_reservations"]["last_status"] == "success"
+
+
+def test_any_job_exception_is_recorded_as_a_failed_run():
+    db = FakeDB()
+
+    async def broken(db):
+        raise KeyError("expense_date")
+
+    run = asyncio.run(run_job(db, Job("materialize_recurring_expenses", timedelta(hours=6), broken)))
+    assert run["status"] == "error"
+    assert run["error"] == "KeyError: 'expense_date'"
+    assert "result" not in run
+    job = db.scheduled_jobs.docs["materialize_recurring_expenses"]
+    assert job["last_status"] == "error"
+    assert job["last_result"] is None
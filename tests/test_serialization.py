@@ -0,0 +1,133 @@
+from datetime import datetime, timezone
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from backend import serialization
+from backend.models import Customer
+from backend.serialization import (
+    NDJSON_MEDIA_TYPE, dumps, fast_json_response, fields_projection, model_defaults, model_projection,
+    ndjson_response, parse_fields, wants_ndjson
+)
+
+DOC = {
+    "id": "c1",
+    "name": "Ana Pérez",
+    "phone": "809-555-0000",
+    "created_at": datetime(2025, 1, 15, 10, 30, tzinfo=timezone.utc),
+    "created_by": "u1",
+}
+
+
+def same_instant(doc):
+    # Pydantic escribe "Z" y la ruta rápida "+00:00": el mismo instante para el frontend
+    return {**doc, "created_at": datetime.fromisoformat(doc["created_at"])}
+
+
+def test_model_projection_has_exactly_the_model_fields():
+    projection = dict(model_projection(Customer))
+    assert projection.pop("_id") == 0
+    assert set(projection) == set(Customer.model_fields)
+
+
+def test_model_defaults_skip_required_and_factory_fields():
+    defaults = model_defaults(Customer)
+    assert defaults["email"] is None
+    assert "name" not in defaults
+    assert "id" not in defaults
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_dumps_matches_the_validated_model(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(serialization, "orjson", None)
+    expected = json.loads(Customer(**DOC).model_dump_json(include=set(DOC)))
+    assert same_instant(json.loads(dumps(DOC))) == same_instant(expected)
+
+
+def test_fast_response_fills_defaults_of_older_documents():
+    response = fast_json_response([DOC], Customer)
+    body = json.loads(response.body)
+    assert [same_instant(doc) for doc in body] == [same_instant(json.loads(Customer(**DOC).model_dump_json()))]
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = list(docs)
+        self.reads = []
+        self.closed = False
+
+    async def to_list(self, length):
+        batch, self.docs = self.docs[:length], self.docs[length:]
+        self.reads.append(len(batch))
+        return batch
+
+    async def close(self):
+        self.closed = True
+
+
+def customers(n):
+    return [{**DOC, "id": f"c{i}"} for i in range(n)]
+
+
+def test_ndjson_streams_one_document_per_line_in_batches():
+    cursor = FakeCursor(customers(5))
+    response = ndjson_response(cursor, Customer, batch_size=2)
+
+    async def run():
+        return [chunk async for chunk in response.body_iterator]
+
+    chunks = asyncio.run(run())
+    assert response.media_type == NDJSON_MEDIA_TYPE
+    assert len(chunks) == 3
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [f"c{i}" for i in range(5)]
+    assert cursor.reads == [2, 2, 1, 0]
+    assert cursor.closed
+
+
+def test_ndjson_closes_the_cursor_when_the_client_disconnects():
+    cursor = FakeCursor(customers(10))
+    response = ndjson_response(cursor, Customer, batch_size=2)
+
+    async def run():
+        body = response.body_iterator
+        await body.__anext__()
+        await body.aclose()
+
+    asyncio.run(run())
+    assert cursor.closed
+    assert cursor.reads == [2]
+
+
+def test_wants_ndjson():
+    assert wants_ndjson("application/x-ndjson")
+    assert wants_ndjson("application/x-ndjson, application/json;q=0.9")
+    assert not wants_ndjson("application/json")
+    assert not wants_ndjson(None)
+
+
+def test_parse_fields_keeps_order_and_drops_duplicates():
+    assert parse_fields(" name, phone,name,,", Customer) == ["name", "phone"]
+    assert parse_fields(None, Customer) is None
+    assert parse_fields("", Customer) is None
+
+
+def test_parse_fields_rejects_unknown_fields():
+    with pytest.raises(HTTPException) as error:
+        parse_fields("name,password_hash", Customer)
+    assert error.value.status_code == 400
+    assert "password_hash" in error.value.detail
+
+
+def test_fields_projection_adds_internal_fields():
+    assert fields_projection(Customer, None) == model_projection(Customer)
+    assert fields_projection(Customer, ["name"], ["id"]) == {"_id": 0, "name": 1, "id": 1}
+
+
+def test_fast_response_sends_only_requested_fields():
+    older = {"id": "c1", "name": "Ana Pérez"}  # sin email: se completa con el valor por defecto
+    body = json.loads(fast_json_response([older], Customer, ["name", "email"]).body)
+    assert body == [{"name": "Ana Pérez", "email": None}]